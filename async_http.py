@@ -0,0 +1,37 @@
+import importlib.util
+
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 100
+KEEPALIVE_EXPIRY = 60
+REQUEST_TIMEOUT = 600
+
+_http_client = None
+
+
+def get_http_client():
+    """返回异步LLM客户端共享的 httpx 连接池
+
+    连接池保持长连接，安装了 h2 时启用 HTTP/2。需在事件循环内调用。
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        import httpx
+
+        _http_client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=10),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """关闭共享连接池，下次调用 get_http_client 时重新创建"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
@@ -0,0 +1,159 @@
+import json
+import os
+import time
+
+from metrics import recorder as metrics
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+STATE_NAME = "batch_state.json"
+
+# 批处理任务结束后不会再变化的状态
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_request_line(custom_id, model, messages, **options):
+    """构造批处理输入文件中的一行请求，options 为请求体中的其他参数（如 response_format）"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": messages,
+            **options,
+        },
+    }
+
+
+class BatchFileWriter:
+    """逐行写入批处理输入文件，避免所有请求（含图片）同时留在内存中"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: 输入文件路径（JSON lines 格式）
+        """
+        self.path = path
+        self.count = 0
+        output_dir = os.path.dirname(path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+
+    def write(self, line):
+        """写入一行由 build_request_line 构造的请求"""
+        self._file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.count += 1
+
+
+def submit_batch(client, input_path, description=None):
+    """上传批处理输入文件并创建批处理任务
+
+    Args:
+        client: OpenAI 客户端
+        input_path: 输入文件路径
+        description: 写入任务元数据的说明文字
+
+    Returns:
+        Batch: 新建的批处理任务
+    """
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+
+    options = {}
+    if description:
+        options["metadata"] = {"description": description}
+    return client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        **options
+    )
+
+
+def wait_for_batch(client, batch_id, poll_interval=0):
+    """查询批处理任务状态
+
+    Args:
+        client: OpenAI 客户端
+        batch_id: 批处理任务ID
+        poll_interval: 大于0时每隔该秒数查询一次，直到任务结束；否则只查询一次
+
+    Returns:
+        Batch: 最近一次查询到的批处理任务
+    """
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in FINAL_STATUSES or poll_interval <= 0:
+            return batch
+
+        print(f"批处理任务 {batch_id} 状态: {batch.status}，{poll_interval:g} 秒后再次查询")
+        time.sleep(poll_interval)
+
+
+def read_batch_results(client, batch):
+    """下载批处理任务的输出文件和错误文件，并记录成功请求的 token 用量
+
+    Returns:
+        tuple: (custom_id 到回复内容的字典, custom_id 到错误信息的字典)
+    """
+    results = {}
+    errors = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+
+        content = client.files.content(file_id).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            custom_id = record["custom_id"]
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                error = record.get("error") or response.get("body", {}).get("error") or {}
+                message = error.get("message") if isinstance(error, dict) else str(error)
+                errors[custom_id] = message or f"HTTP {response.get('status_code')}"
+                continue
+            body = response["body"]
+            metrics.record_usage(body.get("usage"), body.get("model"))
+            results[custom_id] = body["choices"][0]["message"]["content"]
+
+    return results, errors
+
+
+def state_path(output_dir):
+    """返回批处理状态文件路径"""
+    return os.path.join(output_dir, STATE_NAME)
+
+
+def load_state(output_dir):
+    """读取输出目录中未收取的批处理任务状态，不存在时返回None"""
+    path = state_path(output_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(output_dir, state):
+    """保存批处理任务状态，先写临时文件再替换，避免中断时留下不完整的状态"""
+    path = state_path(output_dir)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def clear_state(output_dir):
+    """删除批处理任务状态文件"""
+    path = state_path(output_dir)
+    if os.path.exists(path):
+        os.remove(path)
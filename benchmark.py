@@ -0,0 +1,291 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from metrics import percentile, STAGE_ORDER
+from mock_server import create_server, MOCK_OCR_TEXT
+
+# 合成扫描页的尺寸（A4，100 DPI）
+PAGE_SIZE = (827, 1169)
+
+# 导入 main 时不应加载的模块，它们只在实际渲染、请求或生成文档时才导入
+DEFERRED_MODULES = ("openai", "httpx", "dotenv", "pdf2image", "PyPDF2", "PIL", "docx", "markdown", "bs4", "watchdog")
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "loaded": [name for name in %r if name in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+
+def make_scanned_page(page_num, seed=0):
+    """生成一张模拟扫描效果的作文页：手写风格的文字行、轻微倾斜、灰底和噪点
+
+    Args:
+        page_num: 页码，用于在页面上标注并改变随机种子
+        seed: 随机种子，相同参数生成的页面相同
+
+    Returns:
+        Image: 灰度页面图片
+    """
+    rng = random.Random(seed * 10007 + page_num)
+    page = Image.new("L", PAGE_SIZE, 235 + rng.randint(0, 15))
+    draw = ImageDraw.Draw(page)
+
+    # 默认字体不含中文，只使用英文行
+    lines = [line for line in MOCK_OCR_TEXT.splitlines() if line.isascii()] * 8
+    y = 80
+    draw.text((80, y), f"Page {page_num}", fill=40)
+    for line in lines:
+        y += 30 + rng.randint(0, 8)
+        if y > PAGE_SIZE[1] - 100:
+            break
+        x = 70 + rng.randint(-10, 10)
+        draw.text((x, y), line[:90], fill=rng.randint(20, 70))
+        # 横线模拟作文纸
+        draw.line((60, y + 22, PAGE_SIZE[0] - 60, y + 22), fill=200)
+
+    noise = Image.effect_noise(PAGE_SIZE, 18)
+    page = Image.blend(page, noise, 0.12)
+    page = page.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, fillcolor=240)
+    return page.filter(ImageFilter.GaussianBlur(0.6))
+
+
+def make_scanned_pdf(path, page_count, seed=0):
+    """生成包含 page_count 页合成扫描页的PDF"""
+    pages = [make_scanned_page(page_num, seed) for page_num in range(1, page_count + 1)]
+    pages[0].save(path, "PDF", resolution=100, save_all=True, append_images=pages[1:])
+    return path
+
+
+def run_with_peak_rss(command, env, log_path):
+    """运行子进程，返回 (退出码, 峰值内存MB)
+
+    峰值内存通过 os.wait4 获取，不支持的平台（如Windows）上为 None。
+    """
+    with open(log_path, "w", encoding="utf-8") as log:
+        process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if not hasattr(os, "wait4"):
+            return process.wait(), None
+
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # Linux 上 ru_maxrss 的单位为KB，macOS 上为字节
+        peak_rss = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / 1024 / 1024
+        return process.returncode, peak_rss
+
+
+def read_stage_stats(metrics_path):
+    """从 metrics.jsonl 中汇总各阶段的 p50 和 p95 耗时以及重试次数
+
+    Returns:
+        tuple: (阶段名称到 {"p50", "p95"} 的映射, 重试次数, 生成Word文档的页面组数)
+    """
+    durations = {}
+    retries = 0
+    if not os.path.exists(metrics_path):
+        return {}, retries, 0
+
+    with open(metrics_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("event") == "stage":
+                durations.setdefault(record["stage"], []).append(record["seconds"])
+            elif record.get("event") == "retry":
+                retries += 1
+
+    stats = {}
+    for stage in STAGE_ORDER:
+        if stage in durations:
+            values = sorted(durations[stage])
+            stats[stage] = {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95)}
+    return stats, retries, len(durations.get("docx", []))
+
+
+def run_setting(pdf_paths, page_count, setting, base_url, work_dir, extra_args):
+    """以一组参数运行一次 main.py，返回测量结果"""
+    dpi, pages_per_image, concurrency = setting
+    name = f"dpi{dpi}_pages{pages_per_image}_c{concurrency}"
+    output_dir = os.path.join(work_dir, name)
+    metrics_path = os.path.join(output_dir, "metrics.jsonl")
+    os.makedirs(output_dir, exist_ok=True)
+
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+        *pdf_paths,
+        "-o", output_dir,
+        "--dpi", str(dpi),
+        "--pages", str(pages_per_image),
+        "--ocr-concurrency", str(concurrency),
+        "--score-concurrency", str(concurrency),
+        "--no-cache",
+        "--metrics", metrics_path,
+        *extra_args,
+    ]
+    env = dict(os.environ)
+    env.update({
+        "OPENROUTER_API_KEY": "benchmark",
+        "OPENROUTER_BASE_URL": base_url,
+        "SILICONFLOW_API_KEY": "benchmark",
+        "SILICONFLOW_BASE_URL": base_url,
+    })
+
+    start = time.perf_counter()
+    returncode, peak_rss = run_with_peak_rss(command, env, os.path.join(output_dir, "run.log"))
+    seconds = time.perf_counter() - start
+    stages, retries, completed_groups = read_stage_stats(metrics_path)
+    total_pages = page_count * len(pdf_paths)
+    total_groups = math.ceil(page_count / pages_per_image) * len(pdf_paths)
+    return {
+        "name": name,
+        "dpi": dpi,
+        "pages": pages_per_image,
+        "concurrency": concurrency,
+        "returncode": returncode,
+        "seconds": seconds,
+        "pages_per_second": total_pages / seconds if seconds > 0 else 0.0,
+        "peak_rss_mb": peak_rss,
+        "retries": retries,
+        "completed_groups": completed_groups,
+        "total_groups": total_groups,
+        "stages": stages,
+    }
+
+
+def measure_startup(runs=5):
+    """测量启动耗时
+
+    在新进程中分别测量 import main 和 main.py --help 的耗时，各运行 runs 次取中位数，
+    并检查 import main 后是否已加载 DEFERRED_MODULES 中的模块。
+    检查时不设置API密钥，确认启动阶段不依赖环境变量。
+
+    Returns:
+        dict: {"import_ms", "help_ms", "loaded"}
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    env = {key: value for key, value in os.environ.items() if not key.endswith(("_API_KEY", "_BASE_URL"))}
+    import_times, help_times, loaded = [], [], set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT], cwd=script_dir, env=env,
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        import_times.append(result["seconds"])
+        loaded.update(result["loaded"])
+
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(script_dir, "main.py"), "--help"], cwd=script_dir, env=env,
+            stdout=subprocess.DEVNULL, check=True,
+        )
+        help_times.append(time.perf_counter() - start)
+
+    return {
+        "import_ms": percentile(sorted(import_times), 0.5) * 1000,
+        "help_ms": percentile(sorted(help_times), 0.5) * 1000,
+        "loaded": sorted(loaded),
+    }
+
+
+def check_startup(budget_ms, runs=5):
+    """检查启动耗时是否在预算内，返回是否通过"""
+    result = measure_startup(runs)
+    print(f"import main: {result['import_ms']:.0f} ms，main.py --help: {result['help_ms']:.0f} ms（{runs} 次中位数）")
+    passed = True
+    if result["loaded"]:
+        print(f"启动时加载了应延迟导入的模块: {', '.join(result['loaded'])}")
+        passed = False
+    if result["import_ms"] > budget_ms:
+        print(f"import main 耗时超过预算 {budget_ms:g} ms")
+        passed = False
+    if passed:
+        print(f"启动耗时在预算 {budget_ms:g} ms 内")
+    return passed
+
+
+def print_report(results):
+    """打印各组参数的吞吐量、阶段耗时和峰值内存"""
+    print(f"\n{'参数':<24}{'页/秒':>8}{'耗时':>8}{'内存MB':>9}{'重试':>6}  各阶段 p50/p95（秒）")
+    for result in results:
+        rss = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] is not None else "-"
+        stages = "  ".join(
+            f"{stage} {stats['p50']:.2f}/{stats['p95']:.2f}" for stage, stats in result["stages"].items()
+        )
+        status = ""
+        if result["returncode"] != 0:
+            status = f"  （退出码 {result['returncode']}）"
+        elif result["completed_groups"] < result["total_groups"]:
+            status = f"  （仅完成 {result['completed_groups']}/{result['total_groups']} 组，吞吐量不可比）"
+        print(
+            f"{result['name']:<24}{result['pages_per_second']:>8.2f}{result['seconds']:>8.1f}"
+            f"{rss:>9}{result['retries']:>6}  {stages}{status}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试：使用合成扫描PDF和本地替身服务测量流水线吞吐量")
+    parser.add_argument("--docs", type=int, default=1, help="合成PDF的数量（默认为1）")
+    parser.add_argument("--page-count", type=int, default=8, help="每个合成PDF的页数（默认为8）")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[150, 300], help="测试的DPI取值（默认为150 300）")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1], help="测试的每张图片页数取值（默认为1）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[2, 8], help="测试的OCR和评分并发数取值（默认为2 8）")
+    parser.add_argument("--latency", type=float, default=0.5, help="替身服务每次请求的平均延迟秒数（默认为0.5）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟上下浮动的秒数（默认为0.2）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="替身服务返回429或500错误的概率（默认为0）")
+    parser.add_argument("--work-dir", help="合成PDF和运行结果的保存目录（默认为临时目录，结束后删除）")
+    parser.add_argument("--report", help="将测量结果以JSON格式保存到该文件")
+    parser.add_argument("--seed", type=int, default=0, help="生成合成PDF的随机种子（默认为0）")
+    parser.add_argument("--startup-budget", type=float, metavar="MS",
+                        help="只检查启动耗时：import main 超过该毫秒数或加载了重量级模块时以非零状态退出")
+    # 未识别的参数原样传给 main.py，例如 --async 或 --send-format jpeg
+    args, extra_args = parser.parse_known_args()
+
+    if args.startup_budget is not None:
+        sys.exit(0 if check_startup(args.startup_budget) else 1)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+
+        print(f"正在生成 {args.docs} 个 {args.page_count} 页的合成PDF...")
+        pdf_paths = [
+            make_scanned_pdf(os.path.join(work_dir, f"synthetic_{index}.pdf"), args.page_count, args.seed + index)
+            for index in range(1, args.docs + 1)
+        ]
+
+        server = create_server("127.0.0.1", 0, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+        print(f"替身服务: {base_url}（延迟 {args.latency:g}±{args.jitter:g} 秒，错误率 {args.error_rate:g}）")
+
+        results = []
+        try:
+            for setting in itertools.product(args.dpi, args.pages, args.concurrency):
+                print(f"正在运行: DPI {setting[0]}，每张图片 {setting[1]} 页，并发 {setting[2]}")
+                results.append(run_setting(pdf_paths, args.page_count, setting, base_url, work_dir, extra_args))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    print_report(results)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n测量结果已保存至: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import io
+import os
+import threading
+
+from score_and_comment import CORRECTIONS_SECTION, format_correction
+
+FONT_NAME = '宋体'
+
+# 需要统一字体的样式及其字号（None 表示保留模板字号）
+STYLE_SIZES = {
+    "Normal": 12,
+    "Heading 1": 16,
+    "Heading 2": 14,
+    "Heading 3": 13,
+    "List Bullet": None,
+    "List Number": None,
+    "Table Grid": None,
+}
+
+_template = None
+_style_ids = {}
+_template_lock = threading.Lock()
+
+
+def set_style_font(style, size=None):
+    """将样式的中西文字体设为宋体，并去掉模板中的主题字体和颜色
+
+    Args:
+        style: 文档样式
+        size: 字号（磅），为None时不修改
+    """
+    from docx.oxml.ns import qn
+    from docx.shared import Pt, RGBColor
+
+    style.font.name = FONT_NAME
+    rfonts = style.element.get_or_add_rPr().get_or_add_rFonts()
+    rfonts.set(qn('w:eastAsia'), FONT_NAME)
+    # 标题样式默认使用主题字体，主题字体优先于 w:ascii 等属性，需要删除
+    for theme_attr in ('w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme', 'w:cstheme'):
+        rfonts.attrib.pop(qn(theme_attr), None)
+    if size is not None:
+        style.font.size = Pt(size)
+    if style.name.startswith("Heading"):
+        style.font.color.rgb = RGBColor(0, 0, 0)
+
+
+def build_template():
+    """创建预先设置好样式的空白文档
+
+    样式只在这里设置一次，之后每个文档从模板复制，写入文字时不再逐段修改字体。
+
+    Returns:
+        tuple: (文档的字节内容, 样式名称到样式ID的映射)
+    """
+    from docx import Document
+
+    doc = Document()
+    for name, size in STYLE_SIZES.items():
+        set_style_font(doc.styles[name], size)
+    style_ids = {name: doc.styles[name].style_id for name in STYLE_SIZES}
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue(), style_ids
+
+
+def new_document():
+    """从模板创建新文档，模板在第一次调用时生成并在进程内复用"""
+    from docx import Document
+
+    global _template, _style_ids
+    with _template_lock:
+        if _template is None:
+            _template, _style_ids = build_template()
+    return Document(io.BytesIO(_template))
+
+
+def add_paragraph(doc, text="", style=None, bold=False):
+    """添加段落
+
+    样式直接写入预先查好的样式ID，避免 python-docx 每次按名称在样式表中查找。
+    """
+    para = doc.add_paragraph()
+    if style is not None:
+        para._p.style = _style_ids[style]
+    if text:
+        para.add_run(text).bold = bold or None
+    return para
+
+
+def write_score_docx(score, output_docx_path, text_content=None):
+    """根据结构化评分结果直接生成Word文档，不经过markdown解析
+
+    Args:
+        score: 结构化评分结果，见 score_and_comment.parse_score_result
+        output_docx_path: 输出的Word文档路径
+        text_content: 作文原文，提供时附在文档末尾
+
+    Returns:
+        str: 输出的Word文档路径
+    """
+    output_dir = os.path.dirname(output_docx_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    doc = new_document()
+
+    add_paragraph(doc, "一：评分环节", "Heading 3")
+    table = doc.add_table(rows=1, cols=3)
+    table._tbl.tblPr.style = _style_ids["Table Grid"]
+    for cell, title in zip(table.rows[0].cells, ("维度", "得分", "满分")):
+        cell.paragraphs[0].add_run(title).bold = True
+    for item in score["scores"]:
+        cells = table.add_row().cells
+        cells[0].text = item["dimension"]
+        cells[1].text = f"{item['score']:g}"
+        cells[2].text = f"{item['max']:g}"
+    cells = table.add_row().cells
+    cells[0].paragraphs[0].add_run("总得分").bold = True
+    cells[1].paragraphs[0].add_run(f"{score['total']:g}").bold = True
+    cells[2].text = f"{sum(item['max'] for item in score['scores']):g}"
+
+    add_paragraph(doc, "二：详细点评", "Heading 3")
+    corrections_written = False
+    for index, section in enumerate(score["comments"], 1):
+        add_paragraph(doc, f"{index}. {section['title']}", bold=True)
+        for item in section["items"] or ["无"]:
+            add_paragraph(doc, item, "List Bullet")
+        if section["title"] == CORRECTIONS_SECTION and score["corrections"]:
+            for correction in score["corrections"]:
+                add_paragraph(doc, format_correction(correction), "List Bullet")
+            corrections_written = True
+
+    if score["corrections"] and not corrections_written:
+        add_paragraph(doc, CORRECTIONS_SECTION, bold=True)
+        for correction in score["corrections"]:
+            add_paragraph(doc, format_correction(correction), "List Bullet")
+
+    if text_content:
+        add_paragraph(doc, "原文", "Heading 3")
+        for line in text_content.strip().splitlines():
+            if line.strip():
+                add_paragraph(doc, line.strip())
+
+    doc.save(output_docx_path)
+    print(f"文档已保存，共 {len(doc.paragraphs)} 个段落")
+    return output_docx_path
@@ -0,0 +1,162 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from page_triage import EDGE_MARGIN, ink_mask, load_thumbnail
+
+# 检测作业起始页的方式：layout 只在缩略图上判断版面，name 另外识别页眉区域中的姓名
+BOUNDARY_MODES = ("layout", "name")
+# 检测时的渲染DPI，足以识别页眉中的姓名
+DETECT_DPI = 100
+# 页眉区域占页面高度的比例，姓名写在这一区域
+HEADER_FRACTION = 0.15
+# 笔迹像素不少于该比例的行视为有字
+ROW_INK = 0.01
+# 页眉中第一行笔迹的宽度不超过可书写宽度的该比例时视为姓名或标题，正文行通常写满整行
+NAME_LINE_WIDTH = 0.5
+DEFAULT_MAX_GROUP_PAGES = 4
+
+NAME_PROMPT = """
+        - 这是一页手写作业最上方区域的图片。如果有手写的中文姓名，只输出该姓名；没有姓名时只输出"无"，不要输出其他任何内容。
+        """
+
+# 模型表示没有姓名时可能的回答
+NO_NAME_REPLIES = ("", "无", "没有", "none", "null")
+
+
+def header_first_line(mask, header_fraction=HEADER_FRACTION, margin=EDGE_MARGIN):
+    """返回页眉区域内第一行笔迹的宽度占可书写宽度的比例
+
+    行和列的笔迹密度都由 BOX 缩放求得，不逐像素遍历。
+
+    Args:
+        mask: ink_mask 返回的笔迹掩码
+        header_fraction: 页眉区域占页面高度的比例
+        margin: 忽略的四周边缘比例
+
+    Returns:
+        float: 第一行笔迹的宽度比例，页眉区域没有笔迹时返回 None
+    """
+    from PIL import Image
+
+    dx = int(mask.width * margin)
+    dy = int(mask.height * margin)
+    header = mask.crop((dx, dy, mask.width - dx, dy + max(1, int(mask.height * header_fraction))))
+    rows = list(header.resize((1, header.height), Image.BOX).getdata())
+
+    cutoff = ROW_INK * 255
+    top = next((y for y, value in enumerate(rows) if value >= cutoff), None)
+    if top is None:
+        return None
+    bottom = top
+    while bottom + 1 < len(rows) and rows[bottom + 1] >= cutoff:
+        bottom += 1
+
+    line = header.crop((0, top, header.width, bottom + 1))
+    columns = [x for x, value in enumerate(line.resize((line.width, 1), Image.BOX).getdata()) if value]
+    return (columns[-1] - columns[0] + 1) / header.width
+
+
+def parse_name_reply(reply):
+    """从姓名识别的回答中取出姓名，没有姓名时返回 None"""
+    lines = [line.strip().strip('"“”。.') for line in (reply or "").splitlines() if line.strip()]
+    name = lines[0] if lines else ""
+    return None if name.lower() in NO_NAME_REPLIES else name
+
+
+class BoundaryDetector:
+    """在OCR前找出每份作业的起始页，将连续的页面分为长短不一的页面组
+
+    页面先以低DPI渲染：页眉区域第一行笔迹较短（姓名或标题）的页面视为新作业的开始，
+    页眉空白或第一行写满整行的页面视为上一份作业的续页。name 模式下，页眉区域有笔迹的页面
+    再将页眉裁剪后发送OCR识别姓名，识别出姓名的页面视为新作业的开始。
+    """
+
+    def __init__(self, mode="layout", max_group_pages=DEFAULT_MAX_GROUP_PAGES, dpi=DETECT_DPI, ocr_cache=None, workers=1):
+        """
+        Args:
+            mode: 检测方式，见 BOUNDARY_MODES
+            max_group_pages: 每份作业的最大页数，超出时从下一页起另成一组
+            dpi: 检测时的渲染DPI
+            ocr_cache: name 模式下姓名识别结果的缓存，为None时不使用缓存
+            workers: name 模式下同时发送的姓名识别请求数
+        """
+        if mode not in BOUNDARY_MODES:
+            raise ValueError(f"不支持的作业分组方式: {mode}")
+        self.mode = mode
+        self.max_group_pages = max(1, max_group_pages)
+        self.dpi = dpi
+        self.ocr_cache = ocr_cache
+        self.workers = max(1, workers)
+
+    def read_header(self, path):
+        """读取检测用的页面图片，返回 (页眉第一行宽度比例, 页眉区域的PNG字节)，同时删除临时文件
+
+        页眉区域没有笔迹时宽度比例为 None；只有 name 模式才裁剪页眉。
+        """
+        from PIL import Image
+
+        try:
+            with open(path, "rb") as f:
+                image_bytes = f.read()
+        finally:
+            os.remove(path)
+
+        width = header_first_line(ink_mask(load_thumbnail(image_bytes)))
+        if self.mode != "name" or width is None:
+            return width, None
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            header = image.crop((0, 0, image.width, int(image.height * (HEADER_FRACTION + EDGE_MARGIN))))
+            buffer = io.BytesIO()
+            header.convert("L").save(buffer, "PNG")
+        return width, buffer.getvalue()
+
+    def is_start(self, page_number, width, header_bytes):
+        """判断页面是否为一份作业的开始
+
+        name 模式下识别失败时退回按版面判断。
+        """
+        if self.mode == "name" and header_bytes is not None:
+            from pdf_to_txt import analyze_image_bytes
+
+            try:
+                return bool(parse_name_reply(analyze_image_bytes(header_bytes, NAME_PROMPT, self.ocr_cache, "image/png")))
+            except Exception as e:
+                print(f"第 {page_number} 页姓名识别失败，按版面判断: {e}")
+        return width is not None and width <= NAME_LINE_WIDTH
+
+    def detect(self, renderer, first_page, last_page):
+        """找出页码范围内每份作业的起始页
+
+        Args:
+            renderer: PdfRenderer 实例
+            first_page: 起始页码，总是作为第一份作业的开始
+            last_page: 结束页码
+
+        Returns:
+            dict: 各页面组的起始页码到该组页数的映射，按页码顺序排列
+        """
+        from metrics import timed
+
+        headers = {}
+        for chunk_first in range(first_page, last_page + 1, renderer.chunk_size):
+            chunk_last = min(chunk_first + renderer.chunk_size - 1, last_page)
+            paths = renderer.render_range(chunk_first, chunk_last, dpi=self.dpi)
+            with timed("boundary", first_page=chunk_first, pages=len(paths)):
+                for page_number, path in enumerate(paths, chunk_first):
+                    headers[page_number] = self.read_header(path)
+
+        # 页眉有字的页面在 name 模式下都要识别姓名，第一行写满整行的页面也可能在行首写了姓名
+        candidates = [page_number for page_number in headers if page_number != first_page]
+        with ThreadPoolExecutor(self.workers) as executor:
+            decisions = executor.map(lambda page_number: self.is_start(page_number, *headers[page_number]), candidates)
+            starts = {page_number for page_number, is_start in zip(candidates, decisions) if is_start}
+        starts.add(first_page)
+
+        groups = {}
+        group_first = first_page
+        for page_number in range(first_page + 1, last_page + 2):
+            if page_number in starts or page_number > last_page or page_number - group_first >= self.max_group_pages:
+                groups[group_first] = page_number - group_first
+                group_first = page_number
+        return groups
@@ -0,0 +1,118 @@
+import io
+import math
+
+# 发送格式对应的 PIL 保存格式、MIME 类型和文件扩展名
+SEND_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+
+MIN_QUALITY = 40
+MARGIN_THRESHOLD = 200
+MARGIN_PADDING = 20
+
+
+class ImagePreprocessor:
+    """在发送给视觉模型前压缩页面图片
+
+    依次裁掉空白边距、转为灰度、按像素预算缩小，再以 JPEG/WebP 编码；
+    编码后仍超过字节上限时，先逐步降低质量，再继续缩小尺寸。
+    """
+
+    def __init__(self, fmt="jpeg", quality=85, max_pixels=None, max_bytes=None, grayscale=False, crop_margins=False):
+        """
+        Args:
+            fmt: 发送格式，png、jpeg 或 webp
+            quality: JPEG/WebP 编码质量（1-100）
+            max_pixels: 图片像素总数上限，None 表示不限制
+            max_bytes: 编码后字节数上限，None 表示不限制
+            grayscale: 是否转为灰度图
+            crop_margins: 是否裁掉四周的空白边距
+        """
+        if fmt not in SEND_FORMATS:
+            raise ValueError(f"不支持的发送格式: {fmt}")
+
+        self.fmt = fmt
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.max_bytes = max_bytes
+        self.grayscale = grayscale
+        self.crop_margins = crop_margins
+
+    @property
+    def mime_type(self):
+        return SEND_FORMATS[self.fmt][1]
+
+    @property
+    def extension(self):
+        return SEND_FORMATS[self.fmt][2]
+
+    def process(self, image):
+        """压缩图片
+
+        Args:
+            image: PIL图片
+
+        Returns:
+            bytes: 编码后的图片
+        """
+        if self.crop_margins:
+            image = crop_blank_margins(image)
+
+        image = image.convert("L") if self.grayscale else image.convert("RGB")
+
+        if self.max_pixels:
+            image = limit_pixels(image, self.max_pixels)
+
+        quality = self.quality
+        data = self._encode(image, quality)
+        while self.max_bytes and len(data) > self.max_bytes:
+            if self.fmt != "png" and quality > MIN_QUALITY:
+                quality = max(MIN_QUALITY, quality - 10)
+            else:
+                from PIL import Image
+
+                image = image.resize((max(1, int(image.width * 0.8)), max(1, int(image.height * 0.8))), Image.LANCZOS)
+            data = self._encode(image, quality)
+
+        return data
+
+    def _encode(self, image, quality):
+        buffer = io.BytesIO()
+        pil_format = SEND_FORMATS[self.fmt][0]
+        if pil_format == "PNG":
+            image.save(buffer, format=pil_format, optimize=True)
+        else:
+            image.save(buffer, format=pil_format, quality=quality)
+        return buffer.getvalue()
+
+
+def crop_blank_margins(image, threshold=MARGIN_THRESHOLD, padding=MARGIN_PADDING):
+    """裁掉图片四周接近白色的边距，保留少量留白"""
+    from PIL import ImageOps
+
+    mask = ImageOps.invert(image.convert("L")).point(lambda value: 255 if value > 255 - threshold else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - padding),
+        max(0, top - padding),
+        min(image.width, right + padding),
+        min(image.height, bottom + padding),
+    ))
+
+
+def limit_pixels(image, max_pixels):
+    """按比例缩小图片，使像素总数不超过 max_pixels"""
+    pixels = image.width * image.height
+    if pixels <= max_pixels:
+        return image
+
+    from PIL import Image
+
+    scale = math.sqrt(max_pixels / pixels)
+    return image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
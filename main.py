@@ -1,10 +1,465 @@
 import os
 import argparse
-from pdf_to_img import pdf_to_image
-from pdf_to_txt import analyze_image, save_to_file, extract_chinese_name
-from PyPDF2 import PdfReader
-from score_and_comment import score_and_comment
+import asyncio
+import contextlib
+import copy
+import glob
+import json
+import threading
+from pdf_to_img import PdfRenderer, GROUP_MODES, DEFAULT_GRID_PIXELS, IMAGE_FORMATS
+from pdf_to_txt import analyze_image_bytes, analyze_image_bytes_async, read_image_bytes, guess_mime_type, image_size
+from pdf_to_txt import save_to_file, extract_chinese_name, structured_prompt, parse_ocr_result, format_ocr_text
+from pdf_to_txt import ocr_cache_key, build_batch_request as build_ocr_batch_request
+from pdf_to_txt import get_api_config as get_ocr_api_config, get_client as get_ocr_client, rate_limiter as ocr_rate_limiter
+from score_and_comment import score_and_comment, score_and_comment_async, score_and_comment_batch, read_text_file
+from score_and_comment import save_to_markdown, score_cache_key, build_batch_request as build_score_batch_request
+from score_and_comment import get_api_config as get_score_api_config, get_client as get_score_client, rate_limiter as score_rate_limiter
+from score_and_comment import score_and_comment_structured, score_and_comment_structured_async
+from score_and_comment import save_structured_result, load_score_json
+from async_http import close_http_client
+from streaming import partial_path, remove_partial
 from md_to_doxc import convert_md_to_docx
+from docx_writer import write_score_docx
+from pipeline import AsyncBatcher, PagePipeline, Stage
+from image_prep import ImagePreprocessor, SEND_FORMATS
+from page_triage import PageTriage, load_thumbnail, THUMBNAIL_SIZE, DEFAULT_BLANK_INK, DEFAULT_DUPLICATE_SIMILARITY
+from essay_boundaries import BoundaryDetector, BOUNDARY_MODES, DEFAULT_MAX_GROUP_PAGES
+from cache import ResultCache, DEFAULT_CACHE_DIR
+from manifest import JobManifest, STAGE_ARTIFACTS
+from watch import FolderWatcher, file_digest, move_to_dir
+from metrics import recorder as metrics, timed, with_job_context
+from pricing import load_prices
+from batch_api import BatchFileWriter, FINAL_STATUSES, submit_batch, wait_for_batch, read_batch_results
+from batch_api import load_state as load_batch_state, save_state as save_batch_state, clear_state as clear_batch_state
+
+# 默认OCR提示文本
+DEFAULT_OCR_PROMPT = """
+        请分析这张图片中的手写文字内容:
+        - 因为是批改的作业，英文会有错，原文输出即可,无需解释性的语言，
+        - 如果识别出文字是已经被黑色笔画划掉的，则不输出对应的单词，
+        - 如果为红色笔画，则忽略笔画，此笔画为批注内容，可以当作不存在红色笔画，
+        - 在最上方会有手写的中文，这是手写文字的姓名，请识别后，放入输出内容中的第一行，其他识别内容从第二行开始输出。        
+        """
+
+
+def make_page_job(renderer, page_number, rendered_paths=None, output_dir='output', save_pdf=False, prompt=None, pages_per_image=1, ocr_cache=None, score_cache=None, keep_image=True, preprocessor=None, stream=False, structured=False, structured_score=False, page_triage=None, full_render=None):
+    """创建一个页面处理任务
+
+    Args:
+        renderer: PdfRenderer 实例
+        page_number: 需要处理的页码（从1开始）
+        rendered_paths: iter_groups 返回的渲染块或已渲染的图片路径，在渲染阶段取出，为None时单独渲染该页面组
+        output_dir: 输出目录
+        save_pdf: 是否保存单页PDF
+        prompt: OCR识别提示文本，如果为None则使用默认提示
+        pages_per_image: 每张图片包含的PDF页数
+        ocr_cache: OCR结果缓存，为None时不使用缓存
+        score_cache: 评分结果缓存，为None时不使用缓存
+        keep_image: 是否将页面图片保存到输出目录
+        preprocessor: 发送前压缩图片的 ImagePreprocessor，为None时发送原始渲染结果
+        stream: 是否以流式方式请求OCR和评分，接收过程中实时写入 .part 文件
+        structured: 是否要求OCR以JSON结构返回姓名、正文和置信度
+        structured_score: 是否要求评分以JSON结构返回，并据此直接生成Word文档
+        page_triage: OCR前检测空白页和重复页的 PageTriage，为None时所有页面都发送OCR
+        full_render: 两遍渲染的设置 {"dpi", "min_confidence", "min_chars"}；提供时渲染器以低DPI渲染，
+            OCR置信度或识别字数过低时再以 dpi 重新渲染并识别，为None时只识别一次
+
+    Returns:
+        dict: 任务字典，各处理阶段会在其中写入结果
+    """
+    prompt = prompt if prompt is not None else DEFAULT_OCR_PROMPT
+    return {
+        "renderer": renderer,
+        "pdf_path": renderer.pdf_path,
+        "page_number": page_number,
+        "base_name": f"{renderer.base_filename}_page_{page_number}",
+        "rendered_paths": rendered_paths,
+        "output_dir": output_dir,
+        "save_pdf": save_pdf,
+        "prompt": structured_prompt(prompt) if structured else prompt,
+        "pages_per_image": pages_per_image,
+        "ocr_cache": ocr_cache,
+        "score_cache": score_cache,
+        "keep_image": keep_image,
+        "preprocessor": preprocessor,
+        "stream": stream,
+        "structured": structured,
+        "structured_score": structured_score,
+        "page_triage": page_triage,
+        "full_render": full_render,
+    }
+
+
+def describe_pages(job):
+    """返回任务对应页码范围的描述文字"""
+    page_number = job["page_number"]
+    if job["pages_per_image"] > 1:
+        return f"第 {page_number} 至 {page_number + job['pages_per_image'] - 1} 页"
+    return f"第 {page_number} 页"
+
+
+def render_stage(job):
+    """步骤1：将PDF转换为图片"""
+    print(f"正在处理{describe_pages(job)}...")
+    img_result = job["renderer"].save_group(
+        job["page_number"],
+        job.pop("rendered_paths"),
+        job["output_dir"],
+        job["save_pdf"],
+        job["pages_per_image"],
+        job["keep_image"],
+        job["preprocessor"],
+        thumbnail_size=THUMBNAIL_SIZE if job["page_triage"] is not None else None
+    )
+    job["image_bytes"] = img_result["image_bytes"]
+    job["thumbnail"] = img_result.get("thumbnail")
+    job["mime_type"] = img_result["mime_type"]
+    job["image_path"] = img_result.get("image_path")
+    job["page_pdf_path"] = img_result.get("pdf_path")
+    if job["image_path"]:
+        paths = job["image_path"] if isinstance(job["image_path"], list) else [job["image_path"]]
+        print(f"图片已保存至: {', '.join(paths)}")
+    return job
+
+
+def triage_stage(job):
+    """步骤1.5：在缩略图上检测空白页，空白页面组不再进行OCR、评分和生成文档
+
+    与先前页面特征相似的页面组（--detect-similar）只打印提示，仍照常处理。
+    """
+    page_triage = job["page_triage"]
+    if page_triage is None or "ocr" in job.get("skip_stages", ()):
+        return job
+
+    with timed("triage"):
+        # 渲染阶段已生成缩略图时直接使用；上传的图片和断点续跑时从图片字节解码
+        image_bytes = job.get("image_bytes")
+        thumbnail = job.pop("thumbnail", None)
+        if thumbnail is None:
+            if image_bytes is None:
+                image_bytes, _ = read_saved_image(job["image_path"])
+            thumbnail = load_thumbnail(image_bytes)
+        result = page_triage.classify(job["pdf_path"], job["page_number"], thumbnail)
+    metrics.record_triage(result)
+    job["triage"] = result
+
+    if result["decision"] != "blank":
+        if "similar_to" in result:
+            print(
+                f"{describe_pages(job)}与第 {result['similar_to']} 页相似（相似度 {result['similarity']:.2f}），"
+                f"可能是重新扫描的页面，仍进行OCR"
+            )
+        return job
+
+    print(f"{describe_pages(job)}为空白页（墨迹 {result['ink']:.2%}），跳过OCR")
+
+    job.pop("image_bytes", None)
+    job["skip_stages"] = set(job.get("skip_stages", ())) | {"ocr", "score", "docx"}
+    job["success"] = True
+    return job
+
+
+def take_image(job):
+    """取出任务中的图片字节交给OCR，之后不再保留在内存中
+
+    断点续跑跳过渲染阶段时，从已保存的图片文件读取。
+    """
+    image_bytes = job.pop("image_bytes", None)
+    if image_bytes is None:
+        return read_saved_image(job["image_path"])
+    return image_bytes, job["mime_type"]
+
+
+def read_saved_image(image_path):
+    """读取已保存的页面图片，返回 (图片字节, MIME类型)
+
+    --group-mode parts 时 image_path 为各页图片路径的列表，返回的图片字节也是列表。
+    """
+    if isinstance(image_path, list):
+        return [read_image_bytes(path) for path in image_path], guess_mime_type(image_path[0])
+    return read_image_bytes(image_path), guess_mime_type(image_path)
+
+
+def over_budget(job):
+    """超出 --max-cost / --max-tokens 时跳过尚未发出任何模型请求的页面组
+
+    within_budget 只在任务进入流水线时检查，已渲染、排队等待OCR的页面组在第一次请求前再检查一次。
+    已经开始请求的页面组不再检查，继续完成评分和生成文档。跳过的页面组不计为失败，
+    调整预算后可用 --resume 继续。
+
+    Returns:
+        bool: 是否已超出预算
+    """
+    reason = metrics.budget_exceeded()
+    if not reason:
+        return False
+    print(f"{describe_pages(job)}: {reason}，未发送请求，跳过")
+    job.pop("image_bytes", None)
+    job["budget_skipped"] = reason
+    job["skip_stages"] = set(job.get("skip_stages", ())) | {"ocr", "score", "docx"}
+    return True
+
+
+def ocr_stage(job):
+    """步骤2、3：OCR识别图片内容并保存到文本文件
+
+    两遍渲染模式下低DPI图片的识别结果不可靠时，以全分辨率重新渲染后再识别一次。
+    """
+    if over_budget(job):
+        return job
+    print(f"正在对{describe_pages(job)}进行OCR识别...")
+    image_bytes, mime_type = take_image(job)
+    record_bytes_sent(job, image_bytes)
+    ocr_text = analyze_image_bytes(
+        image_bytes, job["prompt"], job["ocr_cache"], mime_type, ocr_stream_path(job), job["structured"]
+    )
+
+    if full_render_reason(job, ocr_text):
+        image_bytes, mime_type = render_full(job)
+        record_bytes_sent(job, image_bytes)
+        ocr_text = analyze_image_bytes(
+            image_bytes, job["prompt"], job["ocr_cache"], mime_type, ocr_stream_path(job), job["structured"]
+        )
+    return save_ocr_result(job, ocr_text)
+
+
+async def ocr_stage_async(job):
+    """ocr_stage 的异步版本"""
+    if over_budget(job):
+        return job
+    print(f"正在对{describe_pages(job)}进行OCR识别...")
+    image_bytes, mime_type = take_image(job)
+    record_bytes_sent(job, image_bytes)
+    ocr_text = await analyze_image_bytes_async(
+        image_bytes, job["prompt"], job["ocr_cache"], mime_type, ocr_stream_path(job), job["structured"]
+    )
+
+    if full_render_reason(job, ocr_text):
+        image_bytes, mime_type = await asyncio.to_thread(render_full, job)
+        record_bytes_sent(job, image_bytes)
+        ocr_text = await analyze_image_bytes_async(
+            image_bytes, job["prompt"], job["ocr_cache"], mime_type, ocr_stream_path(job), job["structured"]
+        )
+    return save_ocr_result(job, ocr_text)
+
+
+def full_render_reason(job, ocr_text):
+    """判断低DPI图片的OCR结果是否需要以全分辨率重新识别
+
+    结构化OCR返回的置信度低于 min_confidence，或姓名以外的识别字数（不计空白）
+    少于 min_chars 时需要重新识别。已经是全分辨率或未启用两遍渲染时返回None。
+
+    Returns:
+        str: 需要重新识别的原因，不需要时为None
+    """
+    full_render = job["full_render"]
+    if full_render is None or job.get("rendered_dpi") == full_render["dpi"]:
+        return None
+
+    fields = parse_ocr_result(ocr_text)
+    reason = None
+    if fields["confidence"] is not None and fields["confidence"] < full_render["min_confidence"]:
+        reason = f"置信度 {fields['confidence']:.2f}"
+    else:
+        chars = len("".join(fields["body"].split()))
+        if chars < full_render["min_chars"]:
+            reason = f"只识别出 {chars} 字"
+    if reason:
+        print(f"{describe_pages(job)}低分辨率识别{reason}，以 {full_render['dpi']} DPI 重新渲染后再次识别")
+        metrics.record_full_render(reason)
+    return reason
+
+
+def render_full(job):
+    """以全分辨率重新渲染页面组，返回 (图片字节, MIME类型)
+
+    保存图片时用全分辨率图片覆盖低分辨率图片。
+    """
+    dpi = job["full_render"]["dpi"]
+    img_result = job["renderer"].save_group(
+        job["page_number"],
+        None,
+        job["output_dir"],
+        False,
+        job["pages_per_image"],
+        job["keep_image"],
+        job["preprocessor"],
+        dpi
+    )
+    job["rendered_dpi"] = dpi
+    if img_result.get("image_path"):
+        job["image_path"] = img_result["image_path"]
+    return img_result["image_bytes"], img_result["mime_type"]
+
+
+def record_bytes_sent(job, image_bytes):
+    """记录发送给OCR模型的图片大小，两遍渲染时累计两次发送的大小"""
+    size = image_size(image_bytes)
+    job["bytes_sent"] = job.get("bytes_sent", 0) + size
+    print(f"{describe_pages(job)}发送图片 {size / 1024:.0f} KB")
+
+
+def text_output_path(job):
+    """返回OCR文本的输出路径"""
+    # 提取中文姓名
+    # chinese_name = extract_chinese_name(ocr_text)
+    # name_suffix = f"_{chinese_name}" if chinese_name else ""
+    # TODO 暂时不加入姓名
+    name_suffix = ""
+    return os.path.join(job["output_dir"], f"{job['base_name']}_text{name_suffix}.txt")
+
+
+def ocr_stream_path(job):
+    """流式模式下返回OCR文本的临时写入路径，否则返回None"""
+    return partial_path(text_output_path(job)) if job["stream"] else None
+
+
+def ocr_fields_path(job):
+    """返回结构化OCR结果（姓名、正文、置信度）的保存路径"""
+    return os.path.join(job["output_dir"], f"{job['base_name']}_ocr.json")
+
+
+def save_ocr_result(job, ocr_text):
+    """保存OCR识别结果到文本文件
+
+    结构化模式下将返回的JSON解析为姓名和正文，文本文件仍以姓名为第一行，
+    姓名、正文和置信度另存为 _ocr.json 供按学生检索。无法解析时按第一行提取姓名。
+    """
+    if job["structured"]:
+        fields = parse_ocr_result(ocr_text)
+        if not fields["structured"]:
+            print(f"{describe_pages(job)}的OCR结果不是有效的JSON，按第一行提取姓名")
+        ocr_text = format_ocr_text(fields)
+        job["student_name"] = fields["name"]
+        with open(ocr_fields_path(job), "w", encoding="utf-8") as f:
+            json.dump(fields, f, ensure_ascii=False, indent=2)
+
+    job["ocr_text"] = ocr_text
+    job["text_path"] = save_to_file(ocr_text, text_output_path(job))
+    remove_partial(ocr_stream_path(job))
+    print(f"文本已保存至: {job['text_path']}")
+    return job
+
+
+def student_name(job):
+    """返回任务的学生姓名：优先使用结构化OCR结果，否则从文本第一行提取"""
+    if job.get("student_name") is not None:
+        return job["student_name"]
+    return extract_chinese_name(job["ocr_text"])
+
+
+def score_output_path(job):
+    """返回评分结果的输出路径"""
+    return os.path.join(job["output_dir"], f"{job['base_name']}_score.md")
+
+
+def score_stage(job):
+    """步骤4：对提取的文本进行评分和点评"""
+    print(f"正在对{describe_pages(job)}进行评分和点评...")
+    score_output_file = score_output_path(job)
+    if job["structured_score"]:
+        job["score"], _ = score_and_comment_structured(
+            job["text_path"], score_output_file, job["score_cache"], stream=job["stream"]
+        )
+    else:
+        score_and_comment(job["text_path"], score_output_file, job["score_cache"], raise_errors=True, stream=job["stream"])
+    job["score_path"] = score_output_file
+    print(f"评分和点评已保存至: {score_output_file}")
+    return job
+
+
+async def score_stage_async(job):
+    """score_stage 的异步版本"""
+    print(f"正在对{describe_pages(job)}进行评分和点评...")
+    score_output_file = score_output_path(job)
+    if job["structured_score"]:
+        job["score"], _ = await score_and_comment_structured_async(
+            job["text_path"], score_output_file, job["score_cache"], stream=job["stream"]
+        )
+    else:
+        await score_and_comment_async(
+            job["text_path"], score_output_file, job["score_cache"], raise_errors=True, stream=job["stream"]
+        )
+    job["score_path"] = score_output_file
+    print(f"评分和点评已保存至: {score_output_file}")
+    return job
+
+
+def score_batch_stage(jobs):
+    """步骤4（批量模式）：将多组页面的文本合并为一次请求进行评分和点评"""
+    print(f"正在批量评分和点评: {', '.join(describe_pages(job) for job in jobs)}...")
+    output_files = [score_output_path(job) for job in jobs]
+    outcomes = score_and_comment_batch(
+        [job["text_path"] for job in jobs],
+        output_files,
+        jobs[0]["score_cache"]
+    )
+
+    for job, output_file, outcome in zip(jobs, output_files, outcomes):
+        if outcome["success"]:
+            job["score_path"] = output_file
+            print(f"评分和点评已保存至: {output_file}")
+        else:
+            job["success"] = False
+            job["error"] = outcome["error"]
+    return jobs
+
+
+def docx_stage(job):
+    """步骤5：生成Word文档
+
+    有结构化评分结果时直接据此生成，否则将MD文档转换为Word文档。
+    """
+    chinese_name = student_name(job)
+    name_suffix = f"_{chinese_name}" if chinese_name else ""
+    docx_output_file = os.path.join(job["output_dir"], f"{job['base_name']}_score{name_suffix}.docx")
+
+    with timed("docx"):
+        if job.get("score"):
+            print(f"正在根据{describe_pages(job)}的结构化评分生成Word文档...")
+            job["docx_path"] = write_score_docx(job["score"], docx_output_file, job.get("ocr_text"))
+        else:
+            print(f"正在将{describe_pages(job)}的MD文档转换为Word文档...")
+            job["docx_path"] = convert_md_to_docx(job["score_path"], docx_output_file)
+    job["success"] = True
+    print(f"Word文档已保存至: {job['docx_path']}")
+    return job
+
+
+PAGE_STAGES = [
+    ("render", render_stage),
+    ("triage", triage_stage),
+    ("ocr", ocr_stage),
+    ("score", score_stage),
+    ("docx", docx_stage),
+]
+
+# 异步模式下渲染和生成Word文档仍在线程中执行
+ASYNC_PAGE_STAGES = [
+    ("render", render_stage),
+    ("triage", triage_stage),
+    ("ocr", ocr_stage_async),
+    ("score", score_stage_async),
+    ("docx", docx_stage),
+]
+
+
+def page_result(job):
+    """将任务字典整理为处理结果字典"""
+    if not job.get("success", False):
+        return {"success": False, "error": job.get("error", ""), "page_number": job["page_number"]}
+
+    # 空白页没有识别结果
+    return {
+        "image_path": job.get("image_path"),
+        "text_path": job.get("text_path"),
+        "score_path": job.get("score_path"),
+        "docx_path": job.get("docx_path"),
+        "pdf_path": job.get("page_pdf_path"),
+        "page_number": job["page_number"],
+        "triage": job.get("triage", {}).get("decision", "ocr"),
+        "success": True
+    }
 
 
 def process_pdf_page(pdf_path, page_number, output_dir='output', dpi=300, fmt='png', save_pdf=False, prompt=None, pages_per_image=1):
@@ -23,111 +478,862 @@ def process_pdf_page(pdf_path, page_number, output_dir='output', dpi=300, fmt='p
     Returns:
         dict: 包含处理结果的字典
     """
-    # 默认OCR提示文本
-    if prompt is None:
-        prompt = """
-        请分析这张图片中的手写文字内容:
-        - 因为是批改的作业，英文会有错，原文输出即可,无需解释性的语言，
-        - 如果识别出文字是已经被黑色笔画划掉的，则不输出对应的单词，
-        - 如果为红色笔画，则忽略笔画，此笔画为批注内容，可以当作不存在红色笔画，
-        - 在最上方会有手写的中文，这是手写文字的姓名，请识别后，放入输出内容中的第一行，其他识别内容从第二行开始输出。        
-        """
-    
     try:
-        # 步骤1：将PDF转换为图片
-        if pages_per_image > 1:
-            print(f"正在处理第 {page_number} 至 {page_number + pages_per_image - 1} 页...")
-        else:
-            print(f"正在处理第 {page_number} 页...")
-        img_result = pdf_to_image(pdf_path, page_number, output_dir, dpi, fmt, save_pdf, pages_per_image)
-        image_path = img_result['image_path']
-        print(f"图片已保存至: {image_path}")
-        
-        # 步骤2：OCR识别图片内容
-        print(f"正在进行OCR识别...")
-        ocr_text = analyze_image(image_path, prompt)
-        
-        # 提取中文姓名
-        # chinese_name = extract_chinese_name(ocr_text)
-        # name_suffix = f"_{chinese_name}" if chinese_name else ""
-        # TODO 暂时不加入姓名
-        name_suffix = ""
-        
-        # 步骤3：保存OCR结果到文本文件
-        base_name = os.path.splitext(os.path.basename(image_path))[0]
-        output_file = os.path.join(output_dir, f"{base_name}_text{name_suffix}.txt")
-        saved_path = save_to_file(ocr_text, output_file)
-        print(f"文本已保存至: {saved_path}")
-        
-        # 步骤4：对提取的文本进行评分和点评
-        print(f"正在进行评分和点评...")
-        score_output_file = os.path.join(output_dir, f"{base_name}_score{name_suffix}.md")
-        score_result = score_and_comment(saved_path, score_output_file)
-        print(f"评分和点评已保存至: {score_output_file}")
-        
-        # 步骤5：将MD文档转换为Word文档
-        chinese_name = extract_chinese_name(ocr_text)
-        name_suffix = f"_{chinese_name}" if chinese_name else ""
-
-        print(f"正在将MD文档转换为Word文档...")
-        docx_output_file = os.path.join(output_dir, f"{base_name}_score{name_suffix}.docx")
-        docx_path = convert_md_to_docx(score_output_file, docx_output_file)
-        print(f"Word文档已保存至: {docx_path}")
-        
-        return {
-            "image_path": image_path,
-            "text_path": saved_path,
-            "score_path": score_output_file,
-            "docx_path": docx_path,
-            "pdf_path": img_result.get("pdf_path"),
-            "success": True
-        }
-    
+        with PdfRenderer(pdf_path, dpi, fmt, work_dir=output_dir) as renderer:
+            job = make_page_job(renderer, page_number, None, output_dir, save_pdf, prompt, pages_per_image)
+            for _, stage_func in PAGE_STAGES:
+                job = stage_func(job)
+        return page_result(job)
+
     except Exception as e:
         print(f"处理第 {page_number} 页时出错: {e}")
         return {"success": False, "error": str(e), "page_number": page_number}
 
 
-def get_pdf_page_count(pdf_path):
-    """
-    获取PDF文件的总页数
-    
+def resume_job(job, stages_to_run, artifacts):
+    """跳过已完成的阶段，并从清单中恢复这些阶段的产物"""
+    job["skip_stages"] = {stage for stage, _ in STAGE_ARTIFACTS if stage not in stages_to_run}
+    job.update(artifacts)
+
+    if "ocr" in job["skip_stages"]:
+        job["ocr_text"] = read_text_file(job["text_path"])
+        if job["structured"] and os.path.exists(ocr_fields_path(job)):
+            with open(ocr_fields_path(job), "r", encoding="utf-8") as f:
+                job["student_name"] = json.load(f).get("name", "")
+    if "score" in job["skip_stages"] and job["structured_score"] and job.get("score_path"):
+        job["score"] = load_score_json(job["score_path"])
+    if not stages_to_run:
+        job["success"] = True
+        print(f"{describe_pages(job)}已处理完成，跳过")
+    return job
+
+
+def build_pipeline(args, manifest=None, listener=None):
+    """根据命令行参数创建页面处理流水线
+
     Args:
-        pdf_path: PDF文件路径
-    
-    Returns:
-        int: PDF文件的总页数
+        args: 命令行参数
+        manifest: 提供时每个阶段的结果写入该任务清单
+        listener: 未提供 manifest 时使用的阶段监听函数，参数同 PagePipeline 的 listener
+    """
+    workers = {
+        "render": args.render_workers,
+        "triage": args.render_workers,
+        "ocr": args.ocr_concurrency,
+        "score": args.score_concurrency,
+        "docx": args.docx_workers,
+    }
+    stages = []
+    for name, func in PAGE_STAGES:
+        if name == "score" and args.score_batch > 1:
+            stages.append(Stage(name, score_batch_stage, args.score_concurrency, args.score_batch, args.batch_wait))
+        else:
+            stages.append(Stage(name, with_job_context(func), workers[name]))
+    if manifest is not None:
+        listener = manifest.record
+    return PagePipeline(stages, queue_size=args.queue_size, listener=listener)
+
+
+def group_size(args, page_num):
+    """返回以 page_num 开始的页面组的页数，自动分组时为检测结果，否则为 --pages"""
+    if args.group_sizes:
+        return args.group_sizes.get(page_num, args.pages)
+    return args.pages
+
+
+def new_page_job(renderer, args, page_num, rendered_paths=None):
+    """按命令行参数创建页面处理任务"""
+    return make_page_job(
+        renderer,
+        page_num,
+        rendered_paths,
+        args.output,
+        args.save_pdf,
+        args.prompt,
+        group_size(args, page_num),
+        args.ocr_cache,
+        args.score_cache,
+        args.keep_images,
+        args.preprocessor,
+        args.stream,
+        args.structured_ocr,
+        args.structured_score,
+        args.page_triage,
+        args.full_render
+    )
+
+
+def iter_page_jobs(renderer, args, page_numbers, manifest=None):
+    """生成页面处理任务
+
+    提供 manifest 时根据清单跳过已完成的阶段，只有需要重新渲染的页面组才交给渲染器。
     """
+    render_pages = []
+    for page_num in page_numbers:
+        if manifest is None:
+            render_pages.append(page_num)
+            continue
+
+        stages_to_run, artifacts = manifest.plan_stages(renderer.pdf_path, page_num, group_size(args, page_num))
+        if "render" in stages_to_run:
+            render_pages.append(page_num)
+        else:
+            yield resume_job(new_page_job(renderer, args, page_num), stages_to_run, artifacts)
+
+    for page_num, rendered_paths in renderer.iter_groups(render_pages, args.pages, args.group_sizes):
+        yield new_page_job(renderer, args, page_num, rendered_paths)
+
+
+def iter_document_jobs(documents, manifest=None):
+    """依次生成所有文档的页面处理任务，使各文档的页面组进入同一个任务队列"""
+    for document in documents:
+        yield from iter_page_jobs(document["renderer"], document["args"], document["page_numbers"], manifest)
+
+
+def within_budget(jobs):
+    """依次返回 jobs 中的任务，超出 --max-cost / --max-tokens 后停止返回新的任务
+
+    已交给流水线的页面组不受影响，会继续完成。
+    """
+    # 先检查预算再取下一个任务，避免超出预算后仍渲染新的页面
+    jobs = iter(jobs)
+    while True:
+        reason = metrics.budget_exceeded()
+        if reason:
+            print(f"\n{reason}，不再处理新的页面")
+            return
+        job = next(jobs, None)
+        if job is None:
+            return
+        yield job
+
+
+def job_id(job):
+    """返回任务在所有文档中的唯一标识"""
+    return job["pdf_path"], job["page_number"]
+
+
+def run_pipeline(pipeline, documents, manifest=None):
+    """通过流水线处理所有文档的页面组，返回按文档和页码排序的任务列表"""
+    jobs = within_budget(iter_document_jobs(documents, manifest))
+    finished = pipeline.run(jobs)
+    return report_failures(finished)
+
+
+def report_failures(finished):
+    """打印失败任务的错误信息，返回按文档和页码排序的任务列表"""
+    for job in finished:
+        if not job.get("success", False):
+            print(
+                f"处理 {os.path.basename(job['pdf_path'])} 第 {job['page_number']} 页时出错"
+                f"（{job.get('failed_stage')}）: {job.get('error')}"
+            )
+    return sorted(finished, key=job_id)
+
+
+async def run_job_async(job, limits, manifest, batchers=None):
+    """依次执行任务的各个阶段，每个阶段的并发数由对应的信号量限制
+
+    batchers 中列出的阶段改为交给 AsyncBatcher 凑批处理。
+    """
+    batchers = batchers or {}
+    for name, stage_func in ASYNC_PAGE_STAGES:
+        if name in job.get("skip_stages", ()):
+            continue
+        stage_func = with_job_context(stage_func)
+
+        try:
+            if name in batchers:
+                job = await batchers[name].submit(job)
+            else:
+                async with limits[name]:
+                    if asyncio.iscoroutinefunction(stage_func):
+                        job = await stage_func(job)
+                    else:
+                        job = await asyncio.to_thread(stage_func, job)
+        except Exception as e:
+            job["success"] = False
+            job["error"] = str(e)
+            job["failed_stage"] = name
+            manifest.record(name, job, str(e))
+            return job
+
+        if job.get("success") is False:
+            job["failed_stage"] = name
+            manifest.record(name, job, job.get("error", ""))
+            return job
+
+        manifest.record(name, job)
+    return job
+
+
+async def run_pipeline_async(documents, args, manifest, resume=False):
+    """以 asyncio 方式处理所有文档的页面组，返回按文档和页码排序的任务列表
+
+    同时处理的页面组数量不超过 --max-in-flight，各阶段的并发数与线程流水线的参数一致。
+    """
+    limits = {
+        "render": asyncio.Semaphore(args.render_workers),
+        "triage": asyncio.Semaphore(args.render_workers),
+        "ocr": asyncio.Semaphore(args.ocr_concurrency),
+        "score": asyncio.Semaphore(args.score_concurrency),
+        "docx": asyncio.Semaphore(args.docx_workers),
+    }
+    batchers = {}
+    if args.score_batch > 1:
+        async def score_batch(batch):
+            async with limits["score"]:
+                return await asyncio.to_thread(score_batch_stage, batch)
+
+        batchers["score"] = AsyncBatcher(score_batch, args.score_batch, args.batch_wait)
+
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    jobs = within_budget(iter_document_jobs(documents, manifest if resume else None))
+    tasks = []
+
     try:
-        pdf_reader = PdfReader(pdf_path)
-        return len(pdf_reader.pages)
-    except Exception as e:
-        raise ValueError(f"无法读取PDF文件: {e}")
+        while True:
+            await in_flight.acquire()
+            # 渲染在生成任务时进行，放到线程中避免阻塞事件循环
+            job = await asyncio.to_thread(next, jobs, None)
+            if job is None:
+                in_flight.release()
+                break
 
+            task = asyncio.create_task(run_job_async(job, limits, manifest, batchers))
+            task.add_done_callback(lambda _: in_flight.release())
+            tasks.append(task)
 
-def main():
-    # 创建命令行参数解析器
-    parser = argparse.ArgumentParser(description="PDF OCR处理工具")
-    parser.add_argument("pdf_path", help="PDF文件路径")
+        finished = await asyncio.gather(*tasks)
+    finally:
+        await close_http_client()
+
+    return report_failures(finished)
+
+
+# 批处理模式分两个阶段提交：先OCR识别，收取文本后再提交评分
+BATCH_PHASES = {
+    "ocr": ("OCR识别", get_ocr_client),
+    "score": ("评分点评", get_score_client),
+}
+
+
+def batch_input_path(args, phase):
+    """返回批处理输入文件路径"""
+    return os.path.join(args.output, f"batch_{phase}_input.jsonl")
+
+
+def start_batch_phase(args, phase, input_path, requests, pages, failed_pages, resume):
+    """提交一个阶段的批处理任务，并保存收取结果所需的状态"""
+    label, get_client = BATCH_PHASES[phase]
+    batch = submit_batch(get_client(), input_path, f"{label} {os.path.basename(args.pdf_path)}")
+    save_batch_state(args.output, {
+        "phase": phase,
+        "batch_id": batch.id,
+        "pdf_path": os.path.abspath(args.pdf_path),
+        "pages_per_image": args.pages,
+        "pages": pages,
+        "failed_pages": failed_pages,
+        "resume": resume,
+        "requests": requests,
+    })
+    print(f"已提交{label}批处理任务 {batch.id}，共 {len(requests)} 个请求，稍后使用 --batch-collect 收取结果")
+
+
+def write_ocr_batch(renderer, args, page_numbers, manifest):
+    """渲染需要OCR的页面组，将OCR请求逐行写入批处理输入文件
+
+    缓存命中的页面组直接保存识别结果，不进入批处理。
+
+    Returns:
+        tuple: (custom_id 到请求信息的字典, 参与后续阶段的页码列表)
+    """
+    requests = {}
+    pages = []
+    with BatchFileWriter(batch_input_path(args, "ocr")) as writer:
+        for job in iter_page_jobs(renderer, args, page_numbers, manifest if args.resume else None):
+            pages.append(job["page_number"])
+            skip_stages = job.get("skip_stages", ())
+            if "ocr" in skip_stages:
+                continue
+            if "render" not in skip_stages:
+                job = render_stage(job)
+                manifest.record("render", job)
+
+            image_bytes, mime_type = take_image(job)
+            cache_key = None
+            if job["ocr_cache"] is not None:
+                cache_key = ocr_cache_key(job["ocr_cache"], image_bytes, job["prompt"])
+                cached = job["ocr_cache"].get(cache_key)
+                if cached is not None:
+                    save_ocr_result(job, cached)
+                    manifest.record("ocr", job)
+                    continue
+
+            custom_id = f"ocr-{job['page_number']}"
+            writer.write(build_ocr_batch_request(custom_id, image_bytes, job["prompt"], mime_type, job["structured"]))
+            requests[custom_id] = {"page_number": job["page_number"], "cache_key": cache_key}
+
+    return requests, sorted(pages)
+
+
+def write_score_batch(renderer, args, pages, manifest, resume):
+    """将已完成OCR的页面组的评分请求写入批处理输入文件
+
+    缓存命中的页面组直接保存评分结果；续跑时已有有效评分结果的页面组不再评分。
+
+    Returns:
+        dict: custom_id 到请求信息的字典
+    """
+    requests = {}
+    with BatchFileWriter(batch_input_path(args, "score")) as writer:
+        for page_num in pages:
+            stages_to_run, artifacts = manifest.plan_stages(renderer.pdf_path, page_num, args.pages)
+            if resume and "score" not in stages_to_run:
+                continue
+
+            job = new_page_job(renderer, args, page_num)
+            job["text_path"] = artifacts["text_path"]
+            text_content = read_text_file(job["text_path"])
+            cache_key = None
+            if job["score_cache"] is not None:
+                cache_key = score_cache_key(job["score_cache"], text_content, job["structured_score"])
+                cached = job["score_cache"].get(cache_key)
+                if cached is not None:
+                    save_score_result(job, cached, text_content)
+                    manifest.record("score", job)
+                    continue
+
+            custom_id = f"score-{page_num}"
+            writer.write(build_score_batch_request(custom_id, text_content, job["structured_score"]))
+            requests[custom_id] = {"page_number": page_num, "cache_key": cache_key, "text_path": job["text_path"]}
+
+    return requests
+
+
+def save_score_result(job, result, text_content):
+    """保存评分结果到markdown文件，结构化评分模式下同时保存JSON"""
+    job["score_path"] = score_output_path(job)
+    if job["structured_score"]:
+        job["score"], _ = save_structured_result(result, job["score_path"], text_content)
+    else:
+        save_to_markdown(result, job["score_path"], text_content)
+    return job
+
+
+def submit_score_phase(renderer, args, pages, failed_pages, manifest, resume):
+    """提交评分批处理任务，没有需要评分的页面组时直接生成Word文档"""
+    requests = write_score_batch(renderer, args, pages, manifest, resume)
+    if requests:
+        start_batch_phase(args, "score", batch_input_path(args, "score"), requests, pages, failed_pages, resume)
+    else:
+        finish_batch_jobs(renderer, args, pages, failed_pages, manifest, resume)
+
+
+def submit_batch_jobs(renderer, args, page_numbers, manifest):
+    """--batch-submit：将OCR请求写入批处理文件并提交，所有页面组都无需OCR时直接提交评分"""
+    if load_batch_state(args.output) is not None:
+        print("输出目录中已有未收取的批处理任务，请先使用 --batch-collect 收取结果")
+        return
+
+    requests, pages = write_ocr_batch(renderer, args, page_numbers, manifest)
+    if requests:
+        start_batch_phase(args, "ocr", batch_input_path(args, "ocr"), requests, pages, [], args.resume)
+    else:
+        submit_score_phase(renderer, args, pages, [], manifest, args.resume)
+
+
+def save_batch_results(renderer, args, phase, requests, results, errors, manifest):
+    """保存批处理返回的结果并写入任务清单，缺少结果的请求记为失败
+
+    Returns:
+        list: 失败的页码列表
+    """
+    label, _ = BATCH_PHASES[phase]
+    failed_pages = []
+    for custom_id, request in requests.items():
+        job = new_page_job(renderer, args, request["page_number"])
+        result = results.get(custom_id)
+        if not result:
+            error = errors.get(custom_id, "批处理结果中缺少该请求")
+            print(f"{describe_pages(job)}的{label}失败: {error}")
+            manifest.record(phase, job, error)
+            failed_pages.append(request["page_number"])
+            continue
+
+        cache = job["ocr_cache"] if phase == "ocr" else job["score_cache"]
+        if cache is not None and request["cache_key"]:
+            cache.set(request["cache_key"], result)
+
+        if phase == "ocr":
+            save_ocr_result(job, result)
+        else:
+            job["text_path"] = request["text_path"]
+            save_score_result(job, result, read_text_file(job["text_path"]))
+        manifest.record(phase, job)
+
+    return failed_pages
+
+
+def finish_batch_jobs(renderer, args, pages, failed_pages, manifest, resume):
+    """为评分完成的页面组生成Word文档，并打印处理结果统计"""
+    clear_batch_state(args.output)
+    total = len(pages) + len(failed_pages)
+    failed_pages = list(failed_pages)
+    for page_num in pages:
+        stages_to_run, artifacts = manifest.plan_stages(renderer.pdf_path, page_num, args.pages)
+        if resume and not stages_to_run:
+            continue
+
+        job = resume_job(new_page_job(renderer, args, page_num), {"docx"}, artifacts)
+        try:
+            docx_stage(job)
+            manifest.record("docx", job)
+        except Exception as e:
+            print(f"处理第 {page_num} 页时出错（docx）: {e}")
+            manifest.record("docx", job, str(e))
+            failed_pages.append(page_num)
+
+    print(f"\n批处理完成: 共处理 {total} 组页面，失败 {len(failed_pages)} 组")
+    if failed_pages:
+        print(f"以下页码处理失败，可使用 --resume 重新处理: {', '.join(str(page) for page in sorted(failed_pages))}")
+
+
+def collect_batch_jobs(renderer, args, manifest):
+    """--batch-collect：收取批处理结果，OCR完成后提交评分，评分完成后生成Word文档
+
+    指定 --batch-poll 时持续等待，直到所有阶段完成。
+    """
+    state = load_batch_state(args.output)
+    if state is None:
+        print("输出目录中没有未收取的批处理任务")
+        return
+
+    while state is not None:
+        if state["pdf_path"] != os.path.abspath(renderer.pdf_path) or state["pages_per_image"] != args.pages:
+            print(f"批处理任务属于 {state['pdf_path']}（每组 {state['pages_per_image']} 页），与当前参数不一致")
+            return
+
+        phase = state["phase"]
+        label, get_client = BATCH_PHASES[phase]
+        client = get_client()
+        batch = wait_for_batch(client, state["batch_id"], args.batch_poll)
+        if batch.status not in FINAL_STATUSES:
+            counts = batch.request_counts
+            progress = f"，已完成 {counts.completed}/{counts.total}" if counts else ""
+            print(f"{label}批处理任务 {batch.id} 尚未完成（{batch.status}{progress}）")
+            return
+        if batch.status != "completed":
+            print(f"{label}批处理任务 {batch.id} 状态为 {batch.status}，只保存已返回的结果")
+
+        results, errors = read_batch_results(client, batch)
+        print(f"{label}批处理任务 {batch.id} 返回 {len(results)} 个结果，{len(errors)} 个错误")
+        failed = save_batch_results(renderer, args, phase, state["requests"], results, errors, manifest)
+        pages = [page_num for page_num in state["pages"] if page_num not in failed]
+        failed_pages = state["failed_pages"] + failed
+
+        if phase == "ocr":
+            submit_score_phase(renderer, args, pages, failed_pages, manifest, state["resume"])
+        else:
+            finish_batch_jobs(renderer, args, pages, failed_pages, manifest, state["resume"])
+
+        state = load_batch_state(args.output) if args.batch_poll > 0 else None
+
+
+def build_arg_parser(description="PDF OCR处理工具"):
+    """创建命令行参数解析器，main 和 HTTP 服务共用同一组处理参数"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("pdf_paths", nargs="*", help="PDF文件、包含PDF的目录或通配符，可以指定多个")
     parser.add_argument("-s", "--start", type=int, default=1, help="起始页码（从1开始，默认为1）")
     parser.add_argument("-e", "--end", type=int, help="结束页码（默认为PDF的最后一页）")
     parser.add_argument("-o", "--output", default="output", help="输出目录（默认为'output'）")
     parser.add_argument("-d", "--dpi", type=int, default=300, help="图片DPI（默认为300）")
+    parser.add_argument("--draft-dpi", type=int, help="两遍渲染：先以该DPI渲染并识别，置信度或识别字数过低时再以 --dpi 重新渲染识别")
+    parser.add_argument("--min-confidence", type=float, default=0.8, help="两遍渲染时低于该置信度则以全分辨率重新识别，需配合 --structured-ocr（默认为0.8）")
+    parser.add_argument("--min-chars", type=int, default=50, help="两遍渲染时识别字数（不计姓名和空白）少于该值则以全分辨率重新识别（默认为50）")
     parser.add_argument("-f", "--format", default="png", help="图片格式（默认为'png'）")
     parser.add_argument("-p", "--save-pdf", action="store_true", help="是否保存单页PDF（默认不保存）")
     parser.add_argument("--prompt", help="自定义OCR识别提示文本")
     parser.add_argument("--pages", type=int, default=1, help="每张图片包含的PDF页数，默认为1")
-    
+    parser.add_argument("--group-mode", choices=GROUP_MODES, default="stack", help="--pages 大于1时页面的组合方式：stack 垂直拼接，grid 按像素预算网格拼接，parts 每页作为同一请求中的单独图片（默认为'stack'）")
+    parser.add_argument("--auto-group", choices=BOUNDARY_MODES, help="自动检测每份作业的起始页，将连续页面分为长短不一的页面组（代替 --pages）：layout 按页眉版面判断，name 另外识别页眉中的姓名")
+    parser.add_argument("--max-group-pages", type=int, default=DEFAULT_MAX_GROUP_PAGES, help=f"自动分组时每份作业的最大页数（默认为{DEFAULT_MAX_GROUP_PAGES}）")
+    parser.add_argument("--grid-pixels", type=float, default=DEFAULT_GRID_PIXELS / 1_000_000, help=f"grid 模式下拼接图片的像素上限，单位为百万像素（默认为{DEFAULT_GRID_PIXELS / 1_000_000:g}）")
+    parser.add_argument("--keep-images", action="store_true", help="将页面图片保存到输出目录（默认只在内存中传给OCR）")
+    parser.add_argument("--send-format", choices=["original"] + list(SEND_FORMATS), default="original", help="发送给OCR模型的图片格式（默认为'original'，即不压缩）")
+    parser.add_argument("--send-quality", type=int, default=85, help="JPEG/WebP编码质量（默认为85）")
+    parser.add_argument("--max-pixels", type=float, help="发送图片的像素上限，单位为百万像素")
+    parser.add_argument("--max-kb", type=int, help="发送图片的大小上限，单位为KB")
+    parser.add_argument("--grayscale", action="store_true", help="发送前将图片转为灰度")
+    parser.add_argument("--crop-margins", action="store_true", help="发送前裁掉图片四周的空白边距")
+    parser.add_argument("--render-workers", type=int, default=2, help="渲染阶段的工作线程数：同时渲染的页面块数，每块由一个pdftoppm进程渲染（默认为2）")
+    parser.add_argument("--render-chunk", type=int, default=8, help="每次调用pdftoppm渲染的最大页数，页数较少时自动缩小，使每个渲染线程都有块可渲染（默认为8）")
+    parser.add_argument("--ocr-concurrency", type=int, default=4, help="OCR识别请求的并发数（默认为4）")
+    parser.add_argument("--score-concurrency", type=int, default=4, help="评分请求的并发数（默认为4）")
+    parser.add_argument("--score-batch", type=int, default=1, help="每次评分请求包含的作文篇数，大于1时启用批量评分（默认为1）")
+    parser.add_argument("--batch-wait", type=float, default=2.0, help="批量评分凑批时等待后续作文的最长秒数（默认为2）")
+    parser.add_argument("--docx-workers", type=int, default=1, help="生成Word文档的并发数（默认为1）")
+    parser.add_argument("--queue-size", type=int, default=4, help="各阶段之间队列的最大长度（默认为4）")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"识别结果缓存目录（默认为'{DEFAULT_CACHE_DIR}'）")
+    parser.add_argument("--cache-size", type=int, default=512, help="每类缓存的最大容量，单位MB（默认为512）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用识别结果缓存")
+    parser.add_argument("--resume", action="store_true", help="根据输出目录中的任务清单跳过已完成的页面和阶段")
+    parser.add_argument("--structured-ocr", action="store_true", help="要求OCR模型以JSON结构返回姓名、正文和置信度，解析失败时按第一行提取姓名")
+    parser.add_argument("--structured-score", action="store_true", help="要求评分以JSON结构返回各维度得分、点评和改错，并直接据此生成Word文档")
+    parser.add_argument("--triage", action="store_true", help="OCR前在缩略图上检测空白页，空白页跳过OCR、评分和生成文档")
+    parser.add_argument("--blank-ink", type=float, default=DEFAULT_BLANK_INK * 100, help=f"墨迹覆盖率低于该百分比的页面视为空白（默认为{DEFAULT_BLANK_INK * 100:g}）")
+    parser.add_argument("--detect-similar", action="store_true", help="与 --triage 同时使用：与同一文档中先前页面特征相似的页面标记为疑似重复，仍照常处理")
+    parser.add_argument("--duplicate-similarity", type=float, default=DEFAULT_DUPLICATE_SIMILARITY, help=f"--detect-similar 时页面特征相似度不低于该值的页面标记为疑似重复（默认为{DEFAULT_DUPLICATE_SIMILARITY:g}）")
+    parser.add_argument("--stream", action="store_true", help="以流式方式请求OCR和评分，实时写入结果并显示进度")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用asyncio并发发送OCR和评分请求")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="异步模式下同时处理的页面组上限（默认为64）")
+    parser.add_argument("--ocr-rate", type=float, help="每分钟最多发送的OCR识别请求数（默认不限制）")
+    parser.add_argument("--score-rate", type=float, help="每分钟最多发送的评分请求数（默认不限制）")
+    batch_group = parser.add_mutually_exclusive_group()
+    batch_group.add_argument("--batch-submit", action="store_true", help="将OCR和评分请求写入批处理文件并提交到服务商的批处理接口")
+    batch_group.add_argument("--batch-collect", action="store_true", help="收取已提交的批处理结果，继续完成后续阶段")
+    parser.add_argument("--batch-poll", type=float, default=0, help="收取批处理结果时每隔多少秒查询一次直到全部完成（默认为0，只查询一次）")
+    parser.add_argument("--max-retries", type=int, default=5, help="请求被限流或失败时的最大重试次数（默认为5）")
+    parser.add_argument("--max-cost", type=float, help="本次运行的费用上限（美元），超出后不再发出新的页面组，已发出的继续完成")
+    parser.add_argument("--max-tokens", type=int, help="本次运行的token总数上限，超出后不再发出新的页面组，已发出的继续完成")
+    parser.add_argument("--price-file", help="模型价格表JSON文件，覆盖或补充内置的每百万token价格")
+    parser.add_argument("--metrics", help="各阶段耗时、token用量和重试记录的输出文件（JSON lines，默认为输出目录下的metrics.jsonl）")
+    parser.add_argument("--watch", metavar="DIR", help="持续监视该目录，自动处理新放入的PDF文件")
+    parser.add_argument("--done-dir", help="监视模式下处理完成的PDF移动到的目录（默认为监视目录下的done）")
+    parser.add_argument("--failed-dir", help="监视模式下处理失败的PDF移动到的目录（默认为监视目录下的failed）")
+    parser.add_argument("--settle", type=float, default=5.0, help="监视模式下文件大小保持不变多少秒后才开始处理（默认为5）")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="监视模式下扫描目录的间隔秒数（默认为2）")
+    return parser
+
+
+def setup_services(args):
+    """根据命令行参数设置限速器，创建图片压缩器和结果缓存，保存在 args 中供所有任务共用"""
+    # 客户端在第一次请求时才创建，这里先检查环境变量，缺少API密钥时在处理任何页面前报错
+    get_ocr_api_config()
+    get_score_api_config()
+    configure_rate_limiters(args)
+    metrics.open(args.metrics or os.path.join(args.output, "metrics.jsonl"))
+    metrics.set_budget(load_prices(args.price_file), args.max_cost, args.max_tokens)
+    args.preprocessor = build_preprocessor(args)
+    args.page_triage = None
+    if args.triage:
+        args.page_triage = PageTriage(args.blank_ink / 100, args.duplicate_similarity if args.detect_similar else None)
+    args.full_render = None
+    if args.draft_dpi:
+        args.full_render = {"dpi": args.dpi, "min_confidence": args.min_confidence, "min_chars": args.min_chars}
+
+    args.ocr_cache = None
+    args.score_cache = None
+    if not args.no_cache:
+        args.ocr_cache = ResultCache(args.cache_dir, "ocr", args.cache_size * 1024 * 1024)
+        args.score_cache = ResultCache(args.cache_dir, "score", args.cache_size * 1024 * 1024)
+
+    # 各文档的分组结果在 open_document 中写入文档参数副本的 group_sizes
+    args.group_sizes = None
+    args.boundary_detector = None
+    if args.auto_group:
+        args.boundary_detector = BoundaryDetector(
+            args.auto_group,
+            args.max_group_pages,
+            ocr_cache=args.ocr_cache,
+            workers=args.ocr_concurrency
+        )
+
+
+def validate_args(parser, args):
+    """检查处理参数的取值和组合，不合法时通过 parser.error 退出
+
+    命令行入口和HTTP服务共用，各入口特有的参数（如PDF路径、--watch）由调用方另行检查。
+    """
+    if args.dpi < 1:
+        parser.error("--dpi 必须大于0")
+    if args.format.lower() not in IMAGE_FORMATS:
+        parser.error(f"--format 只支持 {', '.join(IMAGE_FORMATS)}")
+    if args.pages < 1:
+        parser.error("--pages 必须大于等于1")
+    if args.max_group_pages < 1:
+        parser.error("--max-group-pages 必须大于等于1")
+    if args.grid_pixels <= 0:
+        parser.error("--grid-pixels 必须大于0")
+    if not 1 <= args.send_quality <= 100:
+        parser.error("--send-quality 必须在1到100之间")
+    if args.max_kb is not None and args.max_kb < 1:
+        parser.error("--max-kb 必须大于0")
+    if args.max_pixels is not None and args.max_pixels <= 0:
+        parser.error("--max-pixels 必须大于0")
+
+    is_batch = args.batch_submit or args.batch_collect
+    if args.structured_score and args.score_batch > 1:
+        parser.error("--structured-score 不能与 --score-batch 同时使用")
+    if args.triage and is_batch:
+        parser.error("--triage 不能与批处理模式同时使用")
+    if args.detect_similar and not args.triage:
+        parser.error("--detect-similar 需要与 --triage 同时使用")
+    if args.auto_group:
+        if args.pages != 1:
+            parser.error("--auto-group 自动确定每组页数，不能与 --pages 同时使用")
+        if is_batch:
+            parser.error("--auto-group 不能与批处理模式同时使用")
+    if args.draft_dpi is not None:
+        if not 1 <= args.draft_dpi < args.dpi:
+            parser.error("--draft-dpi 必须大于0且小于 --dpi")
+        if is_batch:
+            parser.error("--draft-dpi 不能与批处理模式同时使用")
+
+
+def main():
+    # 创建命令行参数解析器
+    parser = build_arg_parser()
     args = parser.parse_args()
+    if args.watch:
+        if args.pdf_paths or args.batch_submit or args.batch_collect:
+            parser.error("--watch 不能与PDF文件或批处理模式同时使用")
+        if not os.path.isdir(args.watch):
+            parser.error(f"监视目录 '{args.watch}' 不存在")
+    elif not args.pdf_paths:
+        parser.error("请指定PDF文件、目录或通配符，或使用 --watch 监视目录")
+    validate_args(parser, args)
     
-    # 检查PDF文件是否存在
-    if not os.path.exists(args.pdf_path):
-        print(f"错误: PDF文件 '{args.pdf_path}' 不存在")
+    # 展开目录和通配符，并检查PDF文件是否存在
+    pdf_paths = []
+    for pdf_path in collect_pdf_paths(args.pdf_paths):
+        if os.path.isfile(pdf_path):
+            pdf_paths.append(pdf_path)
+        else:
+            print(f"错误: PDF文件 '{pdf_path}' 不存在")
+    if not args.watch and not pdf_paths:
+        print("错误: 没有找到需要处理的PDF文件")
         return
     
+    # 确保输出目录存在
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    setup_services(args)
+
+    if args.watch:
+        if args.use_async:
+            print("监视模式使用线程流水线，忽略 --async")
+        watch_folder(args)
+    else:
+        with contextlib.ExitStack() as stack:
+            documents = open_documents(stack, args, pdf_paths)
+            if documents:
+                process_documents(documents, args)
+
+    report_cache_stats(args)
+    metrics.print_summary()
+    metrics.close()
+
+
+def collect_pdf_paths(inputs):
+    """展开命令行中的文件、目录和通配符，返回去重后的PDF路径列表
+
+    目录会递归查找其中的PDF文件；不存在的普通路径原样保留，由调用方报告错误。
+    """
+    pdf_paths = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(item)
+                for name in names
+                if name.lower().endswith(".pdf")
+            )
+        elif any(char in item for char in "*?["):
+            matches = sorted(
+                path for path in glob.glob(item, recursive=True)
+                if path.lower().endswith(".pdf") and os.path.isfile(path)
+            )
+            if not matches:
+                print(f"警告: '{item}' 没有匹配到PDF文件")
+        else:
+            matches = [item]
+
+        for path in matches:
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                pdf_paths.append(path)
+    return pdf_paths
+
+
+def document_output_dirs(pdf_paths, output_dir):
+    """单个文档时直接输出到输出目录，多个文档时每个文档使用以文件名命名的子目录"""
+    if len(pdf_paths) == 1:
+        return [output_dir]
+
+    output_dirs = []
+    name_counts = {}
+    for pdf_path in pdf_paths:
+        name = os.path.splitext(os.path.basename(pdf_path))[0]
+        name_counts[name] = name_counts.get(name, 0) + 1
+        # 不同目录下的同名文件依次加上序号
+        subdir = name if name_counts[name] == 1 else f"{name}_{name_counts[name]}"
+        output_dirs.append(os.path.join(output_dir, subdir))
+    return output_dirs
+
+
+def open_document(args, pdf_path, output_dir):
+    """为PDF创建渲染器并确定处理的页码，调用方负责关闭渲染器
+
+    Returns:
+        dict: 包含 renderer、该文档的参数副本 args 和 page_numbers；无法读取或页码范围无效时返回None
+    """
+    try:
+        # 两遍渲染时先以低DPI渲染，需要时由 render_full 以 --dpi 重新渲染
+        renderer = PdfRenderer(
+            pdf_path,
+            args.draft_dpi or args.dpi,
+            args.format,
+            thread_count=args.render_workers,
+            chunk_size=args.render_chunk,
+            work_dir=output_dir,
+            group_mode=args.group_mode,
+            grid_pixels=int(args.grid_pixels * 1_000_000)
+        )
+    except ValueError as e:
+        print(f"错误: {pdf_path}: {e}")
+        return None
+
+    print(f"{pdf_path} 共有 {renderer.page_count} 页")
+    page_numbers = select_page_numbers(renderer, args)
+    if not page_numbers:
+        renderer.close()
+        return None
+
+    # 缓存、压缩器等共享对象随浅拷贝在所有文档之间共用
+    doc_args = copy.copy(args)
+    doc_args.pdf_path = pdf_path
+    doc_args.output = output_dir
+
+    if args.boundary_detector is not None:
+        try:
+            doc_args.group_sizes = args.boundary_detector.detect(renderer, page_numbers[0], page_numbers[-1])
+        except Exception as e:
+            print(f"错误: {pdf_path}: 自动分组失败: {e}")
+            renderer.close()
+            return None
+        metrics.record_grouping(pdf_path, doc_args.group_sizes)
+        page_numbers = list(doc_args.group_sizes)
+        print(f"{pdf_path} 自动分组: {', '.join(describe_group(first, size) for first, size in doc_args.group_sizes.items())}")
+    return {"renderer": renderer, "args": doc_args, "page_numbers": page_numbers}
+
+
+def open_documents(stack, args, pdf_paths):
+    """打开所有PDF文档，渲染器在 stack 关闭时清理
+
+    Returns:
+        list: open_document 返回的文档字典列表
+    """
+    documents = []
+    for pdf_path, output_dir in zip(pdf_paths, document_output_dirs(pdf_paths, args.output)):
+        document = open_document(args, pdf_path, output_dir)
+        if document is not None:
+            stack.callback(document["renderer"].close)
+            documents.append(document)
+    return documents
+
+
+def watch_folder(args):
+    """--watch：持续监视输入目录，将新出现的PDF的页面送入同一条流水线
+
+    每个PDF的结果保存在输出目录下以文件名和内容摘要命名的子目录中，先后放入的同名文件互不覆盖。
+    所有页面处理成功的PDF移动到 done 目录，有页面失败或无法读取的PDF移动到 failed 目录，
+    移走后删除其任务清单记录。
+    """
+    watcher = FolderWatcher(args.watch, args.settle, args.poll_interval)
+    done_dir = args.done_dir or os.path.join(args.watch, "done")
+    failed_dir = args.failed_dir or os.path.join(args.watch, "failed")
+    manifest = JobManifest(args.output)
+    pipeline = build_pipeline(args, manifest)
+    pending = {}
+    lock = threading.Lock()
+
+    def move_document(pdf_path, is_failed):
+        try:
+            target = move_to_dir(pdf_path, failed_dir if is_failed else done_dir)
+        except OSError as e:
+            print(f"移动 {pdf_path} 失败: {e}")
+            return
+        watcher.forget(pdf_path)
+        manifest.forget(pdf_path)
+        print(f"{os.path.basename(pdf_path)} 处理{'失败' if is_failed else '完成'}，已移动至: {target}")
+
+    def iter_jobs():
+        for pdf_path in watcher.iter_ready():
+            try:
+                digest = file_digest(pdf_path)
+            except OSError as e:
+                print(f"读取 {pdf_path} 失败: {e}")
+                watcher.forget(pdf_path)
+                continue
+            name = os.path.splitext(os.path.basename(pdf_path))[0]
+            output_dir = os.path.join(args.output, f"{name}_{digest[:8]}")
+            document = open_document(args, pdf_path, output_dir)
+            if document is None:
+                move_document(pdf_path, True)
+                continue
+
+            with lock:
+                pending[pdf_path] = {
+                    "renderer": document["renderer"],
+                    "remaining": len(document["page_numbers"]),
+                    "results": {},
+                }
+            yield from iter_page_jobs(
+                document["renderer"],
+                document["args"],
+                document["page_numbers"],
+                manifest if args.resume else None
+            )
+
+    def on_result(job):
+        if metrics.budget_exceeded():
+            watcher.stop()
+        with lock:
+            entry = pending[job["pdf_path"]]
+            entry["remaining"] -= 1
+            entry["results"][job_id(job)] = job
+            if entry["remaining"] > 0:
+                return
+            del pending[job["pdf_path"]]
+
+        entry["renderer"].close()
+        if args.page_triage is not None:
+            args.page_triage.forget(job["pdf_path"])
+        skipped_pages = sorted(page for (_, page), result in entry["results"].items() if result.get("budget_skipped"))
+        failed_pages = sorted(
+            page for (_, page), result in entry["results"].items()
+            if not result.get("success", False) and not result.get("budget_skipped")
+        )
+        if failed_pages:
+            print(f"{os.path.basename(job['pdf_path'])} 以下页码处理失败: {', '.join(str(page) for page in failed_pages)}")
+        if skipped_pages and not failed_pages:
+            # 留在输入目录中，调整预算后以 --resume 重新监视时只处理未完成的页面组
+            print(f"{os.path.basename(job['pdf_path'])} 超出预算未处理的页码: {', '.join(str(page) for page in skipped_pages)}，文件保留在输入目录中")
+            return
+        move_document(job["pdf_path"], bool(failed_pages))
+
+    try:
+        pipeline.run(within_budget(iter_jobs()), on_result)
+        if metrics.budget_exceeded():
+            print("已停止监视，未处理完的文件保留在输入目录中，调整预算后可使用 --resume 继续")
+    except KeyboardInterrupt:
+        watcher.stop()
+        print("\n已停止监视，未处理完的文件保留在输入目录中，可使用 --resume 继续")
+
+
+def describe_group(first_page, size):
+    """返回页面组的页码范围描述，例如 1-2"""
+    return str(first_page) if size == 1 else f"{first_page}-{first_page + size - 1}"
+
+
+def select_page_numbers(renderer, args):
+    """根据起止页码参数返回需要处理的页面组首页页码，范围无效时返回空列表"""
     # 获取PDF总页数
-    total_pages = get_pdf_page_count(args.pdf_path)
-    print(f"PDF文件共有 {total_pages} 页")
+    total_pages = renderer.page_count
     
     # 确定处理的页码范围
     start_page = max(1, args.start)  # 确保起始页码至少为1
@@ -136,65 +1342,156 @@ def main():
     # 确保页码范围有效
     if start_page > total_pages:
         print(f"错误: 起始页码 {start_page} 超出PDF总页数 {total_pages}")
-        return
+        return []
     
     if end_page > total_pages:
         print(f"警告: 结束页码 {end_page} 超出PDF总页数 {total_pages}，将处理到最后一页")
         end_page = total_pages
-    
-    # 确保输出目录存在
-    if not os.path.exists(args.output):
-        os.makedirs(args.output)
-    
-    # 处理PDF页面
-    results = []
-    failed_pages = []
-    
-    # 根据pages_per_image参数调整循环步长，确保每次处理指定数量的页面
-    for page_num in range(start_page, end_page + 1, args.pages):
-        # 第一次尝试处理
-        result = process_pdf_page(
-            args.pdf_path, 
-            page_num, 
-            args.output, 
-            args.dpi, 
-            args.format, 
-            args.save_pdf,
-            args.prompt,
-            args.pages
-        )
-        
-        # 如果失败，进行一次重试
-        if not result.get("success", False):
-            print(f"第 {page_num} 页处理失败，正在进行重试...")
-            result = process_pdf_page(
-                args.pdf_path, 
-                page_num, 
-                args.output, 
-                args.dpi, 
-                args.format, 
-                args.save_pdf,
-                args.prompt,
-                args.pages
-            )
-            
-            # 如果重试后仍然失败，记录失败页码
-            if not result.get("success", False):
-                failed_pages.append(page_num)
-                print(f"第 {page_num} 页重试后仍然失败")
-        
-        results.append(result)
-    
-    # 打印处理结果统计
-    success_count = sum(1 for r in results if r.get("success", False))
-    print(f"\n处理完成: 共处理 {len(results)} 页，成功 {success_count} 页，失败 {len(results) - success_count} 页")
-    
-    # 如果有失败的页码，输出详细信息
-    if failed_pages:
-        print("\n以下页码处理失败:")
-        for page in failed_pages:
-            print(f"- 第 {page} 页")
+
+    # 根据pages_per_image参数调整步长，确保每次处理指定数量的页面
+    return list(range(start_page, end_page + 1, args.pages))
+
+
+def build_preprocessor(args):
+    """根据命令行参数创建图片压缩器，未启用任何压缩选项时返回None"""
+    is_enabled = (
+        args.send_format != "original"
+        or args.max_pixels
+        or args.max_kb
+        or args.grayscale
+        or args.crop_margins
+    )
+    if not is_enabled:
+        return None
+
+    # 'original' 时沿用渲染格式编码
+    if args.send_format == "original":
+        send_format = "jpeg" if args.format.lower() in ("jpg", "jpeg") else "png"
+    else:
+        send_format = args.send_format
+
+    return ImagePreprocessor(
+        fmt=send_format,
+        quality=args.send_quality,
+        max_pixels=int(args.max_pixels * 1_000_000) if args.max_pixels else None,
+        max_bytes=args.max_kb * 1024 if args.max_kb else None,
+        grayscale=args.grayscale,
+        crop_margins=args.crop_margins
+    )
+
+
+def configure_rate_limiters(args):
+    """根据命令行参数设置OCR和评分请求的限速器"""
+    ocr_rate_limiter.configure(
+        rate=args.ocr_rate / 60 if args.ocr_rate else None,
+        max_concurrency=args.ocr_concurrency,
+        max_retries=args.max_retries
+    )
+    score_rate_limiter.configure(
+        rate=args.score_rate / 60 if args.score_rate else None,
+        max_concurrency=args.score_concurrency,
+        max_retries=args.max_retries
+    )
+
+
+def report_cache_stats(args):
+    """打印缓存命中统计并关闭缓存"""
+    caches = [("OCR识别", args.ocr_cache), ("评分点评", args.score_cache)]
+    for label, cache in caches:
+        if cache is None:
+            continue
+        stats = cache.stats()
+        print(f"{label}缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次")
+        cache.close()
+
+
+def process_documents(documents, args):
+    """按命令行参数处理所有文档
+
+    所有文档的页面组进入同一条流水线，共用各阶段的工作线程、限速器和缓存，
+    避免每个文档结束时流水线排空。
+    """
+    manifest = JobManifest(args.output)
+    if args.batch_submit or args.batch_collect:
+        for document in documents:
+            if args.batch_submit:
+                submit_batch_jobs(document["renderer"], document["args"], document["page_numbers"], manifest)
+            else:
+                collect_batch_jobs(document["renderer"], document["args"], manifest)
+        return
+
+    pipeline = build_pipeline(args, manifest)
+    if args.use_async:
+        finished = asyncio.run(run_pipeline_async(documents, args, manifest, args.resume))
+    else:
+        finished = run_pipeline(pipeline, documents, manifest if args.resume else None)
+    results = {job_id(job): job for job in finished}
+
+    # 失败的页面重试一次，已完成的阶段不再重复执行；超出预算后未发出的页面不再重试
+    retry_documents = []
+    for document in documents:
+        if metrics.budget_exceeded():
+            break
+        pdf_path = document["renderer"].pdf_path
+        retry_pages = [
+            page_num for page_num in document["page_numbers"]
+            if (pdf_path, page_num) in results and not results[(pdf_path, page_num)].get("success", False)
+            and not results[(pdf_path, page_num)].get("budget_skipped")
+        ]
+        if retry_pages:
+            retry_documents.append(dict(document, page_numbers=retry_pages))
+    if retry_documents:
+        print("\n以下页面处理失败，正在进行重试:")
+        for document in retry_documents:
+            print(f"- {document['renderer'].pdf_path}: {', '.join(str(page) for page in document['page_numbers'])}")
+        if args.use_async:
+            retried = asyncio.run(run_pipeline_async(retry_documents, args, manifest, resume=True))
+        else:
+            retried = run_pipeline(pipeline, retry_documents, manifest)
+        for job in retried:
+            results[job_id(job)] = job
+    # 超出预算而未发出请求的页面组与未进入流水线的页面组一样列为未处理，不计为失败
+    results = {key: job for key, job in results.items() if not job.get("budget_skipped")}
+
+    bytes_sent = [job["bytes_sent"] for job in results.values() if "bytes_sent" in job]
+    if bytes_sent:
+        print(f"\n共发送图片 {sum(bytes_sent) / 1024 / 1024:.1f} MB，平均每组 {sum(bytes_sent) / len(bytes_sent) / 1024:.0f} KB")
+
+    total_count = 0
+    total_failed = 0
+    total_skipped = 0
+    for document in documents:
+        pdf_path = document["renderer"].pdf_path
+        doc_results = [
+            page_result(results[(pdf_path, page_num)]) for page_num in document["page_numbers"]
+            if (pdf_path, page_num) in results
+        ]
+        failed_pages = [r["page_number"] for r in doc_results if not r.get("success", False)]
+        skipped_pages = [page_num for page_num in document["page_numbers"] if (pdf_path, page_num) not in results]
+        blank_pages = [r["page_number"] for r in doc_results if r.get("triage") == "blank"]
+        total_count += len(doc_results)
+        total_failed += len(failed_pages)
+        total_skipped += len(skipped_pages)
+
+        # 打印处理结果统计
+        success_count = len(doc_results) - len(failed_pages)
+        print(f"\n{pdf_path} 处理完成: 共处理 {len(doc_results)} 页，成功 {success_count} 页，失败 {len(failed_pages)} 页")
+
+        # 如果有失败的页码，输出详细信息
+        if failed_pages:
+            print("以下页码处理失败:")
+            for page in failed_pages:
+                print(f"- 第 {page} 页")
+        if blank_pages:
+            print(f"空白页（未进行OCR）: {', '.join(str(page) for page in blank_pages)}")
+        if skipped_pages:
+            print(f"超出预算未处理的页码: {', '.join(str(page) for page in skipped_pages)}")
+
+    if len(documents) > 1:
+        print(f"\n全部完成: 共 {len(documents)} 个文档，处理 {total_count} 页，失败 {total_failed} 页")
+    if total_skipped:
+        print(f"因超出预算有 {total_skipped} 个页面组未处理，调整 --max-cost / --max-tokens 后可使用 --resume 继续")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
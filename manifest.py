@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import time
+import zipfile
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# 各处理阶段及其产物在任务字典中的字段名
+STAGE_ARTIFACTS = [
+    ("render", "image_path"),
+    ("ocr", "text_path"),
+    ("score", "score_path"),
+    ("docx", "docx_path"),
+]
+
+
+def job_key(pdf_path, page_number, pages_per_image):
+    """返回页面组在清单中的唯一标识"""
+    return f"{os.path.abspath(pdf_path)}#{page_number}+{pages_per_image}"
+
+
+def is_valid_artifact(path):
+    """判断产物文件是否存在且内容有效，path 为列表时（按页保存的图片）要求全部有效"""
+    if isinstance(path, list):
+        return bool(path) and all(is_valid_artifact(part) for part in path)
+    if not path or not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return False
+    if path.endswith(".docx"):
+        return zipfile.is_zipfile(path)
+    return True
+
+
+class JobManifest:
+    """记录每个页面组各阶段状态和产物路径的任务清单
+
+    清单以 JSON lines 格式追加写入输出目录，每完成或失败一个阶段写入一行，
+    中断后重新运行时可据此跳过已完成的阶段。
+    """
+
+    def __init__(self, output_dir):
+        """
+        Args:
+            output_dir: 输出目录，清单文件保存在该目录下
+        """
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程中断时最后一行可能只写了一半
+                    continue
+
+                if "forget" in record:
+                    self._drop(record["forget"])
+                    continue
+                entry = self.entries.setdefault(record["key"], {"artifacts": {}, "stages": {}})
+                entry["artifacts"].update(record.get("artifacts", {}))
+                entry["stages"][record["stage"]] = record["status"]
+
+    def record(self, stage_name, job, error=None):
+        """写入一条阶段完成或失败的记录
+
+        Args:
+            stage_name: 阶段名称
+            job: 任务字典
+            error: 失败时的错误信息，成功时为None
+        """
+        key = job_key(job["pdf_path"], job["page_number"], job["pages_per_image"])
+        artifacts = {field: job[field] for _, field in STAGE_ARTIFACTS if job.get(field)}
+        record = {
+            "key": key,
+            "page_number": job["page_number"],
+            "stage": stage_name,
+            "status": "failed" if error else ("skipped" if job.get("budget_skipped") else "done"),
+            "artifacts": artifacts,
+            "time": time.time(),
+        }
+        if error:
+            record["error"] = error
+
+        with self._lock:
+            entry = self.entries.setdefault(key, {"artifacts": {}, "stages": {}})
+            entry["artifacts"].update(artifacts)
+            entry["stages"][stage_name] = record["status"]
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _drop(self, pdf_path):
+        prefix = f"{os.path.abspath(pdf_path)}#"
+        for key in [key for key in self.entries if key.startswith(prefix)]:
+            del self.entries[key]
+
+    def forget(self, pdf_path):
+        """删除一个PDF所有页面组的记录，之后同一路径的新文件从头处理
+
+        监视模式下PDF处理完并移出输入目录后调用，避免同名的新扫描件被误认为已完成。
+        """
+        record = {"forget": os.path.abspath(pdf_path), "time": time.time()}
+        with self._lock:
+            self._drop(pdf_path)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def plan_stages(self, pdf_path, page_number, pages_per_image):
+        """根据清单和已有产物计算页面组需要执行的阶段
+
+        从第一个产物缺失或无效的阶段开始，其后的阶段都需要重新执行；
+        页面图片只是中间产物，仅在需要重新OCR且图片无效时才重新渲染。
+
+        Returns:
+            tuple: (需要执行的阶段名称集合, 已有的产物路径字典)
+        """
+        entry = self.entries.get(job_key(pdf_path, page_number, pages_per_image))
+        if entry is None:
+            return {stage for stage, _ in STAGE_ARTIFACTS}, {}
+
+        artifacts = entry["artifacts"]
+        stages_to_run = set()
+        for stage, field in STAGE_ARTIFACTS[1:]:
+            if stages_to_run or not is_valid_artifact(artifacts.get(field)):
+                stages_to_run.add(stage)
+
+        if "ocr" in stages_to_run and not is_valid_artifact(artifacts.get("image_path")):
+            stages_to_run.add("render")
+
+        return stages_to_run, artifacts
@@ -1,8 +1,3 @@
-import markdown
-from bs4 import BeautifulSoup
-from docx import Document
-from docx.oxml.ns import qn
-from docx.shared import Pt, RGBColor
 import os
 import re
 
@@ -13,6 +8,9 @@ def set_font_simsun(run):
     Args:
         run: 文档中的文本运行对象
     """
+    from docx.oxml.ns import qn
+    from docx.shared import Pt
+
     run.font.name = '宋体'
     run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
     run.font.size = Pt(12)
@@ -32,6 +30,11 @@ def convert_md_to_docx(input_md_path, output_docx_path):
         FileNotFoundError: 当输入文件不存在时
         IOError: 当读取或写入文件出错时
     """
+    # python-docx 导入较慢，只在实际生成文档时导入
+    from docx import Document
+    from docx.oxml.ns import qn
+    from docx.shared import Pt
+
     try:
         # 确保输出目录存在
         output_dir = os.path.dirname(output_docx_path)
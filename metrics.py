@@ -0,0 +1,332 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+from pricing import usage_cost
+
+# 当前正在处理的页面组和计时阶段，请求的用量和重试会归到它们名下
+_current_job = contextvars.ContextVar("current_job", default=None)
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+# 汇总时按此顺序列出各阶段
+STAGE_ORDER = [
+    "boundary", "render", "thumbnail", "encode", "triage",
+    "ocr_request", "ocr_request_wait", "ocr_request_backoff",
+    "score_request", "score_request_wait", "score_request_backoff",
+    "docx",
+]
+
+
+def percentile(values, fraction):
+    """返回已排序列表的百分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+class MetricsRecorder:
+    """记录各阶段耗时、发送字节数、token 用量、费用、重试次数和页面分类结果
+
+    每条记录以 JSON lines 格式追加写入文件，同时在内存中汇总，运行结束时打印统计。
+    token 用量和费用按页面组、文档和整次运行分别汇总，并据此判断是否超出预算。
+    同一实例可同时用于线程和 asyncio。
+    """
+
+    def __init__(self):
+        self.path = None
+        self.prices = {}
+        self.max_cost = None
+        self.max_tokens = None
+        self._file = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空内存中的汇总数据"""
+        with self._lock:
+            self.durations = {}
+            self.bytes_sent = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cost = 0.0
+            self.unpriced_models = set()
+            self.page_usage = {}
+            self.retries = 0
+            self.triage = {}
+            self.similar_pages = 0
+            self.full_renders = 0
+            self.group_sizes = {}
+
+    def set_budget(self, prices, max_cost=None, max_tokens=None):
+        """设置价格表和本次运行的费用、token 上限
+
+        Args:
+            prices: 模型名称到每百万 token 价格的映射，见 pricing.load_prices
+            max_cost: 费用上限，None 表示不限制
+            max_tokens: 输入和输出 token 总数上限，None 表示不限制
+        """
+        self.prices = prices
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+
+    def open(self, path):
+        """开始将记录追加写入 path，path 为 None 时只在内存中汇总"""
+        self.close()
+        self.path = path
+        if path:
+            output_dir = os.path.dirname(path)
+            if output_dir and not os.path.exists(output_dir):
+                os.makedirs(output_dir, exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        """写入各页面组的用量汇总并关闭记录文件"""
+        with self._lock:
+            page_usage = sorted(self.page_usage.items(), key=lambda item: (item[0][0] or "", item[0][1] or 0))
+            if self._file is not None:
+                for (pdf, page), usage in page_usage:
+                    if pdf is None:
+                        continue
+                    record = {"event": "page_usage", "pdf": pdf, "page": page, **usage, "time": round(time.time(), 3)}
+                    record["cost"] = round(record["cost"], 6)
+                    self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.close()
+                self._file = None
+
+    def _write(self, record):
+        record["time"] = round(time.time(), 3)
+        job = _current_job.get()
+        if job is not None:
+            record.update(job)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.flush()
+
+    def record_stage(self, stage, seconds, **fields):
+        """记录一次阶段耗时，fields 为附加字段（如 bytes_sent、pages）"""
+        with self._lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            self.bytes_sent += fields.get("bytes_sent", 0)
+        self._write({"event": "stage", "stage": stage, "seconds": round(seconds, 4), **fields})
+
+    def record_usage(self, usage, model=None):
+        """记录一次请求的 token 用量和费用，归到当前计时阶段和页面组
+
+        Args:
+            usage: completion.usage，或批处理结果中的 usage 字典
+            model: 请求使用的模型，用于在价格表中查找单价
+        """
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            prompt_tokens = usage.get("prompt_tokens") or 0
+            completion_tokens = usage.get("completion_tokens") or 0
+        else:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cost = usage_cost(self.prices, model, prompt_tokens, completion_tokens)
+
+        job = _current_job.get()
+        # 批量评分等不属于单个页面组的请求只计入文档和整次运行的汇总
+        key = (job["pdf"], job["page"]) if job is not None else (None, None)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if cost is None:
+                self.unpriced_models.add(model)
+            else:
+                self.cost += cost
+            page = self.page_usage.setdefault(key, {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+            page["prompt_tokens"] += prompt_tokens
+            page["completion_tokens"] += completion_tokens
+            page["cost"] += cost or 0.0
+        self._write({
+            "event": "usage",
+            "stage": _current_stage.get(),
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": round(cost, 6) if cost is not None else None,
+        })
+
+    def budget_exceeded(self):
+        """已超出 --max-cost 或 --max-tokens 时返回说明文字，否则返回 None"""
+        with self._lock:
+            tokens = self.prompt_tokens + self.completion_tokens
+            cost = self.cost
+        if self.max_tokens is not None and tokens >= self.max_tokens:
+            return f"token 用量 {tokens} 已达到上限 {self.max_tokens}"
+        if self.max_cost is not None and cost >= self.max_cost:
+            return f"费用 ${cost:.4f} 已达到上限 ${self.max_cost:g}"
+        return None
+
+    def document_usage(self):
+        """返回按文档汇总的 token 用量和费用
+
+        Returns:
+            dict: 文档绝对路径到 {"prompt_tokens", "completion_tokens", "cost"} 的映射，
+                不属于单个页面组的请求归在 None 下
+        """
+        documents = {}
+        with self._lock:
+            for (pdf, _), page in self.page_usage.items():
+                total = documents.setdefault(pdf, {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+                for field, value in page.items():
+                    total[field] += value
+        return documents
+
+    def record_retry(self, error_name, stage=None):
+        """记录一次请求重试，归到 stage，为 None 时归到当前计时阶段"""
+        with self._lock:
+            self.retries += 1
+        self._write({"event": "retry", "stage": stage or _current_stage.get(), "error": error_name})
+
+    def record_triage(self, result):
+        """记录一个页面组的分类结果，result 为 PageTriage.classify 的返回值"""
+        with self._lock:
+            self.triage[result["decision"]] = self.triage.get(result["decision"], 0) + 1
+            if "similar_to" in result:
+                self.similar_pages += 1
+        self._write({"event": "triage", **result})
+
+    def record_full_render(self, reason):
+        """记录一次两遍渲染中的全分辨率重新识别"""
+        with self._lock:
+            self.full_renders += 1
+        self._write({"event": "full_render", "reason": reason})
+
+    def record_grouping(self, pdf_path, groups):
+        """记录一个文档的自动分组结果，groups 为各组起始页码到页数的映射"""
+        with self._lock:
+            for size in groups.values():
+                self.group_sizes[size] = self.group_sizes.get(size, 0) + 1
+        self._write({"event": "grouping", "pdf": os.path.abspath(pdf_path), "groups": [[first, size] for first, size in groups.items()]})
+
+    def summary(self):
+        """返回各阶段的次数、总耗时、p50 和 p95
+
+        Returns:
+            dict: 阶段名称到 {"count", "total", "p50", "p95"} 的映射
+        """
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+
+        stages = [stage for stage in STAGE_ORDER if stage in durations]
+        stages += sorted(stage for stage in durations if stage not in STAGE_ORDER)
+        return {
+            stage: {
+                "count": len(durations[stage]),
+                "total": sum(durations[stage]),
+                "p50": percentile(durations[stage], 0.5),
+                "p95": percentile(durations[stage], 0.95),
+            }
+            for stage in stages
+        }
+
+    def print_summary(self):
+        """打印各阶段耗时统计和请求用量"""
+        summary = self.summary()
+        if not summary and not self.page_usage:
+            return
+
+        if summary:
+            print("\n各阶段耗时统计（秒）:")
+            print(f"{'阶段':<22}{'次数':>6}{'合计':>10}{'p50':>9}{'p95':>9}")
+            for stage, stats in summary.items():
+                print(f"{stage:<22}{stats['count']:>6}{stats['total']:>10.2f}{stats['p50']:>9.2f}{stats['p95']:>9.2f}")
+        print(
+            f"发送图片 {self.bytes_sent / 1024 / 1024:.1f} MB，"
+            f"输入 {self.prompt_tokens} tokens，输出 {self.completion_tokens} tokens，重试 {self.retries} 次"
+        )
+
+        skipped = self.triage.get("blank", 0)
+        if skipped:
+            print(f"页面分类: 空白 {skipped} 组，共省去 {skipped}/{sum(self.triage.values())} 次OCR请求")
+        if self.similar_pages:
+            print(f"疑似重复: {self.similar_pages} 组页面与先前页面相似，已照常处理")
+
+        if self.full_renders:
+            print(f"两遍渲染: {self.full_renders} 组页面以全分辨率重新识别")
+
+        if self.group_sizes:
+            sizes = "，".join(f"{size} 页 {count} 份" for size, count in sorted(self.group_sizes.items()))
+            print(f"自动分组: 共 {sum(self.group_sizes.values())} 份作业（{sizes}）")
+
+        documents = self.document_usage()
+        if len(documents) > 1:
+            labels = document_labels(pdf for pdf in documents if pdf is not None)
+            for pdf, usage in sorted(documents.items(), key=lambda item: item[0] or ""):
+                label = labels[pdf] if pdf is not None else "批量请求"
+                print(f"- {label}: {usage['prompt_tokens'] + usage['completion_tokens']} tokens，${usage['cost']:.4f}")
+        print(f"预估费用: ${self.cost:.4f}")
+        if self.unpriced_models:
+            models = ", ".join(sorted(str(model) for model in self.unpriced_models))
+            print(f"价格表中没有以下模型，未计入费用: {models}")
+        if self.path:
+            print(f"详细记录已写入: {self.path}")
+
+
+def document_labels(pdf_paths):
+    """返回汇总中显示的文档名称：通常为文件名，不同目录中有同名文件时显示相对路径"""
+    pdf_paths = list(pdf_paths)
+    names = [os.path.basename(pdf) for pdf in pdf_paths]
+    return {
+        pdf: name if names.count(name) == 1 else os.path.relpath(pdf)
+        for pdf, name in zip(pdf_paths, names)
+    }
+
+
+recorder = MetricsRecorder()
+
+
+@contextlib.contextmanager
+def timed(stage, **fields):
+    """记录 with 块的耗时，块内发出的请求用量和重试归到该阶段"""
+    token = _current_stage.set(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _current_stage.reset(token)
+        recorder.record_stage(stage, seconds, **fields)
+
+
+def job_fields(job):
+    """返回记录中标识页面组的字段，不同目录中的同名PDF以绝对路径区分"""
+    return {"pdf": os.path.abspath(job["pdf_path"]), "page": job["page_number"]}
+
+
+def with_job_context(func):
+    """包装阶段处理函数，使其执行期间的记录带上当前页面组
+
+    批量阶段接收任务列表，此时不设置当前页面组。
+    """
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(job):
+            token = _current_job.set(job_fields(job))
+            try:
+                return await func(job)
+            finally:
+                _current_job.reset(token)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(job):
+        if isinstance(job, list):
+            return func(job)
+        token = _current_job.set(job_fields(job))
+        try:
+            return func(job)
+        finally:
+            _current_job.reset(token)
+    return wrapper
@@ -0,0 +1,401 @@
+import argparse
+import collections
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 模拟OCR识别结果：第一行为中文姓名，其后为英文作文
+MOCK_OCR_TEXT = """张三
+Dear Mr. Smith,
+I am writing to tell you about our school trip. Last week we visited the science museum and learned a lot.
+Yours sincerely,
+Li Hua"""
+
+MOCK_SCORE_TEXT = """### 总得分：12/15
+
+- 内容要点：4/5
+- 结构：4/5
+- 语言：4/5
+
+### 点评
+
+整体结构完整，"Last week we visited the science museum" 表达清楚，建议增加细节描写。"""
+
+MOCK_SCORE_RESULT = {
+    "scores": [
+        {"dimension": "任务完成与内容", "score": 4, "max": 5},
+        {"dimension": "结构与连贯性", "score": 4, "max": 5},
+        {"dimension": "语言能力", "score": 4, "max": 5},
+    ],
+    "total": 12,
+    "comments": [
+        {"title": "总体评价", "items": ["整体结构完整，主题明确，首尾呼应"]},
+        {"title": "语言形式评价", "items": ["语法基本正确，词汇可以更丰富"]},
+    ],
+    "corrections": [{"original": "learned a lot", "corrected": "learned a lot about science"}],
+}
+
+ESSAY_PATTERN = re.compile(r"^=== 作文 (\d+) ===$", re.MULTILINE)
+
+
+class MockState:
+    """模拟服务端保存的文件、批处理任务以及 chat.completions 的延迟和错误"""
+
+    def __init__(self, batch_delay=0.0, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=None):
+        self.batch_delay = batch_delay
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.completion_count = 0
+        self._queued_errors = collections.deque()
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def new_id(self, prefix):
+        return f"{prefix}-{next(self._ids)}"
+
+    def fail_next(self, *statuses):
+        """让接下来的 chat.completions 请求依次返回指定的错误状态码（429或500），用于测试重试"""
+        with self.lock:
+            self._queued_errors.extend(statuses)
+
+    def next_error(self):
+        """记录一次 chat.completions 请求，返回本次应返回的错误状态码，不出错时返回 None"""
+        with self.lock:
+            self.completion_count += 1
+            if self._queued_errors:
+                return self._queued_errors.popleft()
+        if random.random() < self.error_rate:
+            return 429 if random.random() < 0.5 else 500
+        return None
+
+    def response_delay(self):
+        """返回一次请求的模拟延迟：latency 上下浮动 jitter 秒"""
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+
+def is_image_request(messages):
+    """判断请求中是否包含图片"""
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return True
+    return False
+
+
+def request_text(messages):
+    """拼接请求中的全部文本内容"""
+    texts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "\n".join(texts)
+
+
+def mock_reply(body):
+    """根据请求内容生成模拟回复：图片返回OCR文本，批量评分按编号返回多段结果，其余返回单篇评分
+
+    请求指定 json_schema 格式时返回对应的JSON结构。
+    """
+    messages = body.get("messages", [])
+    if is_image_request(messages):
+        if (body.get("response_format") or {}).get("type") == "json_schema":
+            name, text = MOCK_OCR_TEXT.split("\n", 1)
+            return json.dumps({"name": name, "body": text, "confidence": 0.92}, ensure_ascii=False)
+        return MOCK_OCR_TEXT
+
+    if (body.get("response_format") or {}).get("type") == "json_schema":
+        return json.dumps(MOCK_SCORE_RESULT, ensure_ascii=False)
+
+    numbers = ESSAY_PATTERN.findall(request_text(messages))
+    if numbers:
+        return "\n\n".join(f"=== 结果 {number} ===\n{MOCK_SCORE_TEXT}" for number in numbers)
+    return MOCK_SCORE_TEXT
+
+
+def make_completion(body, content):
+    """构造 chat.completion 响应"""
+    prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+    completion_tokens = len(content)
+    return {
+        "id": f"chatcmpl-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def run_batch(state, batch):
+    """处理批处理任务的全部请求，生成输出文件"""
+    input_file = state.files[batch["input_file_id"]]
+    lines = []
+    for index, line in enumerate(input_file["content"].decode("utf-8").splitlines()):
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        body = request["body"]
+        lines.append(json.dumps({
+            "id": f"batch_req_{index}",
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "request_id": f"req_{index}",
+                "body": make_completion(body, mock_reply(body)),
+            },
+            "error": None,
+        }, ensure_ascii=False))
+
+    output_id = state.new_id("file")
+    state.files[output_id] = {
+        "filename": f"{batch['id']}_output.jsonl",
+        "purpose": "batch_output",
+        "content": ("\n".join(lines) + "\n").encode("utf-8"),
+        "created_at": int(time.time()),
+    }
+    batch.update({
+        "status": "completed",
+        "output_file_id": output_id,
+        "completed_at": int(time.time()),
+        "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0},
+    })
+
+
+def file_object(file_id, entry):
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(entry["content"]),
+        "created_at": entry["created_at"],
+        "filename": entry["filename"],
+        "purpose": entry["purpose"],
+        "status": "processed",
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """OpenAI 兼容接口的本地替身，支持 chat.completions、files 和 batches"""
+
+    server_version = "MockOpenAI/1.0"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self.handle_completion(json.loads(self.read_body()))
+        elif path.endswith("/files"):
+            self.handle_upload()
+        elif path.endswith("/batches"):
+            self.handle_create_batch(json.loads(self.read_body()))
+        else:
+            self.send_json({"error": {"message": f"未知接口: {path}"}}, 404)
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        match = re.search(r"/files/([^/]+)(/content)?$", path)
+        if match:
+            self.handle_get_file(match.group(1), bool(match.group(2)))
+            return
+        match = re.search(r"/batches/([^/]+)$", path)
+        if match:
+            self.handle_get_batch(match.group(1))
+            return
+        self.send_json({"error": {"message": f"未知接口: {path}"}}, 404)
+
+    def handle_completion(self, body):
+        time.sleep(self.state.response_delay())
+        # 按队列或随机返回限流、服务端错误，用于测试限速和重试
+        status = self.state.next_error()
+        if status == 429:
+            headers = {}
+            if self.state.retry_after is not None:
+                headers["Retry-After"] = f"{self.state.retry_after:g}"
+            self.send_json({"error": {"message": "模拟限流", "type": "rate_limit_error"}}, 429, headers)
+            return
+        if status is not None:
+            self.send_json({"error": {"message": "模拟服务端错误", "type": "server_error"}}, status)
+            return
+
+        content = mock_reply(body)
+        if not body.get("stream"):
+            self.send_json(make_completion(body, content))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        completion = make_completion(body, content)
+        for start in range(0, len(content), 20):
+            chunk = {
+                "id": "chatcmpl-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "delta": {"content": content[start:start + 20]}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": "chatcmpl-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [],
+                "usage": completion["usage"],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def handle_upload(self):
+        # 借助 email 解析器读取 multipart/form-data
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(header + self.read_body())
+        fields = {}
+        filename = "upload.jsonl"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            fields[name] = part.get_payload(decode=True)
+            if name == "file":
+                filename = part.get_filename() or filename
+
+        with self.state.lock:
+            file_id = self.state.new_id("file")
+            self.state.files[file_id] = {
+                "filename": filename,
+                "purpose": (fields.get("purpose") or b"batch").decode("utf-8"),
+                "content": fields.get("file") or b"",
+                "created_at": int(time.time()),
+            }
+            self.send_json(file_object(file_id, self.state.files[file_id]))
+
+    def handle_get_file(self, file_id, content):
+        entry = self.state.files.get(file_id)
+        if entry is None:
+            self.send_json({"error": {"message": f"文件不存在: {file_id}"}}, 404)
+            return
+        if not content:
+            self.send_json(file_object(file_id, entry))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(entry["content"])))
+        self.end_headers()
+        self.wfile.write(entry["content"])
+
+    def handle_create_batch(self, body):
+        if body.get("input_file_id") not in self.state.files:
+            self.send_json({"error": {"message": "input_file_id 不存在"}}, 400)
+            return
+
+        with self.state.lock:
+            batch_id = self.state.new_id("batch")
+            batch = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body.get("endpoint"),
+                "input_file_id": body["input_file_id"],
+                "completion_window": body.get("completion_window"),
+                "metadata": body.get("metadata"),
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+            self.state.batches[batch_id] = batch
+            self.send_json(batch)
+
+    def handle_get_batch(self, batch_id):
+        with self.state.lock:
+            batch = self.state.batches.get(batch_id)
+            if batch is None:
+                self.send_json({"error": {"message": f"批处理任务不存在: {batch_id}"}}, 404)
+                return
+            if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.state.batch_delay:
+                run_batch(self.state, batch)
+            self.send_json(batch)
+
+
+def create_server(host="127.0.0.1", port=8765, batch_delay=0.0, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=None):
+    """创建本地替身服务，port 为0时自动选择空闲端口
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        batch_delay: 批处理任务创建后经过多少秒才完成
+        latency: chat.completions 请求的平均延迟秒数
+        jitter: 延迟上下浮动的秒数
+        error_rate: chat.completions 请求返回429或500错误的概率
+        retry_after: 提供时429响应带上该秒数的 Retry-After 响应头
+    """
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(batch_delay, latency, jitter, error_rate, retry_after)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容接口的本地替身服务，用于离线测试")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认为127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口（默认为8765）")
+    parser.add_argument("--batch-delay", type=float, default=0, help="批处理任务创建后经过多少秒才完成（默认为0）")
+    parser.add_argument("--latency", type=float, default=0, help="每次对话请求的平均延迟秒数（默认为0）")
+    parser.add_argument("--jitter", type=float, default=0, help="延迟上下浮动的秒数（默认为0）")
+    parser.add_argument("--error-rate", type=float, default=0, help="对话请求返回429或500错误的概率（默认为0）")
+    parser.add_argument("--retry-after", type=float, help="429响应带上的 Retry-After 秒数（默认不带）")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.batch_delay, args.latency, args.jitter, args.error_rate, args.retry_after)
+    print(f"本地替身服务已启动: http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
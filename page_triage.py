@@ -0,0 +1,185 @@
+import io
+import threading
+
+# 缩略图的最长边像素数，空白和重复检测都在缩略图上进行
+THUMBNAIL_SIZE = 512
+# 比纸张底色暗该比例以上的像素视为笔迹，透过纸背的字迹和浅色横线不计入
+INK_CONTRAST = 0.25
+# 计算墨迹覆盖率时忽略的四周边缘比例，扫描件边缘常有黑边和阴影
+EDGE_MARGIN = 0.05
+# 页面特征的网格大小（列数, 行数），每格为该区域的笔迹密度
+SIGNATURE_GRID = (24, 32)
+# 比较特征时上下左右最多错开的格数，容忍重新扫描时的位移
+MAX_SHIFT = 2
+
+DEFAULT_BLANK_INK = 0.005
+DEFAULT_DUPLICATE_SIMILARITY = 0.9
+# 两页的墨迹覆盖率相差超过该比例时不视为相似，不再比较特征
+DUPLICATE_INK_TOLERANCE = 0.35
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE):
+    """将已解码的页面图片缩小为灰度缩略图
+
+    先用 reduce 按整数倍快速缩小，再转为灰度并精确缩放，不在全分辨率图片上做颜色转换。
+    """
+    from PIL import Image
+
+    factor = max(1, min(image.width // size, image.height // size))
+    if factor > 1:
+        image = image.reduce(factor)
+    thumbnail = image.convert("L")
+    thumbnail.thumbnail((size, size), Image.BILINEAR)
+    return thumbnail
+
+
+def stack_thumbnails(thumbnails):
+    """将多页的缩略图垂直拼接为一张"""
+    from PIL import Image
+
+    if len(thumbnails) == 1:
+        return thumbnails[0]
+    stacked = Image.new("L", (max(t.width for t in thumbnails), sum(t.height for t in thumbnails)), 255)
+    y = 0
+    for thumbnail in thumbnails:
+        stacked.paste(thumbnail, (0, y))
+        y += thumbnail.height
+    return stacked
+
+
+def load_thumbnail(image_bytes, size=THUMBNAIL_SIZE):
+    """将编码后的页面图片解码为灰度缩略图
+
+    JPEG 图片通过 draft 在解码时直接缩小；PNG 等格式只能完整解码，渲染阶段应尽量
+    直接提供缩略图（见 PdfRenderer.save_group 的 thumbnail_size）。
+    image_bytes 为多页图片字节的列表时，各页缩略图垂直拼接为一张。
+    """
+    from PIL import Image
+
+    if isinstance(image_bytes, (list, tuple)):
+        return stack_thumbnails([load_thumbnail(part, size) for part in image_bytes])
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image.draft("L", (size, size))
+        return make_thumbnail(image, size)
+
+
+def ink_mask(thumbnail, contrast=INK_CONTRAST):
+    """返回笔迹掩码：以灰度中位数作为纸张底色，比底色暗 contrast 以上的像素为255，其余为0
+
+    以底色为基准，不受扫描亮度和纸张颜色的影响。
+    """
+    histogram = thumbnail.histogram()
+    total = sum(histogram)
+    count = 0
+    background = 255
+    for level, pixels in enumerate(histogram):
+        count += pixels
+        if count * 2 >= total:
+            background = level
+            break
+    cutoff = int(background * (1 - contrast))
+    return thumbnail.point(lambda value: 255 if value < cutoff else 0)
+
+
+def ink_coverage(mask, margin=EDGE_MARGIN):
+    """返回笔迹像素所占的比例，不计四周边缘"""
+    dx = int(mask.width * margin)
+    dy = int(mask.height * margin)
+    histogram = mask.crop((dx, dy, mask.width - dx, mask.height - dy)).histogram()
+    total = sum(histogram)
+    return histogram[255] / total if total else 0.0
+
+
+def page_signature(mask, grid=SIGNATURE_GRID):
+    """将笔迹掩码缩小为网格，每格为该区域的笔迹密度，作为页面的感知特征"""
+    from PIL import Image
+
+    return mask.resize(grid, Image.BOX)
+
+
+def signature_similarity(a, b, max_shift=MAX_SHIFT):
+    """返回两个页面特征的相似度（相关系数，1 表示完全相同）
+
+    在上下左右各错开 max_shift 格的范围内取最大值。只使用 Pillow 的图像运算，
+    协方差由 var(a) + var(b) - var(a - b) 求得。
+    """
+    from PIL import ImageChops, ImageStat
+
+    width, height = a.size
+    best = -1.0
+    for dx in range(-max_shift, max_shift + 1):
+        for dy in range(-max_shift, max_shift + 1):
+            crop_a = a.crop((max(0, dx), max(0, dy), width + min(0, dx), height + min(0, dy)))
+            crop_b = b.crop((max(0, -dx), max(0, -dy), width + min(0, -dx), height + min(0, -dy)))
+            var_a = ImageStat.Stat(crop_a).var[0]
+            var_b = ImageStat.Stat(crop_b).var[0]
+            if not var_a or not var_b:
+                continue
+            # subtract 的结果为 (a - b) / 2 + 128，方差需乘以4
+            var_diff = ImageStat.Stat(ImageChops.subtract(crop_a, crop_b, 2, 128)).var[0] * 4
+            best = max(best, (var_a + var_b - var_diff) / 2 / (var_a * var_b) ** 0.5)
+    return best
+
+
+class PageTriage:
+    """OCR前的页面分类：跳过空白页，标记同一文档中疑似重复的页面
+
+    每个页面组按缩略图的墨迹覆盖率判断是否空白。启用相似检测时，非空白的页面组与同一文档中
+    先前出现的页面组比较笔迹密度特征，相似时只标记为疑似重复，仍照常OCR：重新扫描的页面与
+    同一答题纸上不同学生的作答同样相似，无法区分，不能复用结果。图片内容完全相同的页面由
+    OCR结果缓存按图片内容命中，无需在此判断。
+    """
+
+    def __init__(self, blank_ink=DEFAULT_BLANK_INK, duplicate_similarity=None):
+        """
+        Args:
+            blank_ink: 墨迹覆盖率低于该比例的页面组视为空白
+            duplicate_similarity: 特征相似度不低于该值的页面组标记为疑似重复；为None时不检测
+        """
+        self.blank_ink = blank_ink
+        self.duplicate_similarity = duplicate_similarity
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def classify(self, pdf_path, page_number, thumbnail):
+        """判断页面组是否需要OCR
+
+        Args:
+            pdf_path: 页面组所属文档，只在同一文档内检测重复
+            page_number: 页面组的起始页码
+            thumbnail: 页面组的灰度缩略图，见 make_thumbnail 和 load_thumbnail
+
+        Returns:
+            dict: decision 为 "ocr" 或 "blank"，ink 为墨迹覆盖率；疑似重复时另含
+                similar_to（特征相似的页面组页码）和 similarity（特征相似度）
+        """
+        mask = ink_mask(thumbnail)
+        ink = ink_coverage(mask)
+        result = {"decision": "ocr", "ink": round(ink, 5)}
+        if ink < self.blank_ink:
+            result["decision"] = "blank"
+            return result
+        if self.duplicate_similarity is None:
+            return result
+
+        signature = page_signature(mask)
+        with self._lock:
+            seen = self._seen.setdefault(pdf_path, [])
+            others = [entry for entry in seen if entry[2] != page_number]
+            for other_signature, other_ink, other_page in others:
+                if abs(ink - other_ink) > DUPLICATE_INK_TOLERANCE * max(ink, other_ink):
+                    continue
+                similarity = signature_similarity(signature, other_signature)
+                if similarity >= self.duplicate_similarity:
+                    result.update(similar_to=other_page, similarity=round(similarity, 3))
+                    break
+            # 失败重试的页面组会再次分类，只保留第一次的特征
+            if len(others) == len(seen):
+                seen.append((signature, ink, page_number))
+        return result
+
+    def forget(self, pdf_path):
+        """删除文档的页面特征，文档处理完成后调用"""
+        with self._lock:
+            self._seen.pop(pdf_path, None)
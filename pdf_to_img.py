@@ -1,12 +1,508 @@
+import io
+import math
 import os
-from pdf2image import convert_from_path
-from PIL import Image
-from PyPDF2 import PdfReader, PdfWriter
+import shutil
+import tempfile
+import threading
+from metrics import timed
+from page_triage import load_thumbnail, make_thumbnail, stack_thumbnails
+
+
+# 多页页面组合成发送图片的方式：垂直拼接、网格拼接、每页作为单独的图片
+GROUP_MODES = ("stack", "grid", "parts")
+DEFAULT_GRID_PIXELS = 8_000_000
+
+# 图片格式对应的 PIL 保存格式和 MIME 类型
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "tif": ("TIFF", "image/tiff"),
+    "tiff": ("TIFF", "image/tiff"),
+}
+
+
+def image_mime_type(fmt):
+    """返回图片格式对应的 MIME 类型"""
+    return IMAGE_FORMATS.get(fmt.lower(), (fmt.upper(), f"image/{fmt.lower()}"))[1]
+
+
+def encode_image(image, fmt='png'):
+    """将PIL图片编码为指定格式的字节"""
+    buffer = io.BytesIO()
+    image.save(buffer, format=IMAGE_FORMATS.get(fmt.lower(), (fmt.upper(), None))[0])
+    return buffer.getvalue()
+
+
+def merge_images_vertically(images):
+    """将多张图片垂直拼接为一张图片
+
+    Args:
+        images: PIL图片列表
+
+    Returns:
+        Image: 拼接后的图片
+    """
+    from PIL import Image
+
+    total_width = max(img.width for img in images)
+    total_height = sum(img.height for img in images)
+
+    merged_image = Image.new('RGB', (total_width, total_height), (255, 255, 255))
+
+    y_offset = 0
+    for img in images:
+        merged_image.paste(img, (0, y_offset))
+        y_offset += img.height
+
+    return merged_image
+
+
+def tile_images(paths, max_pixels=DEFAULT_GRID_PIXELS):
+    """将多张页面图片按网格排列为一张图片，总像素不超过 max_pixels
+
+    先只读取各图片的尺寸确定缩放比例，再逐张读取、缩小并贴入画布，
+    内存中只保留画布和当前页面，不会生成全尺寸的拼接图片。
+
+    Args:
+        paths: 按页码顺序排列的图片路径
+        max_pixels: 拼接后图片的像素总数上限
+
+    Returns:
+        Image: 拼接后的图片，每行最多 ceil(sqrt(页数)) 页
+    """
+    from PIL import Image
+
+    sizes = []
+    for path in paths:
+        with Image.open(path) as img:
+            sizes.append(img.size)
+    cell_width = max(width for width, _ in sizes)
+    cell_height = max(height for _, height in sizes)
+    cols = math.ceil(math.sqrt(len(paths)))
+    rows = math.ceil(len(paths) / cols)
+
+    scale = min(1.0, math.sqrt(max_pixels / (cols * cell_width * rows * cell_height)))
+    cell_width = max(1, int(cell_width * scale))
+    cell_height = max(1, int(cell_height * scale))
+
+    canvas = Image.new('RGB', (cols * cell_width, rows * cell_height), (255, 255, 255))
+    for index, path in enumerate(paths):
+        with Image.open(path) as img:
+            # thumbnail 先按整数倍快速缩小再精确缩放，JPEG 在解码时即可缩小
+            img.draft('RGB', (cell_width, cell_height))
+            img.thumbnail((cell_width, cell_height), Image.LANCZOS)
+            canvas.paste(img, ((index % cols) * cell_width, (index // cols) * cell_height))
+    return canvas
+
+
+class RenderChunk:
+    """iter_groups 合并的一段连续页面，由一个线程调用一次 pdftoppm 渲染整段
+
+    渲染在流水线渲染阶段的工作线程中进行。页面组按页码顺序进入渲染阶段，取用的块正由
+    其他线程渲染时，先渲染之后尚未开始的块，使多个工作线程同时渲染不同的块。
+    """
+
+    def __init__(self, renderer, first_page, last_page):
+        """
+        Args:
+            renderer: PdfRenderer 实例
+            first_page: 块的起始页码
+            last_page: 块的结束页码
+        """
+        self.renderer = renderer
+        self.first_page = first_page
+        self.last_page = last_page
+        # 同一文档中的下一个块，由 iter_groups 设置
+        self.next = None
+        self._lock = threading.Lock()
+        self._started = False
+        self._paths = None
+        self._failed = False
+        self._thumbnail_lock = threading.Lock()
+        self._thumbnails = None
+
+    def render(self, blocking=True):
+        """渲染整块，已渲染时直接返回
+
+        每个块由一个 pdftoppm 进程渲染，并发由同时渲染的块数决定。
+
+        Returns:
+            bool: blocking 为 False 且其他线程正在渲染该块时返回 False，否则返回 True
+        """
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            if not self._started:
+                self._started = True
+                try:
+                    self._paths = self.renderer.render_range(self.first_page, self.last_page, thread_count=1)
+                except Exception as e:
+                    print(f"批量渲染第 {self.first_page} 至 {self.last_page} 页失败，将逐组重新渲染: {e}")
+                    self._failed = True
+        finally:
+            self._lock.release()
+        return True
+
+    def prefetch(self):
+        """渲染之后第一个尚未开始渲染的块"""
+        chunk = self.next
+        while chunk is not None:
+            if not chunk._started and chunk.render(blocking=False):
+                return
+            chunk = chunk.next
+
+    def take(self, first_page, last_page):
+        """返回块中一个页面组的图片路径，块尚未渲染时先渲染
+
+        Returns:
+            list: 按页码顺序排列的图片文件路径；整块渲染失败时返回 None，由调用方逐组重新渲染
+        """
+        if not self.render(blocking=False):
+            self.prefetch()
+            self.render()
+        if self._failed:
+            return None
+        return self._paths[first_page - self.first_page:last_page - self.first_page + 1]
+
+    def take_thumbnails(self, first_page, last_page, size):
+        """返回块中一个页面组的灰度缩略图，整块的缩略图只调用一次 pdftoppm 渲染
+
+        Returns:
+            list: 按页码顺序排列的灰度PIL图片
+        """
+        with self._thumbnail_lock:
+            if self._thumbnails is None or self._thumbnails[0] != size:
+                self._thumbnails = (size, self.renderer.render_thumbnails(self.first_page, self.last_page, size))
+        return self._thumbnails[1][first_page - self.first_page:last_page - self.first_page + 1]
+
+
+class PdfRenderer:
+    """文档级PDF渲染器
+
+    只读取一次PDF信息，将连续多页合并为渲染块，每块调用一次 pdftoppm 渲染到临时目录，
+    避免每页单独启动 poppler 进程并重新解析PDF。
+    多页的页面组按 group_mode 组合：stack 垂直拼接为一张图片，grid 按像素预算网格拼接，
+    parts 不拼接，每页作为单独的图片返回。
+    """
+
+    def __init__(self, pdf_path, dpi=300, fmt='png', thread_count=1, chunk_size=8, work_dir=None, group_mode="stack", grid_pixels=DEFAULT_GRID_PIXELS):
+        """
+        Args:
+            pdf_path: PDF文件路径
+            dpi: 输出图片的DPI（分辨率）
+            fmt: 输出图片格式（png, jpg等）
+            thread_count: 渲染并发数：iter_groups 至少划分出该数量的渲染块供渲染阶段的工作线程同时渲染，
+                直接调用 render_range 时为 pdftoppm 的并发进程数
+            chunk_size: 每次调用 pdftoppm 渲染的页数
+            work_dir: 临时渲染目录所在的目录，默认为系统临时目录
+            group_mode: 多页页面组的组合方式，见 GROUP_MODES
+            grid_pixels: grid 模式下拼接图片的像素总数上限
+        """
+        if group_mode not in GROUP_MODES:
+            raise ValueError(f"不支持的页面组合方式: {group_mode}")
+
+        self.pdf_path = pdf_path
+        self.dpi = dpi
+        self.fmt = fmt
+        self.group_mode = group_mode
+        self.grid_pixels = grid_pixels
+        self.mime_type = image_mime_type(fmt)
+        self.thread_count = max(1, thread_count)
+        self.chunk_size = max(1, chunk_size)
+        self.base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+
+        from pdf2image import pdfinfo_from_path
+
+        try:
+            self.page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        except Exception as e:
+            raise ValueError(f"无法读取PDF文件: {e}")
+
+        if work_dir and not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        self._temp_dir = tempfile.mkdtemp(prefix=".render_", dir=work_dir)
+        self._reader = None
+        self._reader_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """删除临时渲染目录"""
+        shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+    def page_range(self, page_number, pages_per_image=1):
+        """返回以 page_number 开始的页面组的首尾页码"""
+        if page_number < 1:
+            raise ValueError("页码必须从1开始")
+        if pages_per_image < 1:
+            raise ValueError("每张图片的页数必须大于等于1")
+        if page_number > self.page_count:
+            raise ValueError(f"页码 {page_number} 超出PDF页数范围")
+        return page_number, min(page_number + pages_per_image - 1, self.page_count)
+
+    def render_range(self, first_page, last_page, dpi=None, thread_count=None):
+        """渲染连续页面到临时目录
+
+        Args:
+            first_page: 起始页码
+            last_page: 结束页码
+            dpi: 本次渲染的DPI，为None时使用渲染器的DPI
+            thread_count: pdftoppm 的并发进程数，为None时使用渲染器的 thread_count
+
+        Returns:
+            list: 按页码顺序排列的图片文件路径
+        """
+        from pdf2image import convert_from_path
+
+        dpi = dpi or self.dpi
+        output_folder = tempfile.mkdtemp(dir=self._temp_dir)
+        with timed("render", first_page=first_page, pages=last_page - first_page + 1, dpi=dpi):
+            paths = convert_from_path(
+                self.pdf_path,
+                dpi=dpi,
+                fmt=self.fmt,
+                first_page=first_page,
+                last_page=last_page,
+                output_folder=output_folder,
+                paths_only=True,
+                thread_count=thread_count or self.thread_count
+            )
+        if len(paths) != last_page - first_page + 1:
+            raise ValueError(f"无法转换第 {first_page} 至 {last_page} 页")
+        return paths
+
+    def render_thumbnails(self, first_page, last_page, size):
+        """由 pdftoppm 直接渲染连续页面的灰度缩略图，最长边为 size 像素
+
+        PNG 无法在解码时缩小，完整解码全分辨率渲染结果的开销与渲染本身相当，
+        页面分类需要的缩略图改为直接以小尺寸渲染。
+
+        Returns:
+            list: 按页码顺序排列的灰度PIL图片
+        """
+        from pdf2image import convert_from_path
+
+        with timed("thumbnail", first_page=first_page, pages=last_page - first_page + 1):
+            return convert_from_path(
+                self.pdf_path,
+                size=size,
+                grayscale=True,
+                first_page=first_page,
+                last_page=last_page
+            )
+
+    def iter_groups(self, page_numbers, pages_per_image=1, group_sizes=None):
+        """将页面组合并为渲染块并逐组返回，不在此处渲染
+
+        首尾相接的页面组合并为同一块，每块不超过 chunk_size 页；页数较少时缩小块的大小，
+        使渲染阶段的 thread_count 个工作线程都有块可以渲染。
+
+        Args:
+            page_numbers: 各页面组的起始页码
+            pages_per_image: 每组包含的页数
+            group_sizes: 各页面组起始页码到页数的映射，提供时覆盖 pages_per_image
+
+        Yields:
+            tuple: (起始页码, 该组所在的 RenderChunk)，由 save_group 取出图片路径
+        """
+        group_sizes = group_sizes or {}
+        groups = [self.page_range(page_number, group_sizes.get(page_number, pages_per_image)) for page_number in page_numbers]
+        total_pages = sum(last - first + 1 for first, last in groups)
+        chunk_size = max(1, min(self.chunk_size, math.ceil(total_pages / self.thread_count)))
+
+        chunks = []
+        for group in groups:
+            if chunks:
+                chunk = chunks[-1]
+                chunk_pages = chunk[-1][1] - chunk[0][0] + 1
+                if group[0] == chunk[-1][1] + 1 and chunk_pages < chunk_size:
+                    chunk.append(group)
+                    continue
+            chunks.append([group])
+
+        render_chunks = [RenderChunk(self, chunk[0][0], chunk[-1][1]) for chunk in chunks]
+        for render_chunk, next_chunk in zip(render_chunks, render_chunks[1:]):
+            render_chunk.next = next_chunk
+        for chunk, render_chunk in zip(chunks, render_chunks):
+            for group_first, _ in chunk:
+                yield group_first, render_chunk
+
+    def load_group(self, page_number, rendered_paths, pages_per_image=1):
+        """读取渲染好的页面组为PIL图片，同时删除临时文件
+
+        Args:
+            page_number: 页面组的起始页码
+            rendered_paths: 已渲染的图片路径，为 None 时重新渲染
+            pages_per_image: 每组包含的页数
+
+        Returns:
+            Image: 页面图片，多页时按 group_mode 拼接；parts 模式下多页时返回图片列表
+        """
+        first_page, last_page = self.page_range(page_number, pages_per_image)
+        if rendered_paths is None:
+            rendered_paths = self.render_range(first_page, last_page)
+
+        from PIL import Image
+
+        try:
+            if self.group_mode == "grid" and len(rendered_paths) > 1:
+                return tile_images(rendered_paths, self.grid_pixels)
+
+            images = []
+            for path in rendered_paths:
+                with Image.open(path) as img:
+                    img.load()
+                    images.append(img)
+            if len(images) == 1:
+                return images[0]
+            if self.group_mode == "parts":
+                return images
+            return merge_images_vertically(images)
+        finally:
+            for path in rendered_paths:
+                os.remove(path)
+
+    def encode_group(self, page_number, rendered_paths, pages_per_image=1):
+        """读取渲染好的页面组并返回编码后的图片字节，同时删除临时文件
+
+        Args:
+            page_number: 页面组的起始页码
+            rendered_paths: 已渲染的图片路径，为 None 时重新渲染
+            pages_per_image: 每组包含的页数
+
+        Returns:
+            bytes: 按渲染格式编码的图片，多页时按 group_mode 拼接；parts 模式下多页时返回各页字节的列表
+        """
+        first_page, last_page = self.page_range(page_number, pages_per_image)
+        if rendered_paths is None:
+            rendered_paths = self.render_range(first_page, last_page)
+
+        try:
+            # pdftoppm 已按目标格式输出，单页和 parts 模式直接读取即可
+            if len(rendered_paths) == 1 or self.group_mode == "parts":
+                parts = []
+                for path in rendered_paths:
+                    with open(path, "rb") as f:
+                        parts.append(f.read())
+                return parts[0] if len(parts) == 1 else parts
+            if self.group_mode == "grid":
+                return encode_image(tile_images(rendered_paths, self.grid_pixels), self.fmt)
+
+            from PIL import Image
+
+            images = [Image.open(path) for path in rendered_paths]
+            try:
+                return encode_image(merge_images_vertically(images), self.fmt)
+            finally:
+                for img in images:
+                    img.close()
+        finally:
+            for path in rendered_paths:
+                os.remove(path)
+
+    def save_group(self, page_number, rendered_paths, output_dir, save_pdf=False, pages_per_image=1, keep_image=True, preprocessor=None, dpi=None, thumbnail_size=None):
+        """将渲染好的页面组编码为图片，并可选择保存图片和对应的PDF
+
+        Args:
+            page_number: 页面组的起始页码
+            rendered_paths: iter_groups 返回的 RenderChunk 或已渲染的图片路径，为 None 时重新渲染
+            output_dir: 输出目录
+            save_pdf: 是否保存该组页面的PDF文件
+            pages_per_image: 每组包含的页数
+            keep_image: 是否将图片保存到输出目录
+            preprocessor: ImagePreprocessor 实例，提供时按其设置压缩图片
+            dpi: rendered_paths 为 None 时重新渲染使用的DPI，为None时使用渲染器的DPI
+            thumbnail_size: 提供时另外返回最长边为该像素数的灰度缩略图，供页面分类使用
+
+        Returns:
+            字典，包含图片字节、MIME 类型，以及可选的图片路径、PDF路径和缩略图；
+            parts 模式下多页时图片字节和图片路径均为按页排列的列表
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        chunk = None
+        if isinstance(rendered_paths, RenderChunk):
+            chunk = rendered_paths
+            rendered_paths = chunk.take(*self.page_range(page_number, pages_per_image))
+        if rendered_paths is None:
+            rendered_paths = self.render_range(*self.page_range(page_number, pages_per_image), dpi)
+
+        decoded = None
+        with timed("encode"):
+            if preprocessor is None:
+                image_bytes = self.encode_group(page_number, rendered_paths, pages_per_image)
+                mime_type, extension = self.mime_type, self.fmt
+            else:
+                image = decoded = self.load_group(page_number, rendered_paths, pages_per_image)
+                if isinstance(image, list):
+                    image_bytes = [preprocessor.process(part) for part in image]
+                else:
+                    image_bytes = preprocessor.process(image)
+                mime_type, extension = preprocessor.mime_type, preprocessor.extension
+        result = {"image_bytes": image_bytes, "mime_type": mime_type}
+
+        if thumbnail_size:
+            # 已解码的图片直接缩小，JPEG 可在解码时缩小，其他格式按渲染块一次渲染整块的小图，都不完整解码全分辨率图片
+            if decoded is not None:
+                parts = decoded if isinstance(decoded, list) else [decoded]
+                result["thumbnail"] = stack_thumbnails([make_thumbnail(part, thumbnail_size) for part in parts])
+            elif mime_type == "image/jpeg":
+                result["thumbnail"] = load_thumbnail(image_bytes, thumbnail_size)
+            elif chunk is not None:
+                pages = chunk.take_thumbnails(*self.page_range(page_number, pages_per_image), thumbnail_size)
+                result["thumbnail"] = stack_thumbnails([make_thumbnail(page, thumbnail_size) for page in pages])
+            else:
+                pages = self.render_thumbnails(*self.page_range(page_number, pages_per_image), thumbnail_size)
+                result["thumbnail"] = stack_thumbnails([make_thumbnail(page, thumbnail_size) for page in pages])
+
+        if keep_image:
+            # parts 模式下每页分别保存，文件名使用各自的页码
+            parts = image_bytes if isinstance(image_bytes, list) else [image_bytes]
+            image_paths = []
+            for index, data in enumerate(parts):
+                image_path = os.path.join(output_dir, f"{self.base_filename}_page_{page_number + index}.{extension}")
+                with open(image_path, "wb") as f:
+                    f.write(data)
+                image_paths.append(image_path)
+            result["image_path"] = image_paths if isinstance(image_bytes, list) else image_paths[0]
+
+        if save_pdf:
+            first_page, last_page = self.page_range(page_number, pages_per_image)
+            pdf_path_out = os.path.join(output_dir, f"{self.base_filename}_page_{page_number}.pdf")
+            self.save_pages_pdf(first_page, last_page, pdf_path_out)
+            result["pdf_path"] = pdf_path_out
+
+        return result
+
+    def save_pages_pdf(self, first_page, last_page, pdf_path_out):
+        """将指定范围的页面保存为新的PDF文件"""
+        from PyPDF2 import PdfReader, PdfWriter
+
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = PdfReader(self.pdf_path)
+
+            pdf_writer = PdfWriter()
+            # PyPDF2的页码从0开始，需要减1
+            for i in range(first_page - 1, last_page):
+                pdf_writer.add_page(self._reader.pages[i])
+
+            with open(pdf_path_out, "wb") as output_pdf:
+                pdf_writer.write(output_pdf)
 
 
 def pdf_to_image(pdf_path, page_number, output_dir='output', dpi=300, fmt='png', save_pdf=False, pages_per_image=1):
     """将PDF文件的指定页转换为图片，并可选择保存单页PDF
-    
+
+    只处理一个页面组的简便接口，由 PdfRenderer 完成渲染和保存。处理多个页面组时
+    应直接使用 PdfRenderer，避免每次调用都重新读取PDF信息。
+
     Args:
         pdf_path: PDF文件路径
         page_number: 需要转换的页码（从1开始）
@@ -15,89 +511,12 @@ def pdf_to_image(pdf_path, page_number, output_dir='output', dpi=300, fmt='png',
         fmt: 输出图片格式（png, jpg等）
         save_pdf: 是否保存单页PDF文件
         pages_per_image: 每张图片包含的PDF页数，默认为1
-    
+
     Returns:
-        字典，包含输出图片路径和可选的PDF路径
+        字典，包含输出图片路径和可选的PDF路径，见 PdfRenderer.save_group
     """
-    # 确保输出目录存在
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # 检查页码有效性
-    if page_number < 1:
-        raise ValueError("页码必须从1开始")
-    
-    # 检查pages_per_image参数有效性
-    if pages_per_image < 1:
-        raise ValueError("每张图片的页数必须大于等于1")
-    
-    # 计算结束页码
-    last_page = page_number + pages_per_image - 1
-    
-    # 转换PDF为图片
-    images = convert_from_path(
-        pdf_path, 
-        dpi=dpi,
-        first_page=page_number,
-        last_page=last_page
-    )
-    
-    if not images:
-        raise ValueError(f"无法转换页码 {page_number}，可能超出PDF页数范围")
-    
-    # 获取文件名（不含路径和扩展名）
-    base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
-    
-    # 保存图片
-    if pages_per_image == 1:
-        # 单页模式，直接保存
-        image_path = os.path.join(output_dir, f"{base_filename}_page_{page_number}.{fmt}")
-        images[0].save(image_path, format=fmt.upper())
-    else:
-        # 多页模式，垂直拼接图片
-        image_path = os.path.join(output_dir, f"{base_filename}_page_{page_number}.{fmt}")
-        
-        # 计算拼接后的图片尺寸
-        total_width = max(img.width for img in images)
-        total_height = sum(img.height for img in images)
-        
-        # 创建新图片
-        merged_image = Image.new('RGB', (total_width, total_height), (255, 255, 255))
-        
-        # 垂直拼接图片
-        y_offset = 0
-        for img in images:
-            merged_image.paste(img, (0, y_offset))
-            y_offset += img.height
-        
-        # 保存拼接后的图片
-        merged_image.save(image_path, format=fmt.upper())
-    
-    result = {"image_path": image_path}
-    
-    # 如果需要，保存PDF
-    if save_pdf:
-        pdf_path_out = os.path.join(output_dir, f"{base_filename}_page_{page_number}.pdf")
-        
-        # 使用PyPDF2提取页面并保存
-        pdf_reader = PdfReader(pdf_path)
-        pdf_writer = PdfWriter()
-        
-        # 检查页码范围
-        if page_number <= len(pdf_reader.pages):
-            # PyPDF2的页码从0开始，需要减1
-            for i in range(page_number - 1, min(last_page, len(pdf_reader.pages))):
-                pdf_writer.add_page(pdf_reader.pages[i])
-            
-            # 保存提取的页面到新PDF
-            with open(pdf_path_out, "wb") as output_pdf:
-                pdf_writer.write(output_pdf)
-            
-            result["pdf_path"] = pdf_path_out
-        else:
-            raise ValueError(f"页码 {page_number} 超出PDF页数范围")
-    
-    return result
+    with PdfRenderer(pdf_path, dpi, fmt, work_dir=output_dir) as renderer:
+        return renderer.save_group(page_number, None, output_dir, save_pdf, pages_per_image)
 
 
 if __name__ == "__main__":
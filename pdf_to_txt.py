@@ -1,43 +1,122 @@
-from openai import OpenAI
+import asyncio
 import os
 import base64
-from dotenv import load_dotenv
+import json
+import mimetypes
 import re
+import threading
+from async_http import get_http_client
+from batch_api import build_request_line
+from metrics import recorder as metrics
+from rate_limit import RateLimiter, call_with_retry, call_with_retry_async
+from streaming import collect_stream, collect_stream_async
 
-# 加载.env文件中的环境变量
-load_dotenv()
+# 客户端在第一次请求时才创建，openai 导入较慢，--help 和不需要请求的命令无需等待
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+rate_limiter = RateLimiter()
 
-# 从环境变量获取API密钥和基础URL
-api_key = os.getenv("OPENROUTER_API_KEY")
-if not api_key:
-    raise ValueError("OPENROUTER_API_KEY 未在环境变量中设置")
 
-base_url = os.getenv("OPENROUTER_BASE_URL")
-if not base_url:
-    raise ValueError("OPENROUTER_BASE_URL 未在环境变量中设置")
+def get_api_config():
+    """从环境变量（及.env文件）获取API密钥和基础URL
 
-client = OpenAI(
-    base_url=base_url,
-    api_key=api_key,
-)
+    Returns:
+        tuple: (api_key, base_url)
+
+    Raises:
+        ValueError: 环境变量未设置时
+    """
+    from dotenv import load_dotenv
+
+    # 加载.env文件中的环境变量
+    load_dotenv()
+
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY 未在环境变量中设置")
+
+    base_url = os.getenv("OPENROUTER_BASE_URL")
+    if not base_url:
+        raise ValueError("OPENROUTER_BASE_URL 未在环境变量中设置")
+    return api_key, base_url
+
+
+def get_client():
+    """返回同步客户端，第一次调用时导入 openai 并创建"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+
+            api_key, base_url = get_api_config()
+            # 重试由 rate_limiter 统一控制，关闭客户端自带的重试
+            _client = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                max_retries=0,
+            )
+    return _client
+
+OCR_MODEL = "google/gemini-2.5-pro-preview"
+
+# 结构化输出模式下追加到OCR提示末尾的说明
+STRUCTURED_OCR_INSTRUCTION = """
+        - 以JSON格式输出：name 为最上方手写的中文姓名（没有时为空字符串），body 为姓名以外的全部识别内容，confidence 为0到1之间的数字，表示对识别结果的把握程度。
+        """
+
+# 一次请求发送多张图片时追加到OCR提示末尾的说明
+MULTI_IMAGE_INSTRUCTION = """
+        - 以下 {count} 张图片依次为同一份作业的连续页面，请按图片顺序识别，合并为一份内容输出，姓名只在第一行输出一次。
+        """
+
+# 结构化输出模式下要求模型返回的 JSON 结构
+STRUCTURED_OCR_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "body": {"type": "string"},
+        "confidence": {"type": "number"},
+    },
+    "required": ["name", "body", "confidence"],
+    "additionalProperties": False,
+}
+
+STRUCTURED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "ocr_result", "strict": True, "schema": STRUCTURED_OCR_SCHEMA},
+}
+
+
+def read_image_bytes(image_path):
+    """读取本地图片的原始字节"""
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
 
 
 def encode_image_to_base64(image_path):
     """将本地图片转换为base64编码"""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+    return base64.b64encode(read_image_bytes(image_path)).decode('utf-8')
 
 
-def analyze_image(image_path, prompt):
-    """使用LLM分析图片内容
+def as_image_list(image_bytes):
+    """将单张图片的字节或多张图片字节的列表统一为列表"""
+    return list(image_bytes) if isinstance(image_bytes, (list, tuple)) else [image_bytes]
 
-    Args:
-        image_path: 本地图片路径
-        prompt: 提示文本
-    
-    Returns:
-        str: 分析后的文本内容
+
+def image_size(image_bytes):
+    """返回图片（或多张图片合计）的字节数"""
+    return sum(len(part) for part in as_image_list(image_bytes))
+
+
+def build_image_messages(image_bytes, prompt, mime_type="image/png"):
+    """构造包含提示文本和图片的消息列表
+
+    image_bytes 为列表时，各页作为同一条消息中的多张图片按顺序发送。
     """
+    images = as_image_list(image_bytes)
+    if len(images) > 1:
+        prompt = prompt.rstrip() + MULTI_IMAGE_INSTRUCTION.format(count=len(images))
     content = [
         {
             "type": "text",
@@ -46,25 +125,190 @@ def analyze_image(image_path, prompt):
     ]
 
     # 本地图片需要转为base64
-    base64_image = encode_image_to_base64(image_path)
-    content.append({
-        "type": "image_url",
-        "image_url": {
-            "url": f"data:image/png;base64,{base64_image}"
-        }
-    })
-
-    completion = client.chat.completions.create(
-        model="google/gemini-2.5-pro-preview",
-        messages=[
-            {
-                "role": "user",
-                "content": content
+    for image in images:
+        base64_image = base64.b64encode(image).decode('utf-8')
+        content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime_type};base64,{base64_image}"
             }
-        ]
-    )
+        })
+
+    return [
+        {
+            "role": "user",
+            "content": content
+        }
+    ]
+
+
+def ocr_cache_key(cache, image_bytes, prompt):
+    """返回图片OCR结果在缓存中的键，多张图片时依次计入每张图片"""
+    return cache.make_key(*as_image_list(image_bytes), OCR_MODEL, prompt)
+
+
+def build_batch_request(custom_id, image_bytes, prompt, mime_type="image/png", structured=False):
+    """构造OCR识别的批处理请求行，structured 为True时要求返回JSON结构"""
+    options = {"response_format": STRUCTURED_RESPONSE_FORMAT} if structured else {}
+    return build_request_line(custom_id, OCR_MODEL, build_image_messages(image_bytes, prompt, mime_type), **options)
+
+
+def structured_prompt(prompt):
+    """返回要求以JSON结构输出姓名、正文和置信度的OCR提示"""
+    return prompt.rstrip() + STRUCTURED_OCR_INSTRUCTION
+
+
+def parse_ocr_result(content):
+    """将OCR返回内容解析为姓名、正文和置信度
+
+    结构化输出无法解析为JSON时，退回按第一行提取中文姓名的方式。
+
+    Args:
+        content: OCR模型返回的内容
+
+    Returns:
+        dict: {"name": 姓名, "body": 正文, "confidence": 置信度或None, "structured": 是否为有效的结构化结果}
+    """
+    text = (content or "").strip()
+    # 部分模型会将JSON包在代码块中返回
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    try:
+        data = json.loads(fenced.group(1) if fenced else text)
+    except ValueError:
+        data = None
+
+    if isinstance(data, dict) and isinstance(data.get("body"), str):
+        confidence = data.get("confidence")
+        return {
+            "name": re.sub(r"\s+", "", str(data.get("name") or "")),
+            "body": data["body"].strip(),
+            "confidence": float(confidence) if isinstance(confidence, (int, float)) else None,
+            "structured": True,
+        }
+
+    name = extract_chinese_name(text)
+    body = text.split("\n", 1)[1].strip() if name and "\n" in text else ("" if name else text)
+    return {"name": name, "body": body, "confidence": None, "structured": False}
+
+
+def format_ocr_text(fields):
+    """将姓名和正文拼接为第一行为姓名的文本，与普通OCR输出的格式一致"""
+    if fields["name"]:
+        return f"{fields['name']}\n{fields['body']}"
+    return fields["body"]
+
+
+def guess_mime_type(image_path):
+    """根据文件扩展名判断图片的 MIME 类型"""
+    return mimetypes.guess_type(image_path)[0] or "image/png"
+
+
+def analyze_image(image_path, prompt, cache=None):
+    """使用LLM分析图片内容
+
+    Args:
+        image_path: 本地图片路径
+        prompt: 提示文本
+        cache: ResultCache 实例，命中时直接返回缓存结果，默认为None（不使用缓存）
+    
+    Returns:
+        str: 分析后的文本内容
+    """
+    return analyze_image_bytes(read_image_bytes(image_path), prompt, cache, guess_mime_type(image_path))
+
+
+def analyze_image_bytes(image_bytes, prompt, cache=None, mime_type="image/png", stream_path=None, structured=False):
+    """使用LLM分析内存中已编码的图片
+
+    Args:
+        image_bytes: 已编码的图片字节，为列表时作为同一份作业的连续页面在一次请求中发送
+        prompt: 提示文本
+        cache: ResultCache 实例，命中时直接返回缓存结果，默认为None（不使用缓存）
+        mime_type: 图片的 MIME 类型
+        stream_path: 提供时以流式方式请求，并将收到的内容实时写入该文件
+        structured: 是否通过 response_format 要求返回JSON结构，提示应由 structured_prompt 生成，
+            返回内容用 parse_ocr_result 解析
+
+    Returns:
+        str: 分析后的文本内容
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = ocr_cache_key(cache, image_bytes, prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    messages = build_image_messages(image_bytes, prompt, mime_type)
+    options = {"response_format": STRUCTURED_RESPONSE_FORMAT} if structured else {}
+    # 客户端在计时之外创建，阶段耗时只包含API调用，排队和重试等待另行记录
+    client = get_client()
+
+    def request():
+        if stream_path:
+            stream = client.chat.completions.create(
+                model=OCR_MODEL, messages=messages, stream=True, stream_options={"include_usage": True}, **options
+            )
+            return collect_stream(stream, stream_path, OCR_MODEL)
+        completion = client.chat.completions.create(model=OCR_MODEL, messages=messages, **options)
+        metrics.record_usage(completion.usage, OCR_MODEL)
+        return completion.choices[0].message.content
+
+    result = call_with_retry(request, rate_limiter, "OCR识别请求", "ocr_request", bytes_sent=image_size(image_bytes))
+
+    if cache is not None and result:
+        cache.set(cache_key, result)
+    return result
+
+
+def get_async_client():
+    """返回使用共享连接池的异步客户端，需在事件循环内调用"""
+    global _async_client
+    http_client = get_http_client()
+    if _async_client is None or _async_client[0] is not http_client:
+        from openai import AsyncOpenAI
+
+        api_key, base_url = get_api_config()
+        _async_client = (http_client, AsyncOpenAI(
+            base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0
+        ))
+    return _async_client[1]
+
+
+async def analyze_image_async(image_path, prompt, cache=None):
+    """analyze_image 的异步版本，参数和返回值相同"""
+    image_bytes = await asyncio.to_thread(read_image_bytes, image_path)
+    return await analyze_image_bytes_async(image_bytes, prompt, cache, guess_mime_type(image_path))
+
+
+async def analyze_image_bytes_async(image_bytes, prompt, cache=None, mime_type="image/png", stream_path=None, structured=False):
+    """analyze_image_bytes 的异步版本，参数和返回值相同"""
+    cache_key = None
+    if cache is not None:
+        cache_key = ocr_cache_key(cache, image_bytes, prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    messages = build_image_messages(image_bytes, prompt, mime_type)
+    options = {"response_format": STRUCTURED_RESPONSE_FORMAT} if structured else {}
+    async_client = get_async_client()
+
+    async def request():
+        if stream_path:
+            stream = await async_client.chat.completions.create(
+                model=OCR_MODEL, messages=messages, stream=True, stream_options={"include_usage": True}, **options
+            )
+            return await collect_stream_async(stream, stream_path, OCR_MODEL)
+        completion = await async_client.chat.completions.create(model=OCR_MODEL, messages=messages, **options)
+        metrics.record_usage(completion.usage, OCR_MODEL)
+        return completion.choices[0].message.content
+
+    result = await call_with_retry_async(request, rate_limiter, "OCR识别请求", "ocr_request", bytes_sent=image_size(image_bytes))
 
-    return completion.choices[0].message.content
+    if cache is not None and result:
+        cache.set(cache_key, result)
+    return result
 
 
 def extract_chinese_name(text):
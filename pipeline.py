@@ -0,0 +1,262 @@
+import asyncio
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Callable
+
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    """流水线中的一个处理阶段
+
+    Attributes:
+        name: 阶段名称，用于日志和错误记录
+        func: 处理函数，接收任务字典并返回（更新后的）任务字典；
+            batch_size 大于1时接收并返回任务字典列表
+        workers: 该阶段的并发工作线程数
+        batch_size: 每次交给处理函数的最大任务数
+        batch_wait: 凑批时等待后续任务的最长秒数
+    """
+
+    name: str
+    func: Callable
+    workers: int = 1
+    batch_size: int = 1
+    batch_wait: float = 1.0
+
+
+class AsyncBatcher:
+    """在 asyncio 中将逐个提交的任务凑批后交给批处理函数
+
+    凑满 batch_size 个任务或第一个任务等待超过 batch_wait 秒时执行一次批处理。
+    """
+
+    def __init__(self, func, batch_size, batch_wait=1.0):
+        """
+        Args:
+            func: 异步批处理函数，接收并返回任务字典列表
+            batch_size: 每批最大任务数
+            batch_wait: 凑批时等待后续任务的最长秒数
+        """
+        self.func = func
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, job):
+        """提交任务并等待所在批次处理完成，返回处理后的任务字典"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((job, future))
+
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending):
+        try:
+            processed = await self.func([job for job, _ in pending])
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), job in zip(pending, processed):
+            future.set_result(job)
+
+
+class PagePipeline:
+    """按阶段并发执行页面任务的流水线
+
+    每个阶段拥有独立的工作线程池，阶段之间通过有界队列连接，
+    上游阶段在下游处理不过来时会被阻塞，从而限制内存中的任务数量。
+    任一阶段抛出异常时，任务被标记为失败并直接进入结果队列，不再执行后续阶段。
+    任务字典中 skip_stages 列出的阶段会被直接跳过。
+    """
+
+    def __init__(self, stages, queue_size=4, listener=None):
+        """
+        Args:
+            stages: Stage 列表，按执行顺序排列
+            queue_size: 阶段之间队列的最大长度
+            listener: 每个阶段完成或失败后调用的函数，参数为 (阶段名称, 任务字典, 错误信息或None)
+        """
+        if not stages:
+            raise ValueError("流水线至少需要一个阶段")
+        for stage in stages:
+            if stage.workers < 1:
+                raise ValueError(f"阶段 {stage.name} 的并发数必须大于等于1")
+
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.listener = listener
+
+    def run(self, jobs, on_result=None):
+        """执行所有任务
+
+        Args:
+            jobs: 任务字典的可迭代对象，可以是持续产生任务的生成器
+            on_result: 提供时，每个处理完成（含失败）的任务在完成时交给该函数，
+                不再保存在返回列表中，适合长时间运行的任务源
+
+        Returns:
+            list: 处理完成（含失败）的任务字典列表，顺序与完成顺序一致
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = queue.Queue()
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else results
+            next_workers = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            remaining = [stage.workers]
+            lock = threading.Lock()
+
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(stage, inbox, outbox, results, remaining, lock, next_workers),
+                    name=f"{stage.name}-{worker_index}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        feeder = threading.Thread(
+            target=self._feed, args=(jobs, queues[0], self.stages[0].workers), daemon=True
+        )
+        feeder.start()
+
+        finished = []
+        while True:
+            item = results.get()
+            if item is _STOP:
+                break
+            if on_result is None:
+                finished.append(item)
+                continue
+            try:
+                on_result(item)
+            except Exception as e:
+                print(f"处理完成任务时出错: {e}")
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        return finished
+
+    @staticmethod
+    def _feed(jobs, inbox, workers):
+        try:
+            for job in jobs:
+                inbox.put(job)
+        finally:
+            for _ in range(workers):
+                inbox.put(_STOP)
+
+    def _notify(self, stage_name, job, error=None):
+        if self.listener is None:
+            return
+        try:
+            self.listener(stage_name, job, error)
+        except Exception as e:
+            print(f"记录阶段 {stage_name} 状态时出错: {e}")
+
+    def _worker(self, stage, inbox, outbox, results, remaining, lock, next_workers):
+        is_stopped = False
+        while not is_stopped:
+            batch, is_stopped = self._collect(stage, inbox, outbox)
+            if batch:
+                self._process(stage, batch, outbox, results)
+
+        # 本阶段最后一个退出的线程负责通知下游阶段结束
+        with lock:
+            remaining[0] -= 1
+            is_last = remaining[0] == 0
+        if is_last:
+            for _ in range(next_workers):
+                outbox.put(_STOP)
+
+    @staticmethod
+    def _collect(stage, inbox, outbox):
+        """从队列中取出最多 batch_size 个任务，需要跳过本阶段的任务直接交给下游
+
+        Returns:
+            tuple: (任务列表, 是否已收到结束信号)
+        """
+        batch = []
+        deadline = None
+        while len(batch) < stage.batch_size:
+            try:
+                if deadline is None:
+                    job = inbox.get()
+                else:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    job = inbox.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if job is _STOP:
+                return batch, True
+            if stage.name in job.get("skip_stages", ()):
+                outbox.put(job)
+                continue
+
+            batch.append(job)
+            if deadline is None:
+                deadline = time.monotonic() + stage.batch_wait
+
+        return batch, False
+
+    def _process(self, stage, batch, outbox, results):
+        """执行阶段处理函数，成功的任务交给下游，失败的任务直接进入结果队列
+
+        处理函数可以将单个任务的 success 设为 False 来表示该任务失败。
+        """
+        try:
+            if stage.batch_size > 1:
+                processed = stage.func(batch)
+            else:
+                processed = [stage.func(batch[0])]
+        except Exception as e:
+            for job in batch:
+                job["success"] = False
+                job["error"] = str(e)
+                job["failed_stage"] = stage.name
+                job["traceback"] = traceback.format_exc()
+                self._notify(stage.name, job, str(e))
+                results.put(job)
+            return
+
+        for job in processed:
+            if job.get("success") is False:
+                job.setdefault("failed_stage", stage.name)
+                self._notify(stage.name, job, job.get("error", ""))
+                results.put(job)
+            else:
+                self._notify(stage.name, job)
+                outbox.put(job)
@@ -0,0 +1,33 @@
+import json
+
+# 各模型每百万 token 的价格（美元），可用 --price-file 指定的 JSON 文件覆盖或补充
+# 价格随服务商调整，结算前请以服务商公布的价格为准
+DEFAULT_PRICES = {
+    "google/gemini-2.5-pro-preview": {"input": 1.25, "output": 10.0},
+    "Qwen/Qwen3-235B-A22B": {"input": 0.35, "output": 1.42},
+}
+
+
+def load_prices(path=None):
+    """返回价格表，path 指定的 JSON 文件中的条目覆盖默认价格
+
+    文件格式与 DEFAULT_PRICES 相同：{"模型名称": {"input": 输入单价, "output": 输出单价}}，
+    单价为每百万 token 的价格。
+
+    Returns:
+        dict: 模型名称到价格的映射
+    """
+    prices = {model: dict(price) for model, price in DEFAULT_PRICES.items()}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for model, price in json.load(f).items():
+                prices[model] = {"input": float(price.get("input", 0)), "output": float(price.get("output", 0))}
+    return prices
+
+
+def usage_cost(prices, model, prompt_tokens, completion_tokens):
+    """按价格表计算一次请求的费用，价格表中没有该模型时返回 None"""
+    price = prices.get(model)
+    if price is None:
+        return None
+    return (prompt_tokens * price["input"] + completion_tokens * price["output"]) / 1_000_000
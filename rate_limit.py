@@ -0,0 +1,239 @@
+import asyncio
+import contextlib
+import email.utils
+import random
+import threading
+import time
+
+from metrics import recorder as metrics, timed
+
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+POLL_INTERVAL = 0.05
+
+
+def retryable_errors():
+    """返回可以重试的错误类型：限流、连接失败、超时和服务端错误
+
+    openai 导入较慢，只在请求出错时才导入；此时客户端已经创建，模块已在内存中。
+    """
+    import openai
+    return (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+
+
+def is_rate_limit_error(error):
+    """判断错误是否为 429 限流响应"""
+    import openai
+    return isinstance(error, openai.RateLimitError)
+
+
+class RateLimiter:
+    """令牌桶限速与自适应并发控制
+
+    rate 限制每秒发出的请求数，并发上限在收到限流响应时减半，
+    之后每连续成功一轮再逐步恢复，直到 max_concurrency。
+    收到 Retry-After 时，所有调用方都会暂停到指定时间之后。
+    同一实例可同时用于线程和 asyncio。
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=8, max_retries=MAX_RETRIES, min_concurrency=1):
+        """
+        Args:
+            rate: 每秒允许的请求数，None 表示不限速
+            burst: 令牌桶容量，默认为 max(1, rate)
+            max_concurrency: 并发请求数上限
+            max_retries: 可重试错误的最大重试次数
+            min_concurrency: 限流时并发数最低降到的值
+        """
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.min_concurrency = max(1, min_concurrency)
+        self.configure(rate, burst, max_concurrency, max_retries)
+
+    def configure(self, rate=None, burst=None, max_concurrency=8, max_retries=MAX_RETRIES):
+        """重新设置限速参数"""
+        with self._lock:
+            self.rate = rate
+            self.max_retries = max_retries
+            self.burst = burst or max(1, rate or 1)
+            self.max_concurrency = max(self.min_concurrency, max_concurrency)
+            self.concurrency = self.max_concurrency
+            self._tokens = self.burst
+            self._updated = time.monotonic()
+            self._successes = 0
+            self._paused_until = 0.0
+
+    def _try_acquire(self):
+        """尝试占用一个请求名额，成功返回0，否则返回建议等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._in_flight >= self.concurrency:
+                return POLL_INTERVAL
+
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.rate
+                self._tokens -= 1
+
+            self._in_flight += 1
+            return 0
+
+    def acquire(self):
+        """阻塞直到获得请求名额"""
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """acquire 的异步版本"""
+        while True:
+            wait = self._try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, throttled=False, retry_after=None):
+        """归还请求名额，并根据请求结果调整并发上限
+
+        Args:
+            throttled: 请求是否被限流
+            retry_after: 服务端要求的等待秒数
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if throttled:
+                self._successes = 0
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                if retry_after:
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                return
+
+            self._successes += 1
+            if self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._successes = 0
+
+
+def get_retry_after(error):
+    """从错误响应头中解析 Retry-After 秒数，没有时返回 None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_date.timestamp() - time.time())
+
+
+def backoff_delay(attempt, retry_after=None):
+    """计算第 attempt 次重试前的等待秒数（指数退避加随机抖动）"""
+    delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def timed_attempt(stage, suffix="", **fields):
+    """stage 不为 None 时返回记录 stage + suffix 耗时的上下文，否则不计时"""
+    if stage is None:
+        return contextlib.nullcontext()
+    return timed(stage + suffix, **fields)
+
+
+def call_with_retry(func, limiter, label="请求", stage=None, **fields):
+    """在限速器控制下调用 func，可重试的错误按指数退避重试，最多重试 limiter.max_retries 次
+
+    提供 stage 时分别计时：每次调用 func 记为 stage（fields 为附加字段），等待限速器名额
+    记为 stage_wait，重试前的退避等待记为 stage_backoff，请求耗时不含排队和退避。
+
+    Args:
+        func: 无参数的调用函数
+        limiter: RateLimiter 实例
+        label: 日志中显示的请求名称
+        stage: 计时使用的阶段名称，为 None 时不计时
+
+    Returns:
+        func 的返回值
+    """
+    max_retries = limiter.max_retries
+    for attempt in range(max_retries + 1):
+        with timed_attempt(stage, "_wait"):
+            limiter.acquire()
+        try:
+            with timed_attempt(stage, **fields):
+                result = func()
+        except retryable_errors() as e:
+            retry_after = get_retry_after(e)
+            limiter.release(is_rate_limit_error(e), retry_after)
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt, retry_after)
+            metrics.record_retry(type(e).__name__, stage)
+            print(f"{label}失败（{type(e).__name__}），{delay:.1f} 秒后进行第 {attempt + 1} 次重试")
+            with timed_attempt(stage, "_backoff"):
+                time.sleep(delay)
+            continue
+        except BaseException:
+            limiter.release()
+            raise
+
+        limiter.release()
+        return result
+
+
+async def call_with_retry_async(func, limiter, label="请求", stage=None, **fields):
+    """call_with_retry 的异步版本，func 为返回协程的无参数函数"""
+    max_retries = limiter.max_retries
+    for attempt in range(max_retries + 1):
+        with timed_attempt(stage, "_wait"):
+            await limiter.acquire_async()
+        try:
+            with timed_attempt(stage, **fields):
+                result = await func()
+        except retryable_errors() as e:
+            retry_after = get_retry_after(e)
+            limiter.release(is_rate_limit_error(e), retry_after)
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt, retry_after)
+            metrics.record_retry(type(e).__name__, stage)
+            print(f"{label}失败（{type(e).__name__}），{delay:.1f} 秒后进行第 {attempt + 1} 次重试")
+            with timed_attempt(stage, "_backoff"):
+                await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            limiter.release()
+            raise
+
+        limiter.release()
+        return result
@@ -1,113 +1,69 @@
-from openai import OpenAI
+import asyncio
+import json
 import os
-from dotenv import load_dotenv
+import re
+import threading
+from async_http import get_http_client
+from batch_api import build_request_line
+from metrics import recorder as metrics
+from rate_limit import RateLimiter, call_with_retry, call_with_retry_async
+from streaming import collect_stream, collect_stream_async, partial_path, remove_partial
 
-# 加载.env文件中的环境变量
-load_dotenv()
+# 客户端在第一次请求时才创建，openai 导入较慢，--help 和不需要请求的命令无需等待
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+rate_limiter = RateLimiter()
 
-# 从环境变量获取API密钥和基础URL
-# api_key = os.getenv("OPENROUTER_API_KEY")
-api_key = os.getenv("SILICONFLOW_API_KEY")
-if not api_key:
-    raise ValueError("OPENROUTER_API_KEY 未在环境变量中设置")
 
-# base_url = os.getenv("OPENROUTER_BASE_URL")
-base_url = os.getenv("SILICONFLOW_BASE_URL")
-if not base_url:
-    raise ValueError("OPENROUTER_BASE_URL 未在环境变量中设置")
-
-# api_key= os.getenv("OPENAI_API_KEY")
-
-client = OpenAI(
-    base_url=base_url,
-    api_key=api_key,
-)
-
-
-def analyze_text(text_content, prompt):
-    """使用LLM分析文本内容
-
-    Args:
-        text_content: 要分析的文本内容
-        prompt: 提示文本
+def get_api_config():
+    """从环境变量（及.env文件）获取API密钥和基础URL
 
     Returns:
-        str: 分析后的文本内容
-    """
-    content = [
-        {
-            "type": "text",
-            "text": f"{prompt}\n\n{text_content}"
-        }
-    ]
-
-    completion = client.chat.completions.create(
-        # model="google/gemini-2.5-pro-preview",
-        # model="deepseek/deepseek-r1:free",
-        # model="gpt-4o-mini",
-        model="Qwen/Qwen3-235B-A22B",
-        messages=[
-            {
-                "role": "user",
-                "content": content
-            }
-        ]
-    )
+        tuple: (api_key, base_url)
 
-    return completion.choices[0].message.content
-
-
-def read_text_file(file_path):
-    """读取文本文件内容
+    Raises:
+        ValueError: 环境变量未设置时
+    """
+    from dotenv import load_dotenv
 
-    Args:
-        file_path: 文本文件路径
+    # 加载.env文件中的环境变量
+    load_dotenv()
 
-    Returns:
-        str: 文件内容
-    """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return f.read()
+    # api_key = os.getenv("OPENROUTER_API_KEY")
+    api_key = os.getenv("SILICONFLOW_API_KEY")
+    if not api_key:
+        raise ValueError("SILICONFLOW_API_KEY 未在环境变量中设置")
 
+    # base_url = os.getenv("OPENROUTER_BASE_URL")
+    base_url = os.getenv("SILICONFLOW_BASE_URL")
+    if not base_url:
+        raise ValueError("SILICONFLOW_BASE_URL 未在环境变量中设置")
 
-def save_to_markdown(content, output_file, text_content=None):
-    """将内容保存到markdown文件
+    # api_key= os.getenv("OPENAI_API_KEY")
+    return api_key, base_url
 
-    Args:
-        content: 要保存的内容
-        output_file: 输出文件路径
-        text_content: 原文内容，默认为None
-    """
-    # 确保输出目录存在
-    output_dir = os.path.dirname(output_file)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # 如果有原文内容，添加到保存内容中
-    if text_content:
-        final_content = f"{content}\n\n### 原文\n\n{text_content}\n"
-    else:
-        final_content = content
-        
-    # 保存内容到文件
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(final_content)
-    
-    print(f"结果已保存到: {output_file}")
 
+def get_client():
+    """返回同步客户端，第一次调用时导入 openai 并创建"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
 
-def score_and_comment(text_file_path, output_file=None):
-    """对英文作文进行点评和评分
+            api_key, base_url = get_api_config()
+            # 重试由 rate_limiter 统一控制，关闭客户端自带的重试
+            _client = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                max_retries=0,
+            )
+    return _client
 
-    Args:
-        text_file_path: 文本文件路径
-        output_file: 输出文件路径，默认为None
+SCORE_MODEL = "Qwen/Qwen3-235B-A22B"
 
-    Returns:
-        str: 点评和评分结果
-    """
-    # 评分和点评的提示词
-    prompt = """
+# 评分和点评的提示词
+SCORE_RUBRIC = """
     ## 硬性规则
 
     1. **最终输出仅含**“第一部分：评分环节”和“第二部分：详细点评”两大段落。
@@ -179,6 +135,25 @@ def score_and_comment(text_file_path, output_file=None):
 
     ---
 
+"""
+
+SCORE_PROMPT = SCORE_RUBRIC + """    **待批改作文：**
+
+    ```text
+    {{text_content}}
+    ```
+
+    """
+
+# 结构化评分时附加在评分标准之后的说明，JSON结构替代上面规则中的markdown格式要求
+STRUCTURED_SCORE_PROMPT = SCORE_RUBRIC + """    **输出格式说明：**
+
+    不输出markdown，改为输出一个JSON对象，评分和点评内容仍遵守上述规则：
+    - scores：三个评分维度的列表，dimension 为维度名称，score 为得分，max 为该维度满分；
+    - total：总得分；
+    - comments：按 1–5 大项顺序的点评列表，title 为大项名称（如“总体评价”），items 为该项的点评句子；
+    - corrections：语言形式评价中的错误和改正，original 为原文中的错误表达，corrected 为改正后的表达。
+
     **待批改作文：**
 
     ```text
@@ -187,28 +162,543 @@ def score_and_comment(text_file_path, output_file=None):
 
     """
 
+# 结构化评分要求模型返回的 JSON 结构
+STRUCTURED_SCORE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "scores": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "dimension": {"type": "string"},
+                    "score": {"type": "number"},
+                    "max": {"type": "number"},
+                },
+                "required": ["dimension", "score", "max"],
+                "additionalProperties": False,
+            },
+        },
+        "total": {"type": "number"},
+        "comments": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "items": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["title", "items"],
+                "additionalProperties": False,
+            },
+        },
+        "corrections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "original": {"type": "string"},
+                    "corrected": {"type": "string"},
+                },
+                "required": ["original", "corrected"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["scores", "total", "comments", "corrections"],
+    "additionalProperties": False,
+}
+
+STRUCTURED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "score_result", "strict": True, "schema": STRUCTURED_SCORE_SCHEMA},
+}
+
+# 语言形式评价中的错误和改正列在该大项下
+CORRECTIONS_SECTION = "语言形式评价"
+
+# 批量评分时附加在评分标准之后的说明
+SCORE_BATCH_PROMPT = SCORE_RUBRIC + """    **批量批改说明：**
+
+    下面共有 {count} 篇作文，每篇以单独一行“=== 作文 编号 ===”开头。
+    请对每篇作文分别独立完成评分和点评，每篇都严格遵守上述规则和格式；
+    每篇的结果必须以单独一行“=== 结果 编号 ===”开头，编号与作文编号一致，按编号顺序输出，不得遗漏或合并。
+
+    """
+
+BATCH_RESULT_PATTERN = re.compile(r"^\s*=+\s*结果\s*(\d+)\s*=+\s*$", re.MULTILINE)
+
+
+def build_text_messages(text_content, prompt):
+    """构造包含提示文本和待分析文本的消息列表"""
+    content = [
+        {
+            "type": "text",
+            "text": f"{prompt}\n\n{text_content}"
+        }
+    ]
+
+    return [
+        {
+            "role": "user",
+            "content": content
+        }
+    ]
+
+
+def score_prompt(text_content, structured=False):
+    """返回单篇作文评分使用的提示文本"""
+    return (STRUCTURED_SCORE_PROMPT if structured else SCORE_PROMPT).format(text_content=text_content)
+
+
+def score_cache_key(cache, text_content, structured=False):
+    """返回作文评分结果在缓存中的键，与 score_and_comment 使用的键一致"""
+    return cache.make_key(text_content, score_prompt(text_content, structured), SCORE_MODEL)
+
+
+def build_batch_request(custom_id, text_content, structured=False):
+    """构造单篇作文评分的批处理请求行，structured 为True时要求返回JSON结构"""
+    options = {"response_format": STRUCTURED_RESPONSE_FORMAT} if structured else {}
+    messages = build_text_messages(text_content, score_prompt(text_content, structured))
+    return build_request_line(custom_id, SCORE_MODEL, messages, **options)
+
+
+def parse_score_result(content):
+    """将结构化评分的返回内容解析为评分结果
+
+    Args:
+        content: 模型返回的JSON文本，可能包在代码块中
+
+    Returns:
+        dict: {"scores", "total", "comments", "corrections"}，内容不是有效的评分JSON时返回 None
+    """
+    text = (content or "").strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    try:
+        data = json.loads(fenced.group(1) if fenced else text)
+    except ValueError:
+        return None
+
+    if not isinstance(data, dict) or not isinstance(data.get("scores"), list) or not data["scores"]:
+        return None
+    try:
+        scores = [
+            {"dimension": str(item["dimension"]), "score": item["score"], "max": item["max"]}
+            for item in data["scores"]
+        ]
+        comments = [
+            {"title": str(item["title"]), "items": [str(line) for line in item.get("items") or []]}
+            for item in data.get("comments") or []
+        ]
+        corrections = [
+            {"original": str(item["original"]), "corrected": str(item["corrected"])}
+            for item in data.get("corrections") or []
+        ]
+    except (KeyError, TypeError):
+        return None
+
+    total = data.get("total")
+    if not isinstance(total, (int, float)):
+        total = sum(item["score"] for item in scores)
+    return {"scores": scores, "total": total, "comments": comments, "corrections": corrections}
+
+
+def format_correction(correction):
+    """返回一条错误和改正的文字"""
+    return f"“{correction['original']}” → 应为 “{correction['corrected']}”"
+
+
+def score_to_markdown(score):
+    """将结构化评分结果整理为与普通评分输出相同格式的markdown"""
+    lines = ["### 一：评分环节", ""]
+    lines += [f"- {item['dimension']}：{item['score']:g}" for item in score["scores"]]
+    lines += [f"- **总得分：{score['total']:g}**", "", "### 二：详细点评", ""]
+
+    corrections_written = False
+    for index, section in enumerate(score["comments"], 1):
+        lines += [f"{index}. **{section['title']}**", ""]
+        lines += [f"- {item}" for item in section["items"]] or ["- 无"]
+        if section["title"] == CORRECTIONS_SECTION and score["corrections"]:
+            lines += [f"- {format_correction(correction)}" for correction in score["corrections"]]
+            corrections_written = True
+        lines.append("")
+
+    if score["corrections"] and not corrections_written:
+        lines += [f"**{CORRECTIONS_SECTION}**", ""]
+        lines += [f"- {format_correction(correction)}" for correction in score["corrections"]]
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def score_json_path(output_file):
+    """返回与评分markdown文件同名的JSON文件路径"""
+    return os.path.splitext(output_file)[0] + ".json"
+
+
+def save_score_json(score, output_file):
+    """将结构化评分结果保存为与 output_file 同名的JSON文件，返回保存路径"""
+    json_path = score_json_path(output_file)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(score, f, ensure_ascii=False, indent=2)
+    return json_path
+
+
+def load_score_json(output_file):
+    """读取与 output_file 同名的结构化评分结果，不存在时返回 None"""
+    json_path = score_json_path(output_file)
+    if not os.path.exists(json_path):
+        return None
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def analyze_text(text_content, prompt, cache=None, stream_path=None, response_format=None):
+    """使用LLM分析文本内容
+
+    Args:
+        text_content: 要分析的文本内容
+        prompt: 提示文本
+        cache: ResultCache 实例，命中时直接返回缓存结果，默认为None（不使用缓存）
+        stream_path: 提供时以流式方式请求，并将收到的内容实时写入该文件
+        response_format: 请求的 response_format 参数，为None时不指定
+
+    Returns:
+        str: 分析后的文本内容
+    """
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(text_content, prompt, SCORE_MODEL)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    messages = build_text_messages(text_content, prompt)
+    options = {"response_format": response_format} if response_format else {}
+    # 可选模型: "google/gemini-2.5-pro-preview", "deepseek/deepseek-r1:free", "gpt-4o-mini"
+    # 客户端在计时之外创建，阶段耗时只包含API调用，排队和重试等待另行记录
+    client = get_client()
+
+    def request():
+        if stream_path:
+            stream = client.chat.completions.create(
+                model=SCORE_MODEL, messages=messages, stream=True, stream_options={"include_usage": True}, **options
+            )
+            return collect_stream(stream, stream_path, SCORE_MODEL)
+        completion = client.chat.completions.create(model=SCORE_MODEL, messages=messages, **options)
+        metrics.record_usage(completion.usage, SCORE_MODEL)
+        return completion.choices[0].message.content
+
+    result = call_with_retry(request, rate_limiter, "评分请求", "score_request")
+
+    if cache is not None and result:
+        cache.set(cache_key, result)
+    return result
+
+
+def get_async_client():
+    """返回使用共享连接池的异步客户端，需在事件循环内调用"""
+    global _async_client
+    http_client = get_http_client()
+    if _async_client is None or _async_client[0] is not http_client:
+        from openai import AsyncOpenAI
+
+        api_key, base_url = get_api_config()
+        _async_client = (http_client, AsyncOpenAI(
+            base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0
+        ))
+    return _async_client[1]
+
+
+async def analyze_text_async(text_content, prompt, cache=None, stream_path=None, response_format=None):
+    """analyze_text 的异步版本，参数和返回值相同"""
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(text_content, prompt, SCORE_MODEL)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    messages = build_text_messages(text_content, prompt)
+    options = {"response_format": response_format} if response_format else {}
+    async_client = get_async_client()
+
+    async def request():
+        if stream_path:
+            stream = await async_client.chat.completions.create(
+                model=SCORE_MODEL, messages=messages, stream=True, stream_options={"include_usage": True}, **options
+            )
+            return await collect_stream_async(stream, stream_path, SCORE_MODEL)
+        completion = await async_client.chat.completions.create(model=SCORE_MODEL, messages=messages, **options)
+        metrics.record_usage(completion.usage, SCORE_MODEL)
+        return completion.choices[0].message.content
+
+    result = await call_with_retry_async(request, rate_limiter, "评分请求", "score_request")
+
+    if cache is not None and result:
+        cache.set(cache_key, result)
+    return result
+
+
+def read_text_file(file_path):
+    """读取文本文件内容
+
+    Args:
+        file_path: 文本文件路径
+
+    Returns:
+        str: 文件内容
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def save_to_markdown(content, output_file, text_content=None):
+    """将内容保存到markdown文件
+
+    Args:
+        content: 要保存的内容
+        output_file: 输出文件路径
+        text_content: 原文内容，默认为None
+    """
+    # 确保输出目录存在
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # 如果有原文内容，添加到保存内容中
+    if text_content:
+        final_content = f"{content}\n\n### 原文\n\n{text_content}\n"
+    else:
+        final_content = content
+        
+    # 保存内容到文件
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(final_content)
+    
+    print(f"结果已保存到: {output_file}")
+
+
+def score_and_comment(text_file_path, output_file=None, cache=None, raise_errors=False, stream=False):
+    """对英文作文进行点评和评分
+
+    Args:
+        text_file_path: 文本文件路径
+        output_file: 输出文件路径，默认为None
+        cache: 评分结果缓存，默认为None（不使用缓存）
+        raise_errors: 出错时是否抛出异常，默认为False（返回错误信息）
+        stream: 是否以流式方式请求，接收过程中实时写入输出文件旁的 .part 文件
+
+    Returns:
+        str: 点评和评分结果
+    """
+
     try:
         # 读取文本文件内容
         text_content = read_text_file(text_file_path)
         
         # 使用format方法格式化prompt
-        formatted_prompt = prompt.format(text_content=text_content)
+        formatted_prompt = SCORE_PROMPT.format(text_content=text_content)
 
         # 使用LLM分析文本内容
-        result = analyze_text(text_content, formatted_prompt)
+        stream_path = partial_path(output_file) if stream and output_file else None
+        result = analyze_text(text_content, formatted_prompt, cache, stream_path)
         
         # 如果指定了输出文件，则保存结果
         if output_file:
             save_to_markdown(result, output_file, text_content)
+        remove_partial(stream_path)
+
+        return result
+
+    except Exception as e:
+        if raise_errors:
+            raise
+        error_message = f"处理文件时出错: {e}"
+        print(error_message)
+        return error_message
+
+
+async def score_and_comment_async(text_file_path, output_file=None, cache=None, raise_errors=False, stream=False):
+    """score_and_comment 的异步版本，参数和返回值相同"""
+    try:
+        text_content = await asyncio.to_thread(read_text_file, text_file_path)
+        formatted_prompt = SCORE_PROMPT.format(text_content=text_content)
+
+        stream_path = partial_path(output_file) if stream and output_file else None
+        result = await analyze_text_async(text_content, formatted_prompt, cache, stream_path)
+
+        if output_file:
+            await asyncio.to_thread(save_to_markdown, result, output_file, text_content)
+        remove_partial(stream_path)
 
         return result
 
     except Exception as e:
+        if raise_errors:
+            raise
         error_message = f"处理文件时出错: {e}"
         print(error_message)
         return error_message
 
 
+def save_structured_result(result, output_file, text_content):
+    """解析结构化评分的返回内容并保存
+
+    解析成功时保存由结构化结果生成的markdown和同名JSON文件；
+    返回内容不是有效的评分JSON时，按普通评分结果原样保存markdown。
+
+    Returns:
+        tuple: (结构化评分结果，解析失败时为None, markdown 内容)
+    """
+    score = parse_score_result(result)
+    if score is None:
+        print(f"{output_file or '评分结果'} 不是有效的结构化评分，按markdown保存")
+    else:
+        result = score_to_markdown(score)
+    if output_file:
+        save_to_markdown(result, output_file, text_content)
+        if score is not None:
+            save_score_json(score, output_file)
+    return score, result
+
+
+def score_and_comment_structured(text_file_path, output_file=None, cache=None, stream=False):
+    """对英文作文评分并返回结构化结果
+
+    请求通过 response_format 要求模型返回JSON，结果同时保存为markdown和同名的JSON文件。
+
+    Args:
+        text_file_path: 文本文件路径
+        output_file: 输出markdown文件路径，默认为None（不保存）
+        cache: 评分结果缓存，默认为None（不使用缓存）
+        stream: 是否以流式方式请求，接收过程中实时写入输出文件旁的 .part 文件
+
+    Returns:
+        tuple: (结构化评分结果，解析失败时为None, markdown 内容)
+    """
+    text_content = read_text_file(text_file_path)
+    stream_path = partial_path(output_file) if stream and output_file else None
+    result = analyze_text(
+        text_content, score_prompt(text_content, True), cache, stream_path, STRUCTURED_RESPONSE_FORMAT
+    )
+    outcome = save_structured_result(result, output_file, text_content)
+    remove_partial(stream_path)
+    return outcome
+
+
+async def score_and_comment_structured_async(text_file_path, output_file=None, cache=None, stream=False):
+    """score_and_comment_structured 的异步版本，参数和返回值相同"""
+    text_content = await asyncio.to_thread(read_text_file, text_file_path)
+    stream_path = partial_path(output_file) if stream and output_file else None
+    result = await analyze_text_async(
+        text_content, score_prompt(text_content, True), cache, stream_path, STRUCTURED_RESPONSE_FORMAT
+    )
+    outcome = await asyncio.to_thread(save_structured_result, result, output_file, text_content)
+    remove_partial(stream_path)
+    return outcome
+
+
+def build_batch_content(text_contents):
+    """将多篇作文拼接为批量评分的待分析文本，编号从1开始"""
+    return "\n\n".join(
+        f"=== 作文 {index} ===\n{text_content.strip()}"
+        for index, text_content in enumerate(text_contents, 1)
+    )
+
+
+def parse_batch_result(result):
+    """按“=== 结果 编号 ===”分隔符拆分批量评分结果
+
+    Returns:
+        dict: 编号到该篇评分结果的映射，缺少总得分的段落视为解析失败而不包含在内
+    """
+    sections = {}
+    parts = BATCH_RESULT_PATTERN.split(result or "")
+    # split 结果为 [前导文字, 编号1, 内容1, 编号2, 内容2, ...]
+    for number, section in zip(parts[1::2], parts[2::2]):
+        section = section.strip()
+        if section and "总得分" in section:
+            sections.setdefault(int(number), section)
+    return sections
+
+
+def score_texts_batch(text_contents, cache=None):
+    """在一次请求中对多篇作文评分
+
+    已在缓存中的作文不会重复发送；解析成功的结果按单篇评分的缓存键写入缓存，
+    与 score_and_comment 共用同一份缓存。
+
+    Args:
+        text_contents: 作文文本列表
+        cache: 评分结果缓存，默认为None（不使用缓存）
+
+    Returns:
+        list: 与输入一一对应的评分结果，解析失败的位置为 None
+    """
+    results = [None] * len(text_contents)
+    cache_keys = [None] * len(text_contents)
+    pending = []
+
+    for index, text_content in enumerate(text_contents):
+        if cache is not None:
+            cache_keys[index] = score_cache_key(cache, text_content)
+            results[index] = cache.get(cache_keys[index])
+        if results[index] is None:
+            pending.append(index)
+
+    if not pending:
+        return results
+
+    batch_prompt = SCORE_BATCH_PROMPT.format(count=len(pending))
+    try:
+        response = analyze_text(build_batch_content([text_contents[i] for i in pending]), batch_prompt)
+    except Exception as e:
+        print(f"批量评分请求失败: {e}")
+        return results
+
+    sections = parse_batch_result(response)
+    for number, index in enumerate(pending, 1):
+        section = sections.get(number)
+        if section is None:
+            continue
+        results[index] = section
+        if cache is not None:
+            cache.set(cache_keys[index], section)
+
+    return results
+
+
+def score_and_comment_batch(text_file_paths, output_files, cache=None):
+    """对多篇英文作文批量点评和评分，批量结果中解析失败的作文改为单独评分
+
+    Args:
+        text_file_paths: 文本文件路径列表
+        output_files: 与文本文件对应的输出文件路径列表，元素为None时不保存
+        cache: 评分结果缓存，默认为None（不使用缓存）
+
+    Returns:
+        list: 每篇作文的处理结果，格式为 {"success": bool, "data": 评分结果, "error": 错误信息}
+    """
+    text_contents = [read_text_file(path) for path in text_file_paths]
+    results = score_texts_batch(text_contents, cache)
+
+    outcomes = []
+    for text_file_path, output_file, text_content, result in zip(text_file_paths, output_files, text_contents, results):
+        try:
+            if result is None:
+                print(f"{text_file_path} 的批量评分结果解析失败，改为单独评分")
+                formatted_prompt = SCORE_PROMPT.format(text_content=text_content)
+                result = analyze_text(text_content, formatted_prompt, cache)
+
+            if output_file:
+                save_to_markdown(result, output_file, text_content)
+            outcomes.append({"success": True, "data": result, "error": None})
+
+        except Exception as e:
+            outcomes.append({"success": False, "data": None, "error": f"处理文件时出错: {e}"})
+
+    return outcomes
+
+
 if __name__ == "__main__":
     # 直接设置文本文件路径变量
     text_file_path = "output/扫描双面_page_1_text.txt"  # 在这里直接修改文件路径
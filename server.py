@@ -0,0 +1,486 @@
+import collections
+import copy
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from main import build_arg_parser, setup_services, report_cache_stats, validate_args
+from main import build_pipeline, make_page_job, open_document, iter_page_jobs
+from metrics import recorder as metrics
+from pdf_to_txt import read_image_bytes
+from score_and_comment import read_text_file
+
+# 上传内容的 MIME 类型及保存时使用的扩展名
+UPLOAD_TYPES = {
+    "application/pdf": ".pdf",
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+}
+
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+MAX_FINISHED_JOBS = 1000
+# 上传任务结束后的状态：skipped 表示有页面组因超出预算未处理，其余页面组均已成功
+FINISHED_STATUSES = ("done", "failed", "skipped")
+RETRY_AFTER_SECONDS = 5
+
+# 各阶段完成后在事件中附带的结果字段
+STAGE_RESULTS = {
+    "ocr": ("text", "text_path"),
+    "score": ("score", "score_path"),
+}
+
+
+class QueueFullError(Exception):
+    """等待处理的任务已达上限"""
+
+
+class BudgetExceededError(Exception):
+    """已超出 --max-cost 或 --max-tokens，不再接受新的任务"""
+
+
+class UploadedImage:
+    """上传的图片，提供页面任务需要的文件信息；图片直接交给OCR，不经过渲染"""
+
+    def __init__(self, image_path):
+        self.pdf_path = image_path
+        self.base_filename = os.path.splitext(os.path.basename(image_path))[0]
+
+    def close(self):
+        pass
+
+
+class GradingService:
+    """常驻的批改服务
+
+    所有上传任务的页面进入同一条流水线，API客户端、限速器和缓存在请求之间保持不变。
+    等待处理的上传任务超过 max_queue 时拒绝新的任务，由客户端稍后重试。
+    """
+
+    def __init__(self, args, max_queue=16):
+        """
+        Args:
+            args: 由 build_arg_parser 解析并经过 setup_services 的参数
+            max_queue: 等待进入流水线的上传任务数上限
+        """
+        self.args = args
+        self.jobs_dir = os.path.join(args.output, "jobs")
+        self.jobs = collections.OrderedDict()
+        self._pending = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pipeline = build_pipeline(args, listener=self._on_stage)
+        self._thread = threading.Thread(target=self._run, name="grading-pipeline", daemon=True)
+        self._thread.start()
+
+    def submit(self, data, content_type, start=None, end=None):
+        """保存上传内容并加入队列
+
+        Args:
+            data: 上传的PDF或图片字节
+            content_type: 上传内容的 MIME 类型
+            start: PDF的起始页码
+            end: PDF的结束页码
+
+        Returns:
+            dict: 任务状态
+        """
+        extension = UPLOAD_TYPES.get(content_type)
+        if extension is None:
+            raise ValueError(f"不支持的上传类型: {content_type}")
+        reason = metrics.budget_exceeded()
+        if reason:
+            raise BudgetExceededError(f"{reason}，不再接受新的任务")
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        upload_path = os.path.join(job_dir, f"upload{extension}")
+        with open(upload_path, "wb") as f:
+            f.write(data)
+
+        if extension == ".pdf":
+            document = self._open_pdf(upload_path, job_dir, start, end)
+        else:
+            document = self._open_image(upload_path, job_dir, content_type)
+
+        record = {
+            "job_id": job_id,
+            "status": "queued",
+            "created": time.time(),
+            "document": document,
+            "pages": {page_num: {"page_number": page_num, "status": "queued"} for page_num in document["page_numbers"]},
+            "remaining": len(document["page_numbers"]),
+            "events": [],
+        }
+        with self._lock:
+            self.jobs[job_id] = record
+            self._trim_finished()
+
+        try:
+            self._pending.put_nowait(job_id)
+        except queue.Full:
+            with self._lock:
+                del self.jobs[job_id]
+            document["renderer"].close()
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise QueueFullError("等待处理的任务过多，请稍后重试")
+
+        return self.status(job_id)
+
+    def _open_pdf(self, pdf_path, job_dir, start, end):
+        doc_args = copy.copy(self.args)
+        doc_args.start = start or 1
+        doc_args.end = end
+        document = open_document(doc_args, pdf_path, job_dir)
+        if document is None:
+            raise ValueError("无法读取PDF或页码范围无效")
+        return document
+
+    def _open_image(self, image_path, job_dir, content_type):
+        # 校验图片并按需压缩，失败时直接返回错误
+        try:
+            from PIL import Image
+
+            with Image.open(image_path) as image:
+                image.load()
+                if self.args.preprocessor is not None:
+                    image_bytes = self.args.preprocessor.process(image)
+                    content_type = self.args.preprocessor.mime_type
+                else:
+                    image_bytes = read_image_bytes(image_path)
+        except Exception as e:
+            raise ValueError(f"无法读取图片: {e}")
+
+        doc_args = copy.copy(self.args)
+        doc_args.output = job_dir
+        return {
+            "renderer": UploadedImage(image_path),
+            "args": doc_args,
+            "page_numbers": [1],
+            "image": (image_bytes, content_type),
+        }
+
+    def _iter_jobs(self):
+        """从等待队列中取出上传任务，生成其页面任务交给流水线"""
+        while True:
+            job_id = self._pending.get()
+            with self._lock:
+                record = self.jobs.get(job_id)
+                if record is None:
+                    continue
+                record["status"] = "running"
+                self._changed.notify_all()
+
+            document = record["document"]
+            if "image" not in document:
+                for job in iter_page_jobs(document["renderer"], document["args"], document["page_numbers"]):
+                    job["service_job_id"] = job_id
+                    yield job
+                continue
+
+            args = document["args"]
+            job = make_page_job(
+                document["renderer"],
+                1,
+                None,
+                args.output,
+                False,
+                args.prompt,
+                1,
+                args.ocr_cache,
+                args.score_cache,
+                False,
+                None,
+                False,
+                args.structured_ocr,
+                args.structured_score,
+                args.page_triage
+            )
+            job["image_bytes"], job["mime_type"] = document.pop("image")
+            job["image_path"] = document["renderer"].pdf_path
+            job["skip_stages"] = {"render"}
+            job["service_job_id"] = job_id
+            yield job
+
+    def _run(self):
+        self._pipeline.run(self._iter_jobs(), self._on_result)
+
+    def _add_event(self, record, event):
+        record["events"].append(event)
+        self._changed.notify_all()
+
+    def _on_stage(self, stage_name, job, error=None):
+        """流水线每个阶段完成或失败后记录事件，OCR和评分完成时附带结果文本"""
+        event = {"page_number": job["page_number"], "stage": stage_name, "status": "failed" if error else "done"}
+        if job.get("budget_skipped") and not error:
+            event["status"] = "skipped"
+            event["reason"] = job["budget_skipped"]
+        if error:
+            event["error"] = error
+        elif stage_name == "triage" and job.get("triage"):
+            event["triage"] = job["triage"]
+        elif stage_name in STAGE_RESULTS:
+            field, path_field = STAGE_RESULTS[stage_name]
+            event[field] = read_text_file(job[path_field])
+            if stage_name == "ocr" and job.get("student_name") is not None:
+                event["name"] = job["student_name"]
+            if stage_name == "score" and job.get("score"):
+                event["result"] = job["score"]
+
+        with self._lock:
+            record = self.jobs.get(job["service_job_id"])
+            if record is None:
+                return
+            record["pages"][job["page_number"]]["status"] = stage_name
+            self._add_event(record, event)
+
+    def _on_result(self, job):
+        """页面任务结束后更新状态，所有页面结束时标记上传任务完成"""
+        with self._lock:
+            record = self.jobs.get(job["service_job_id"])
+            if record is None:
+                return
+
+            page = record["pages"][job["page_number"]]
+            page["success"] = job.get("success", False)
+            if job.get("budget_skipped"):
+                # 超出预算时尚未发出请求的页面组，不计为失败
+                page["status"] = "skipped"
+                page["reason"] = job["budget_skipped"]
+            else:
+                page["status"] = "done" if page["success"] else "failed"
+            if page["status"] == "failed":
+                page["error"] = job.get("error", "")
+            for field in ("student_name", "text_path", "score_path", "docx_path"):
+                if job.get(field):
+                    page[field] = job[field]
+            # 空白页没有结果文件
+            if job.get("triage", {}).get("decision", "ocr") != "ocr":
+                page["triage"] = job["triage"]["decision"]
+            elif "similar_to" in job.get("triage", {}):
+                page["similar_to"] = job["triage"]["similar_to"]
+
+            record["remaining"] -= 1
+            if record["remaining"] > 0:
+                return
+
+            statuses = {p["status"] for p in record["pages"].values()}
+            record["status"] = "failed" if "failed" in statuses else ("skipped" if "skipped" in statuses else "done")
+            record["finished"] = time.time()
+            record["document"]["renderer"].close()
+            if self.args.page_triage is not None:
+                self.args.page_triage.forget(record["document"]["renderer"].pdf_path)
+            self._add_event(record, {"status": record["status"]})
+
+    def _trim_finished(self):
+        """只保留最近 MAX_FINISHED_JOBS 个已结束任务的状态"""
+        finished = [job_id for job_id, record in self.jobs.items() if record["status"] in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def status(self, job_id):
+        """返回任务状态，任务不存在时返回None"""
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            return {
+                "job_id": job_id,
+                "status": record["status"],
+                "pages": [dict(page) for _, page in sorted(record["pages"].items())],
+            }
+
+    def iter_events(self, job_id, timeout=None):
+        """依次返回任务的事件，任务结束后停止
+
+        Yields:
+            dict: 阶段事件；最后一个事件为任务的最终状态
+        """
+        index = 0
+        while True:
+            with self._lock:
+                record = self.jobs.get(job_id)
+                if record is None:
+                    return
+                while index >= len(record["events"]):
+                    if record["status"] in FINISHED_STATUSES or not self._changed.wait(timeout):
+                        return
+                events = record["events"][index:]
+                index = len(record["events"])
+            yield from events
+
+    def result_path(self, job_id, page_number, field):
+        """返回任务某一页的结果文件路径，不存在时返回None"""
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None or page_number not in record["pages"]:
+                return None
+            return record["pages"][page_number].get(field)
+
+    def health(self):
+        with self._lock:
+            counts = collections.Counter(record["status"] for record in self.jobs.values())
+        return {
+            "status": "ok",
+            "queued": self._pending.qsize(),
+            "jobs": dict(counts),
+            "tokens": metrics.prompt_tokens + metrics.completion_tokens,
+            "cost": round(metrics.cost, 6),
+        }
+
+
+RESULT_FILES = {
+    "text": ("text_path", "text/plain; charset=utf-8"),
+    "score": ("score_path", "text/markdown; charset=utf-8"),
+    "docx": ("docx_path", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """批改服务的HTTP接口
+
+    POST /jobs                        上传PDF或图片（请求体为文件内容），可选参数 start、end；返回任务ID
+    GET  /jobs/<id>                   查询任务状态和各页结果路径
+    GET  /jobs/<id>/events            以 JSON lines 流式返回各阶段结果，任务结束时关闭连接
+    GET  /jobs/<id>/pages/<n>/<kind>  下载某页的 text、score 或 docx 结果
+    GET  /health                      服务状态
+    """
+
+    server_version = "GradingService/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json({"error": message}, status, headers)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self.send_error_json(404, f"未知接口: {url.path}")
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self.send_error_json(400, "请求体为空")
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self.send_error_json(413, "上传文件过大")
+            return
+
+        query = parse_qs(url.query)
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        try:
+            start = int(query["start"][0]) if "start" in query else None
+            end = int(query["end"][0]) if "end" in query else None
+            status = self.service.submit(self.rfile.read(length), content_type, start, end)
+        except QueueFullError as e:
+            self.send_error_json(503, str(e), {"Retry-After": str(RETRY_AFTER_SECONDS)})
+            return
+        except BudgetExceededError as e:
+            self.send_error_json(503, str(e))
+            return
+        except ValueError as e:
+            self.send_error_json(400, str(e))
+            return
+
+        self.send_json(status, 202, {"Location": f"/jobs/{status['job_id']}"})
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/health":
+            self.send_json(self.service.health())
+            return
+
+        match = re.fullmatch(r"/jobs/([0-9a-f]+)(?:/(events)|/pages/(\d+)/(text|score|docx))?", path)
+        if match is None:
+            self.send_error_json(404, f"未知接口: {path}")
+            return
+
+        job_id, events, page_number, kind = match.groups()
+        if self.service.status(job_id) is None:
+            self.send_error_json(404, f"任务不存在: {job_id}")
+        elif events:
+            self.stream_events(job_id)
+        elif kind:
+            self.send_result(job_id, int(page_number), kind)
+        else:
+            self.send_json(self.service.status(job_id))
+
+    def stream_events(self, job_id):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        for event in self.service.iter_events(job_id):
+            self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+    def send_result(self, job_id, page_number, kind):
+        field, content_type = RESULT_FILES[kind]
+        path = self.service.result_path(job_id, page_number, field)
+        if not path or not os.path.isfile(path):
+            self.send_error_json(404, "结果尚未生成")
+            return
+
+        with open(path, "rb") as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = build_arg_parser("PDF OCR批改HTTP服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认为127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口（默认为8000）")
+    parser.add_argument("--max-queue", type=int, default=16, help="等待处理的上传任务上限，超出时返回503（默认为16）")
+    args = parser.parse_args()
+    if args.pdf_paths or args.watch or args.batch_submit or args.batch_collect:
+        parser.error("HTTP服务通过上传接收PDF，不能指定PDF文件、--watch 或批处理模式")
+    validate_args(parser, args)
+
+    os.makedirs(args.output, exist_ok=True)
+    setup_services(args)
+
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    server.daemon_threads = True
+    server.service = GradingService(args, args.max_queue)
+    print(f"批改服务已启动: http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        report_cache_stats(args)
+        metrics.print_summary()
+        metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+
+from metrics import recorder as metrics
+
+PROGRESS_INTERVAL = 200
+
+
+class StreamWriter:
+    """将流式返回的内容实时写入文件并定期打印进度"""
+
+    def __init__(self, output_path):
+        """
+        Args:
+            output_path: 输出文件路径，每次开始接收时清空重写
+        """
+        self.output_path = output_path
+        self.label = os.path.basename(output_path)
+        self.parts = []
+        self.length = 0
+        self.usage = None
+        self._reported = 0
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        self._file = open(output_path, "w", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+
+    def feed(self, chunk):
+        """处理一个流式返回的数据块"""
+        # 请求 include_usage 时，用量在最后一个不含 choices 的数据块中返回
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            return
+
+        self.parts.append(delta)
+        self.length += len(delta)
+        self._file.write(delta)
+        self._file.flush()
+
+        if self.length - self._reported >= PROGRESS_INTERVAL:
+            self._reported = self.length
+            print(f"{self.label}: 已接收 {self.length} 字")
+
+    def text(self):
+        """返回已接收的完整内容"""
+        return "".join(self.parts)
+
+
+def partial_path(output_path):
+    """返回流式输出过程中使用的临时文件路径
+
+    接收中的内容写入该文件，完成后再保存到正式路径，避免中断时留下不完整的正式产物。
+    """
+    return f"{output_path}.part"
+
+
+def remove_partial(path):
+    """删除流式输出的临时文件"""
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def collect_stream(stream, output_path, model=None):
+    """读取完整的流式返回，同时实时写入 output_path
+
+    Args:
+        stream: 流式请求返回的数据块迭代器
+        output_path: 实时写入的文件路径
+        model: 请求使用的模型，用于计算费用
+
+    Returns:
+        str: 拼接后的完整内容，与非流式请求的返回内容一致
+    """
+    with StreamWriter(output_path) as writer:
+        for chunk in stream:
+            writer.feed(chunk)
+    metrics.record_usage(writer.usage, model)
+    return writer.text()
+
+
+async def collect_stream_async(stream, output_path, model=None):
+    """collect_stream 的异步版本"""
+    with StreamWriter(output_path) as writer:
+        async for chunk in stream:
+            writer.feed(chunk)
+    metrics.record_usage(writer.usage, model)
+    return writer.text()
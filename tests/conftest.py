@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import mock_server  # noqa: E402
+import pdf_to_txt  # noqa: E402
+import rate_limit  # noqa: E402
+import score_and_comment  # noqa: E402
+from metrics import recorder as metrics  # noqa: E402
+
+FAKE_PAGE_COUNT = 4
+
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    """在空闲端口启动本地替身服务，并让OCR和评分客户端都连接到该服务
+
+    测试结束后关闭服务，客户端、限速器和用量汇总恢复原状。返回替身服务，
+    可通过 server.state 设置错误和延迟。
+    """
+    server = mock_server.create_server(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    for prefix in ("OPENROUTER", "SILICONFLOW"):
+        monkeypatch.setenv(f"{prefix}_API_KEY", "test")
+        monkeypatch.setenv(f"{prefix}_BASE_URL", base_url)
+    for module in (pdf_to_txt, score_and_comment):
+        monkeypatch.setattr(module, "_client", None)
+        monkeypatch.setattr(module, "_async_client", None)
+        monkeypatch.setattr(module, "rate_limiter", rate_limit.RateLimiter())
+    # 缩短重试前的等待，Retry-After 仍按响应头等待
+    monkeypatch.setattr(rate_limit, "BASE_BACKOFF", 0.01)
+    metrics.reset()
+
+    yield server
+
+    metrics.close()
+    metrics.reset()
+    metrics.set_budget({})
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_pdf(tmp_path, monkeypatch):
+    """返回一个 FAKE_PAGE_COUNT 页的假PDF路径，渲染时不调用 poppler，每页生成一张写有页码的图片"""
+    import pdf2image
+    from PIL import Image, ImageDraw
+
+    def pdfinfo_from_path(pdf_path, *args, **kwargs):
+        return {"Pages": FAKE_PAGE_COUNT}
+
+    def convert_from_path(pdf_path, dpi=200, fmt="png", first_page=1, last_page=FAKE_PAGE_COUNT, output_folder=None, size=None, **kwargs):
+        paths = []
+        for page_number in range(first_page, last_page + 1):
+            image = Image.new("L", (dpi * 2, dpi * 3), 255)
+            ImageDraw.Draw(image).text((dpi // 4, dpi // 4), f"page {page_number}", fill=0)
+            # 与 pdf2image 一致，未指定 output_folder 时返回PIL图片
+            if output_folder is None:
+                if size:
+                    image.thumbnail((size, size))
+                paths.append(image)
+                continue
+            fd, path = tempfile.mkstemp(suffix=f".{fmt}", dir=output_folder)
+            os.close(fd)
+            image.save(path)
+            paths.append(path)
+        return paths
+
+    monkeypatch.setattr(pdf2image, "pdfinfo_from_path", pdfinfo_from_path)
+    monkeypatch.setattr(pdf2image, "convert_from_path", convert_from_path)
+    pdf_path = tmp_path / "essays.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4\n")
+    return str(pdf_path)
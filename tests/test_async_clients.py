@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+import pdf_to_txt
+import score_and_comment
+from async_http import close_http_client
+from metrics import recorder as metrics
+from mock_server import MOCK_OCR_TEXT, MOCK_SCORE_TEXT
+
+IMAGE_BYTES = b"\x89PNG\r\n\x1a\n"
+
+
+def test_async_clients_share_connection_pool(mock_api):
+    async def run():
+        try:
+            results = await asyncio.gather(
+                *(pdf_to_txt.analyze_image_bytes_async(IMAGE_BYTES, f"识别第 {i} 页") for i in range(10)),
+                *(score_and_comment.analyze_text_async(f"作文 {i}", "评分") for i in range(10)),
+            )
+            assert pdf_to_txt._async_client[0] is score_and_comment._async_client[0]
+            return results
+        finally:
+            await close_http_client()
+
+    results = asyncio.run(run())
+
+    assert results[:10] == [MOCK_OCR_TEXT] * 10
+    assert results[10:] == [MOCK_SCORE_TEXT] * 10
+    assert mock_api.state.completion_count == 20
+
+
+def test_retries_rate_limit_and_server_errors(mock_api):
+    mock_api.state.fail_next(429, 500)
+
+    assert pdf_to_txt.analyze_image_bytes(IMAGE_BYTES, "识别") == MOCK_OCR_TEXT
+    assert mock_api.state.completion_count == 3
+    assert metrics.retries == 2
+
+
+def test_async_retry_waits_for_retry_after(mock_api):
+    mock_api.state.retry_after = 0.3
+    mock_api.state.fail_next(429)
+
+    async def run():
+        try:
+            return await score_and_comment.analyze_text_async("作文", "评分")
+        finally:
+            await close_http_client()
+
+    start = time.perf_counter()
+    assert asyncio.run(run()) == MOCK_SCORE_TEXT
+    assert time.perf_counter() - start >= 0.3
+    assert mock_api.state.completion_count == 2
+    assert metrics.retries == 1
+
+
+def test_gives_up_after_max_retries(mock_api):
+    pdf_to_txt.rate_limiter.configure(max_retries=1)
+    mock_api.state.fail_next(429, 429, 429)
+
+    with pytest.raises(openai.RateLimitError):
+        pdf_to_txt.analyze_image_bytes(IMAGE_BYTES, "识别")
+    assert mock_api.state.completion_count == 2
+
+
+def test_request_timing_excludes_retry_backoff(mock_api):
+    mock_api.state.retry_after = 0.3
+    mock_api.state.fail_next(429)
+
+    assert pdf_to_txt.analyze_image_bytes(IMAGE_BYTES, "识别") == MOCK_OCR_TEXT
+    summary = metrics.summary()
+    # 每次尝试记录一次请求耗时，Retry-After 的等待单独记为退避，不计入请求
+    assert summary["ocr_request"]["count"] == 2
+    assert summary["ocr_request"]["p95"] < 0.3
+    assert summary["ocr_request_backoff"]["count"] == 1
+    assert summary["ocr_request_backoff"]["total"] >= 0.3
+    assert summary["ocr_request_wait"]["count"] == 2
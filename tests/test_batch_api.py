@@ -0,0 +1,54 @@
+import contextlib
+import glob
+import json
+import os
+
+import main
+from batch_api import build_request_line, read_batch_results, submit_batch, wait_for_batch
+from conftest import FAKE_PAGE_COUNT
+from mock_server import MOCK_SCORE_TEXT
+from pdf_to_txt import get_client
+
+
+def run_batch_command(pdf_path, output_dir, *flags):
+    """以命令行参数运行一次 --batch-submit 或 --batch-collect"""
+    args = main.build_arg_parser().parse_args([pdf_path, "-o", output_dir, "--no-cache", *flags])
+    main.setup_services(args)
+    with contextlib.ExitStack() as stack:
+        main.process_documents(main.open_documents(stack, args, [pdf_path]), args)
+
+
+def test_submit_and_collect_batch(mock_api, tmp_path):
+    input_path = tmp_path / "input.jsonl"
+    lines = [build_request_line(f"score-{i}", "mock", [{"role": "user", "content": f"作文 {i}"}]) for i in range(3)]
+    input_path.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+
+    client = get_client()
+    batch = submit_batch(client, str(input_path), "测试")
+    assert batch.status == "in_progress"
+
+    batch = wait_for_batch(client, batch.id)
+    assert batch.status == "completed"
+    results, errors = read_batch_results(client, batch)
+    assert results == {f"score-{i}": MOCK_SCORE_TEXT for i in range(3)}
+    assert errors == {}
+
+
+def test_batch_submit_then_collect_writes_outputs(mock_api, fake_pdf, tmp_path):
+    output_dir = str(tmp_path / "output")
+
+    run_batch_command(fake_pdf, output_dir, "--batch-submit")
+    state = main.load_batch_state(output_dir)
+    assert state["phase"] == "ocr"
+    assert len(state["requests"]) == FAKE_PAGE_COUNT
+    assert mock_api.state.completion_count == 0
+
+    # 第一次收取OCR结果并提交评分，第二次收取评分并生成Word文档
+    run_batch_command(fake_pdf, output_dir, "--batch-collect")
+    assert main.load_batch_state(output_dir)["phase"] == "score"
+    run_batch_command(fake_pdf, output_dir, "--batch-collect")
+    assert main.load_batch_state(output_dir) is None
+
+    for suffix in ("text.txt", "score.md", "score_*.docx"):
+        assert len(glob.glob(os.path.join(output_dir, f"essays_page_*_{suffix}"))) == FAKE_PAGE_COUNT
+    assert mock_api.state.completion_count == 0
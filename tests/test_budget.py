@@ -0,0 +1,18 @@
+import contextlib
+
+import main
+
+
+def test_budget_skips_new_groups_and_finishes_started_ones(mock_api, fake_pdf, tmp_path):
+    args = main.build_arg_parser().parse_args([fake_pdf, "-o", str(tmp_path), "--no-cache", "--max-tokens", "1", "--ocr-concurrency", "1"])
+    main.setup_services(args)
+    with contextlib.ExitStack() as stack:
+        documents = main.open_documents(stack, args, [fake_pdf])
+        finished = main.run_pipeline(main.build_pipeline(args), documents)
+
+    started = [job for job in finished if not job.get("budget_skipped")]
+    skipped = [job for job in finished if job.get("budget_skipped")]
+    # 第一组发出请求后即超出预算，该组仍完成评分和Word文档，其余各组跳过而不是失败
+    assert started and skipped
+    assert all(job.get("success") and job.get("docx_path") for job in started)
+    assert all("error" not in job for job in skipped)
@@ -0,0 +1,25 @@
+import pdf2image
+
+from conftest import FAKE_PAGE_COUNT
+from pdf_to_img import PdfRenderer
+
+
+def test_triage_thumbnails_render_once_per_chunk(fake_pdf, tmp_path, monkeypatch):
+    calls = []
+    convert_from_path = pdf2image.convert_from_path
+
+    def counting_convert(pdf_path, *args, **kwargs):
+        calls.append((kwargs.get("first_page"), kwargs.get("last_page"), "size" in kwargs))
+        return convert_from_path(pdf_path, *args, **kwargs)
+
+    monkeypatch.setattr(pdf2image, "convert_from_path", counting_convert)
+
+    with PdfRenderer(fake_pdf, dpi=20, chunk_size=FAKE_PAGE_COUNT) as renderer:
+        results = [
+            renderer.save_group(page_number, chunk, str(tmp_path), keep_image=False, thumbnail_size=64)
+            for page_number, chunk in renderer.iter_groups(range(1, FAKE_PAGE_COUNT + 1))
+        ]
+
+    assert all(result["thumbnail"] is not None for result in results)
+    # 整块渲染一次全分辨率图片、一次缩略图，不为每个页面组单独启动 pdftoppm
+    assert calls == [(1, FAKE_PAGE_COUNT, False), (1, FAKE_PAGE_COUNT, True)]
@@ -0,0 +1,7 @@
+from benchmark import measure_startup
+
+
+def test_import_main_defers_heavy_modules():
+    # 不检查固定的耗时预算（受机器负载影响），只检查 import main 后没有加载
+    # benchmark.DEFERRED_MODULES 中的 openai、pdf2image、PIL、docx、watchdog 等模块
+    assert measure_startup(runs=1)["loaded"] == []
@@ -0,0 +1,164 @@
+import hashlib
+import importlib.util
+import os
+import shutil
+import threading
+import time
+
+SETTLE_SECONDS = 5.0
+POLL_INTERVAL = 2.0
+
+
+def start_observer(watcher):
+    """启动 watchdog 监视，将文件事件转交给 FolderWatcher
+
+    watchdog 只在开始监视时导入，import main 和不使用 --watch 的运行无需加载。
+
+    Returns:
+        已启动的 watchdog Observer
+    """
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+
+    class ChangeHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            path = getattr(event, "dest_path", None) or event.src_path
+            watcher.notify(path)
+
+    observer = Observer()
+    observer.schedule(ChangeHandler(), watcher.watch_dir, recursive=False)
+    observer.start()
+    return observer
+
+
+class FolderWatcher:
+    """监视输入目录中新出现的PDF文件
+
+    安装了 watchdog 时通过系统文件事件（Linux 上为 inotify）得知变化，否则定期扫描目录。
+    文件大小和修改时间在 settle 秒内保持不变后才视为写入完成，避免处理扫描仪尚未写完的文件。
+    只监视目录本身，不包含子目录。
+    """
+
+    def __init__(self, watch_dir, settle=SETTLE_SECONDS, poll_interval=POLL_INTERVAL, use_events=True):
+        """
+        Args:
+            watch_dir: 需要监视的目录
+            settle: 文件保持不变多少秒后才开始处理
+            poll_interval: 扫描目录或检查文件状态的间隔秒数
+            use_events: 是否在可用时使用 watchdog 文件事件
+        """
+        self.watch_dir = watch_dir
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_events = use_events and importlib.util.find_spec("watchdog") is not None
+        self._candidates = {}
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self, path):
+        """记录发生变化的文件"""
+        if not path.lower().endswith(".pdf") or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.watch_dir):
+            return
+        with self._lock:
+            self._candidates.setdefault(os.path.abspath(path), None)
+        self._changed.set()
+
+    def forget(self, path):
+        """文件处理完并移走后调用，之后同名的新文件会被再次处理"""
+        with self._lock:
+            self._seen.discard(os.path.abspath(path))
+
+    def stop(self):
+        """停止监视，iter_ready 在下一次检查时返回"""
+        self._stopped.set()
+        self._changed.set()
+
+    def scan(self):
+        """扫描目录中的全部PDF文件"""
+        for entry in os.scandir(self.watch_dir):
+            if entry.is_file():
+                self.notify(entry.path)
+
+    def _pop_ready(self):
+        """返回已写入完成的文件，并将其移出待检查列表"""
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, last in list(self._candidates.items()):
+                if path in self._seen:
+                    del self._candidates[path]
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del self._candidates[path]
+                    continue
+
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if last is None or last[0] != signature or stat.st_size == 0:
+                    self._candidates[path] = (signature, now)
+                elif now - last[1] >= self.settle:
+                    del self._candidates[path]
+                    self._seen.add(path)
+                    ready.append(path)
+        return sorted(ready)
+
+    def iter_ready(self):
+        """持续返回写入完成的新PDF文件路径，直到调用 stop
+
+        启动时目录中已有的文件也会被处理。
+        """
+        observer = None
+        if self.use_events:
+            observer = start_observer(self)
+            print(f"正在监视 {self.watch_dir}（文件事件）")
+        else:
+            print(f"正在监视 {self.watch_dir}（每 {self.poll_interval:g} 秒扫描一次）")
+
+        try:
+            self.scan()
+            while not self._stopped.is_set():
+                yield from self._pop_ready()
+
+                # 有待确认的文件时需要按间隔复查其大小，否则只在文件事件到来时醒来
+                with self._lock:
+                    has_candidates = bool(self._candidates)
+                timeout = self.poll_interval if has_candidates or observer is None else None
+                self._changed.wait(timeout)
+                self._changed.clear()
+                if observer is None:
+                    self.scan()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+
+def file_digest(path):
+    """返回文件内容的 SHA-256 十六进制摘要"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def move_to_dir(path, target_dir):
+    """将文件移动到目标目录，重名时在文件名后加上序号
+
+    Returns:
+        str: 移动后的路径
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    name, extension = os.path.splitext(os.path.basename(path))
+    target = os.path.join(target_dir, name + extension)
+    index = 1
+    while os.path.exists(target):
+        index += 1
+        target = os.path.join(target_dir, f"{name}_{index}{extension}")
+    shutil.move(path, target)
+    return target